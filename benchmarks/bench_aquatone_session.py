@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+""" Compare peak memory and throughput of json.load against the streaming read_aquatone_session on a generated
+aquatone_session.json.
+
+The session holds --pages pages, each with --headers response headers, and groups every --cluster-size consecutive
+pages into a pageSimilarityCluster.  Peak memory is measured with tracemalloc in a separate run from the timing.
+
+Usage:
+    python benchmarks/bench_aquatone_session.py [--pages 100000] [--headers 12] [--cluster-size 20] [--repeat 3]
+"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).expanduser().resolve().parents[1]))
+
+from pipeline.recon.web.aquatone import read_aquatone_session  # noqa: E402
+
+
+def build_session(location, num_pages, num_headers, cluster_size):
+    urls = [f"https://host{i}.example.com:8443/" for i in range(num_pages)]
+
+    with open(location, "w") as f:
+        f.write('{"version": "1.7.0", "stats": {"startedAt": "2020-04-01T00:00:00Z", "pageCount": %d}, ' % num_pages)
+        f.write('"pages": {')
+
+        for i, url in enumerate(urls):
+            page = {
+                "uuid": f"00000000-0000-0000-0000-{i:012d}",
+                "url": url,
+                "hostname": f"host{i}.example.com",
+                "addrs": [f"10.0.{i // 256 % 256}.{i % 256}"],
+                "status": "200 OK",
+                "pageTitle": f"Welcome to host {i}",
+                "headersPath": f"headers/https__host{i}_example_com__8443__{i:016x}.txt",
+                "bodyPath": f"html/https__host{i}_example_com__8443__{i:016x}.html",
+                "screenshotPath": f"screenshots/https__host{i}_example_com__8443__{i:016x}.png",
+                "hasScreenshot": True,
+                "headers": [
+                    {
+                        "name": f"X-Header-{x}",
+                        "value": f"value {x}",
+                        "decreasesSecurity": False,
+                        "increasesSecurity": False,
+                    }
+                    for x in range(num_headers)
+                ],
+                "tags": [{"text": "nginx", "type": "info", "link": "https://nginx.org", "hash": "0" * 40}],
+                "notes": None,
+            }
+            f.write(f"{',' if i else ''}{json.dumps(url)}: {json.dumps(page)}")
+
+        f.write('}, "pageSimilarityClusters": {')
+
+        for i in range(0, num_pages, cluster_size):
+            f.write(f"{',' if i else ''}\"cluster-{i}\": {json.dumps(urls[i : i + cluster_size])}")
+
+        f.write("}}")
+
+
+def load_pages(location):
+    """ walk the session the way parse_results used to """
+    with open(location) as f:
+        results = json.load(f)
+
+    clusters = {url: x for x, urls in results.get("pageSimilarityClusters").items() for url in urls}
+
+    return sum(1 for _ in results.get("pages").values()), len(clusters)
+
+
+def stream_pages(location):
+    count, clusters = 0, dict()
+
+    with open(location) as f:
+        for kind, item in read_aquatone_session(f):
+            if kind == "page":
+                count += 1
+            else:
+                clusters.update(dict.fromkeys(item[1], item[0]))
+
+    return count, len(clusters)
+
+
+def measure(func, location, repeat):
+    """ Returns (best time, peak traced memory) for func(location) """
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(location)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    func(location)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=100000, help="number of pages in the session (default: 100000)")
+    parser.add_argument("--headers", type=int, default=12, help="response headers per page (default: 12)")
+    parser.add_argument("--cluster-size", type=int, default=20, help="pages per similarity cluster (default: 20)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per reader, best time is kept (default: 3)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        location = Path(tmpdir) / "aquatone_session.json"
+        build_session(location, args.pages, args.headers, args.cluster_size)
+
+        size = location.stat().st_size
+        print(f"[*] generated {args.pages} pages in a {size / 2 ** 20:.1f} MiB aquatone_session.json")
+
+        assert load_pages(location) == stream_pages(location)
+
+        results = {
+            "json.load": measure(load_pages, location, args.repeat),
+            "read_aquatone_session": measure(stream_pages, location, args.repeat),
+        }
+
+    print(f"{'reader':<24}{'time (s)':>12}{'pages/s':>14}{'peak (MiB)':>14}")
+
+    for label, (elapsed, peak) in results.items():
+        print(f"{label:<24}{elapsed:>12.2f}{args.pages / elapsed:>14.0f}{peak / 2 ** 20:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
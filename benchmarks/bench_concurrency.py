@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+""" Run N writer processes (and optionally reader processes) against one database, once with the connection profile
+the pipeline used to get from a bare create_engine (rollback journal, synchronous=FULL, pysqlite's 5 second timeout)
+and once with the profile defined in recon/config.py's defaults (WAL, synchronous=NORMAL, ...).
+
+Each writer mimics one of FullScan's parallel luigi workers: rows are written with DBManager.add, i.e. one commit per
+row, which is the worst case for lock contention.  Readers repeatedly run the queries behind the shell's view command.
+
+Usage:
+    python benchmarks/bench_concurrency.py [--writers 6] [--readers 1] [--rows 200]
+"""
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).expanduser().resolve().parents[1]))
+
+from sqlalchemy import exc  # noqa: E402
+
+from pipeline.recon.config import defaults  # noqa: E402
+from pipeline.models.db_manager import DBManager  # noqa: E402
+from pipeline.models.endpoint_model import Endpoint  # noqa: E402
+
+PROFILES = {
+    "legacy": {
+        "database-journal-mode": "delete",
+        "database-synchronous": "full",
+        "database-busy-timeout": "",
+        "database-mmap-size": "",
+        "database-cache-size": "",
+        "database-temp-store": "",
+    },
+    "tuned": {},  # recon/config.py's defaults as shipped
+}
+
+
+def writer(db_location, profile, worker, rows, start, results):
+    defaults.update(PROFILES.get(profile))
+
+    db_mgr = DBManager(db_location=db_location)
+    written = locked = 0
+
+    start.wait()
+
+    for i in range(rows):
+        try:
+            db_mgr.add(Endpoint(url=f"http://writer{worker}.com/{i}", status_code=200))
+            written += 1
+        except exc.OperationalError:  # database is locked
+            db_mgr.session.rollback()
+            locked += 1
+
+    db_mgr.close()
+    results.put(("writer", written, locked))
+
+
+def reader(db_location, profile, start, done, results):
+    defaults.update(PROFILES.get(profile))
+
+    db_mgr = DBManager(db_location=db_location)
+    queries = locked = 0
+
+    start.wait()
+
+    while not done.is_set():
+        try:
+            db_mgr.get_all_endpoints()
+            db_mgr.get_status_codes()
+            queries += 1
+        except exc.OperationalError:
+            db_mgr.session.rollback()
+            locked += 1
+
+    db_mgr.close()
+    results.put(("reader", queries, locked))
+
+
+def measure(profile, writers, readers, rows):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_location = Path(tmpdir) / "bench.sqlite"
+
+        # create the schema and apply the profile's journal mode before any contention
+        defaults_backup = dict(defaults)
+        defaults.update(PROFILES.get(profile))
+        DBManager(db_location=db_location).close()
+        defaults.update(defaults_backup)
+
+        start, done, results = multiprocessing.Event(), multiprocessing.Event(), multiprocessing.Queue()
+
+        writer_procs = [
+            multiprocessing.Process(target=writer, args=(db_location, profile, i, rows, start, results))
+            for i in range(writers)
+        ]
+        reader_procs = [
+            multiprocessing.Process(target=reader, args=(db_location, profile, start, done, results))
+            for _ in range(readers)
+        ]
+
+        for proc in writer_procs + reader_procs:
+            proc.start()
+
+        time.sleep(1)  # let every process import and connect
+
+        begin = time.perf_counter()
+        start.set()
+
+        for proc in writer_procs:
+            proc.join()
+
+        elapsed = time.perf_counter() - begin
+        done.set()
+
+        for proc in reader_procs:
+            proc.join()
+
+        totals = {"writer": [0, 0], "reader": [0, 0]}
+
+        for _ in writer_procs + reader_procs:
+            kind, count, locked = results.get()
+            totals[kind][0] += count
+            totals[kind][1] += locked
+
+    return elapsed, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=6, help="number of writer processes (default: 6)")
+    parser.add_argument("--readers", type=int, default=1, help="number of reader processes (default: 1)")
+    parser.add_argument("--rows", type=int, default=200, help="rows written by each writer (default: 200)")
+    args = parser.parse_args()
+
+    print(
+        f"{'profile':<10}{'elapsed (s)':>12}{'rows':>8}{'rows/s':>10}{'locked':>8}{'reads':>8}{'reads/s':>10}"
+        f"{'locked':>8}"
+    )
+
+    for profile in PROFILES:
+        elapsed, totals = measure(profile, args.writers, args.readers, args.rows)
+        (written, write_locked), (reads, read_locked) = totals.get("writer"), totals.get("reader")
+
+        print(
+            f"{profile:<10}{elapsed:>12.2f}{written:>8}{written / elapsed:>10.0f}{write_locked:>8}{reads:>8}"
+            f"{reads / elapsed:>10.0f}{read_locked:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+""" Compare looking up exploits with one searchsploit process per nmap xml file against the in-process ExploitIndex.
+
+--files nmap xml files are generated, each with one host running --ports services drawn from a small pool of
+products and versions.  When exploit-db's searchsploit is installed, it's run against every file and the index is
+built from its own files_exploits.csv.  Otherwise a csv of --exploits generated titles is used and each file is
+handed to a stand-in python process that reads the csv and greps its titles, the way searchsploit does; those
+timings are labelled as such.
+
+The index is timed cold (built from the csv and pickled) and warm (loaded from the pickle).
+
+Usage:
+    python benchmarks/bench_exploit_index.py [--files 200] [--ports 5] [--exploits 45000]
+"""
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).expanduser().resolve().parents[1]))
+
+from bench_nmap_parse import HEADER, FOOTER, ip_address  # noqa: E402
+from pipeline.recon.config import tool_paths  # noqa: E402
+from pipeline.recon.exploits import ExploitIndex, get_exploitdb_csv  # noqa: E402
+from pipeline.recon.nmap import read_nmap_xml, read_searchsploit_json  # noqa: E402
+
+PRODUCTS = ["nginx", "Apache httpd", "OpenSSH", "Microsoft IIS httpd", "vsftpd", "ProFTPD", "MySQL", "Exim smtpd"]
+VERSIONS = ["1.0", "1.16.1", "2.4.29", "7.4", "10.0", "3.0.3", "5.7.30", "4.92"]
+
+PORT = """<port protocol="tcp" portid="{port}"><state state="open" reason="syn-ack" reason_ttl="0"/>\
+<service name="{name}" product="{product}" version="{version}" method="probed" conf="10"></service></port>
+"""
+
+# reads the csv and greps its titles for each service's search terms, dropping the last term until something matches
+STAND_IN = """
+import csv, sys
+from pipeline.recon.nmap import read_nmap_xml
+from pipeline.recon.exploits import get_search_terms
+rows = list(csv.DictReader(open(sys.argv[1], newline="")))
+for service in read_nmap_xml(sys.argv[2]):
+    terms = get_search_terms(service.service, service.product, service.version).split()
+    while terms:
+        found = [r for r in rows if all(t in r["description"].lower() for t in terms)]
+        if found:
+            break
+        terms.pop()
+    for r in found:
+        print(r["type"], r["description"], r["file"], sep="\\t")
+"""
+
+
+def build_csv(location, num_exploits):
+    rng = random.Random(0)
+    words = ["Remote", "Code", "Execution", "Denial", "of", "Service", "Buffer", "Overflow", "SQL", "Injection"]
+
+    with open(location, "w") as f:
+        f.write("id,file,description,date,author,type,platform,port\n")
+
+        for i in range(num_exploits):
+            product = rng.choice(PRODUCTS + [f"Product{i % 5000}"] * 30)
+            title = f"{product} {rng.choice(VERSIONS)} - {' '.join(rng.sample(words, 3))}"
+            f.write(f'{i},exploits/linux/remote/{i}.c,"{title}",2020-01-01,author,remote,linux,\n')
+
+
+def build_corpus(location, num_files, num_ports):
+    rng = random.Random(1)
+
+    for i in range(num_files):
+        ip = ip_address(i)
+        ports = [80 + x for x in range(num_ports)]
+        args = f"nmap --open -sT -n -sV -Pn -p {','.join(map(str, ports))} {ip}"
+
+        with open(location / f"nmap.{ip}-tcp.xml", "w") as f:
+            f.write(HEADER.format(args=args, num_ports=num_ports, services=",".join(map(str, ports)), ip=ip))
+            for port in ports:
+                product, version = rng.choice(PRODUCTS), rng.choice(VERSIONS)
+                f.write(PORT.format(port=port, name="http", product=product, version=version))
+            f.write(FOOTER)
+
+
+def time_searchsploit(entries):
+    """ Run searchsploit --nmap once per file """
+    found = set()
+    start = time.perf_counter()
+
+    for entry in entries:
+        with subprocess.Popen(
+            [tool_paths.get("searchsploit"), "-j", "-v", "--nmap", str(entry)], stdout=subprocess.PIPE, encoding="utf-8"
+        ) as proc:
+            found.update((entry.name, *result) for result in read_searchsploit_json(proc.stdout))
+
+    return time.perf_counter() - start, found
+
+
+def time_stand_in(csv_path, entries):
+    """ Run the stand-in grep process once per file """
+    found = set()
+    start = time.perf_counter()
+
+    for entry in entries:
+        cwd = Path(__file__).expanduser().resolve().parents[1]
+        proc = subprocess.run(
+            [sys.executable, "-c", STAND_IN, str(csv_path), str(entry)], stdout=subprocess.PIPE, cwd=cwd, text=True
+        )
+        found.update((entry.name, *line.split("\t")) for line in proc.stdout.splitlines())
+
+    return time.perf_counter() - start, found
+
+
+def time_index(csv_path, cache_path, entries):
+    """ Load the index and look up every service in every file """
+    found = set()
+    start = time.perf_counter()
+    index = ExploitIndex.load(csv_path, cache_path)
+
+    for entry in entries:
+        for service in read_nmap_xml(entry):
+            for type_, title, path in index.search_service(service.service, service.product, service.version):
+                found.add((entry.name, type_, title, Path(path).relative_to(csv_path.parent).as_posix()))
+
+    return time.perf_counter() - start, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="number of nmap xml files (default: 200)")
+    parser.add_argument("--ports", type=int, default=5, help="open ports per file (default: 5)")
+    parser.add_argument("--exploits", type=int, default=45000, help="rows in a generated csv (default: 45000)")
+    args = parser.parse_args()
+
+    installed = get_exploitdb_csv().exists()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        corpus = tmpdir / "nmap-results"
+        corpus.mkdir()
+
+        build_corpus(corpus, args.files, args.ports)
+        entries = sorted(corpus.iterdir())
+
+        if installed:
+            csv_path = get_exploitdb_csv()
+            label = "searchsploit --nmap"
+            print(f"[*] {args.files} nmap xml files against exploit-db's {csv_path}")
+            baseline, expected = time_searchsploit(entries)
+        else:
+            csv_path = tmpdir / "files_exploits.csv"
+            build_csv(csv_path, args.exploits)
+            label = "stand-in grep process"
+            print(f"[*] searchsploit not installed; {args.files} nmap xml files against {args.exploits} generated rows")
+            baseline, expected = time_stand_in(csv_path, entries)
+
+        cache_path = tmpdir / ".exploit-index.pkl"
+        cold, found = time_index(csv_path, cache_path, entries)
+        warm, _ = time_index(csv_path, cache_path, entries)
+
+        if not installed:
+            assert found == expected, "the index and the stand-in disagree"
+
+    print(f"{'lookup':<32}{'time (s)':>12}{'files/s':>12}{'speedup':>10}")
+
+    for name, elapsed in [(label, baseline), ("ExploitIndex (cold)", cold), ("ExploitIndex (cached)", warm)]:
+        print(f"{name:<32}{elapsed:>12.2f}{args.files / elapsed:>12.0f}{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+""" Compare ingestion rates of gobuster results: the original per-line parser (get_or_create per url plus a membership
+check against the target's endpoint collection), the split()-based bulk parser it was replaced with, and the current
+regex-based GobusterScan.parse_results.
+
+A corpus of --lines results is spread over --files gobuster output files, plus recursive-gobuster logs (bare urls)
+that repeat --duplicates of them.  The per-line parser is far too slow to run over the whole corpus; it's timed on its
+first --legacy-lines lines and its rate is extrapolated linearly, which flatters it: each commit expires the target,
+so its membership check reloads an ever growing endpoint collection.
+
+Usage:
+    python benchmarks/bench_gobuster_parse.py [--lines 1000000] [--files 100] [--legacy-lines 2000]
+"""
+import io
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from contextlib import redirect_stdout
+from urllib.parse import urlparse
+
+sys.path.append(str(Path(__file__).expanduser().resolve().parents[1]))
+
+from pipeline.recon.helpers import batched  # noqa: E402
+from pipeline.recon.config import defaults  # noqa: E402
+from pipeline.recon.web import GobusterScan  # noqa: E402
+from pipeline.models.db_manager import DBManager  # noqa: E402
+from pipeline.models.endpoint_model import Endpoint  # noqa: E402
+
+STATUS_CODES = ["200", "204", "301", "302", "401", "403"]
+
+
+def build_corpus(location, num_lines, num_files, duplicates):
+    """ Returns the number of lines written """
+    per_file = num_lines // num_files
+    written = 0
+
+    for i in range(num_files):
+        host = f"host{i}.example.com"
+        scheme = "https" if i % 2 else "http"
+
+        with open(location / f"gobuster.{scheme}_{host}.txt", "w") as f:
+            for j in range(per_file):
+                f.write(f"{scheme}://{host}/dir{j // 100}/file{j}.php (Status: {STATUS_CODES[j % 6]}) [Size: {j}]\n")
+
+        with open(location / f"recursive-gobuster_{host}.log", "w") as f:
+            for j in range(int(per_file * duplicates)):
+                f.write(f"{scheme}://{host}/dir{j // 100}/file{j}.php\n")
+
+        written += per_file + int(per_file * duplicates)
+
+    return written
+
+
+def legacy_parse(db_mgr, location, limit):
+    """ The original parse_results, stopped after limit lines; returns the number of lines ingested """
+    count = 0
+
+    for file in sorted(location.glob("gobuster.*")):
+        tgt = None
+        for i, line in enumerate(file.read_text().splitlines()):
+            url, status = line.split(maxsplit=1)
+
+            if i == 0:
+                parsed_url = urlparse(url)
+                tgt = db_mgr.get_or_create_target_by_ip_or_hostname(parsed_url.hostname)
+
+            if tgt is not None:
+                status_code = status.split(maxsplit=1)[1]
+                ep = db_mgr.get_or_create(Endpoint, url=url, status_code=status_code.replace(")", "").split()[0])
+                if ep not in tgt.endpoints:
+                    tgt.endpoints.append(ep)
+                db_mgr.add(tgt)
+
+            count += 1
+
+            if count >= limit:
+                return count
+
+    return count
+
+
+def split_parse(db_mgr, location):
+    """ The split()-based bulk parser; it can't read recursive-gobuster's bare urls, so only gobuster files are given """
+    records = list()
+
+    for file in sorted(location.glob("gobuster.*")):
+        for line in file.read_text().splitlines():
+            url, status = line.split(maxsplit=1)
+
+            status_code = status.split(maxsplit=1)[1]
+            records.append((url, status_code.replace(")", "")))
+
+    for batch in batched(records, int(defaults.get("database-batch-size"))):
+        db_mgr.bulk_add_endpoints(batch)
+
+    return len(records)
+
+
+def regex_parse(tmpdir, location):
+    scan = GobusterScan(target_file=__file__, results_dir=str(tmpdir), db_location=str(tmpdir / "regex.sqlite"))
+    scan.results_subfolder = location
+    scan.parse_results()
+
+    return scan.db_mgr.session.query(Endpoint.id).count()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+
+    with redirect_stdout(io.StringIO()):
+        result = func(*args)
+
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1000000, help="gobuster result lines (default: 1000000)")
+    parser.add_argument("--files", type=int, default=100, help="gobuster output files (default: 100)")
+    parser.add_argument(
+        "--duplicates", type=float, default=0.1, help="fraction repeated in recursive-gobuster logs (default: 0.1)"
+    )
+    parser.add_argument("--legacy-lines", type=int, default=2000, help="lines timed for the per-line parser")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        corpus = tmpdir / "gobuster-results"
+        corpus.mkdir()
+
+        total = build_corpus(corpus, int(args.lines / (1 + args.duplicates)), args.files, args.duplicates)
+        size = sum(x.stat().st_size for x in corpus.iterdir())
+        print(f"[*] generated {total} lines in {len(list(corpus.iterdir()))} files ({size / 2 ** 20:.1f} MiB)")
+
+        legacy, legacy_lines = timed(legacy_parse, DBManager(tmpdir / "legacy.sqlite"), corpus, args.legacy_lines)
+        split, split_lines = timed(split_parse, DBManager(tmpdir / "split.sqlite"), corpus)
+        regex, endpoints = timed(regex_parse, tmpdir, corpus)
+
+    rates = {
+        "per-line get_or_create*": legacy_lines / legacy,
+        "split() + bulk upsert": split_lines / split,
+        "regex + bulk upsert": total / regex,
+    }
+
+    print(f"{'parser':<28}{'lines/s':>12}{'1M lines (s)':>16}{'speedup':>10}")
+
+    for label, rate in rates.items():
+        print(f"{label:<28}{rate:>12.0f}{1000000 / rate:>16.1f}{rate / rates.get('per-line get_or_create*'):>9.1f}x")
+
+    print(
+        f"\n* timed over its first {legacy_lines} lines and extrapolated; {endpoints} endpoints from the regex parser"
+    )
+
+
+if __name__ == "__main__":
+    main()
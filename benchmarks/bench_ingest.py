@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+""" Compare rows/sec of the per-row get_or_create + add ingestion against DBManager's bulk upserts and against the
+same per-row code running inside a DBManager.transaction unit of work.
+
+The amass, masscan, and gobuster fixtures under tests/data/recon-results are scaled up by rewriting their hostnames,
+ip addresses, and paths so that every copy is unique.
+
+Usage:
+    python benchmarks/bench_ingest.py [--scale 10]
+"""
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import ipaddress
+from pathlib import Path
+from contextlib import redirect_stdout
+
+sys.path.append(str(Path(__file__).expanduser().resolve().parents[1]))
+
+from pipeline.recon.helpers import batched  # noqa: E402
+from pipeline.models.port_model import Port  # noqa: E402
+from pipeline.models.target_model import Target  # noqa: E402
+from pipeline.models.db_manager import DBManager  # noqa: E402
+from pipeline.models.endpoint_model import Endpoint  # noqa: E402
+from pipeline.models.ip_address_model import IPAddress  # noqa: E402
+
+fixtures = Path(__file__).expanduser().resolve().parents[1] / "tests" / "data" / "recon-results"
+
+BATCH_SIZE = 1000
+
+
+def shift_ip(ipaddr, copy):
+    """ Give each copy of the fixtures its own ipv4 address space """
+    return str(ipaddress.ip_address(ipaddr) + copy * 2 ** 16) if "." in ipaddr else ipaddr
+
+
+def scaled_amass(scale):
+    lines = (fixtures / "amass-results" / "amass.json").read_text().splitlines()
+
+    for copy in range(scale):
+        for line in lines:
+            entry = json.loads(line)
+            entry["name"] = f"c{copy}.{entry.get('name')}"
+            for address in entry.get("addresses"):
+                address["ip"] = shift_ip(address.get("ip"), copy)
+            yield entry
+
+
+def scaled_masscan(scale):
+    entries = json.loads((fixtures / "masscan-results" / "masscan.json").read_text())
+
+    for copy in range(scale):
+        for entry in entries:
+            yield shift_ip(entry.get("ip"), copy), entry.get("ports")
+
+
+def scaled_gobuster(scale):
+    lines = list()
+
+    for file in (fixtures / "gobuster-results").iterdir():
+        lines.extend(file.read_text().splitlines())
+
+    for copy in range(scale):
+        for line in lines:
+            url, status = line.split(maxsplit=1)
+            yield f"{url}/c{copy}", status.split(maxsplit=1)[1].replace(")", "")
+
+
+def legacy_amass(db_mgr, entries):
+    """ ParseAmassOutput.run prior to the bulk api """
+    for entry in entries:
+        tgt = db_mgr.get_or_create(Target, hostname=entry.get("name"), is_web=True)
+
+        for address in entry.get("addresses"):
+            tgt = db_mgr.add_ipv4_or_v6_address_to_target(tgt, address.get("ip"))
+
+        db_mgr.add(tgt)
+
+
+def bulk_amass(db_mgr, entries):
+    for batch in batched(entries, BATCH_SIZE):
+        db_mgr.bulk_get_or_create_targets((x.get("name") for x in batch), is_web=True, commit=False)
+        db_mgr.bulk_add_ip_addresses((x.get("name"), y.get("ip")) for x in batch for y in x.get("addresses"))
+
+
+def legacy_masscan(db_mgr, entries):
+    """ ParseMasscanOutput.run prior to the bulk api """
+    for single_target_ip, ports in entries:
+        tgt = db_mgr.get_or_create_target_by_ip_or_hostname(single_target_ip)
+
+        if single_target_ip not in tgt.ip_addresses:
+            tgt.ip_addresses.append(db_mgr.get_or_create(IPAddress, ipv4_address=single_target_ip))
+
+        for port_entry in ports:
+            port = db_mgr.get_or_create(Port, protocol=port_entry.get("proto"), port_number=port_entry.get("port"))
+            tgt.open_ports.append(port)
+
+        db_mgr.add(tgt)
+
+
+def bulk_masscan(db_mgr, entries):
+    records = ((ip, x.get("proto"), x.get("port")) for ip, ports in entries for x in ports)
+
+    for batch in batched(records, BATCH_SIZE):
+        db_mgr.bulk_add_ports(batch)
+
+
+def legacy_gobuster(db_mgr, records):
+    """ GobusterScan.parse_results prior to the bulk api """
+    for url, status_code in records:
+        tgt = db_mgr.get_or_create_target_by_ip_or_hostname(url.split("/")[2])
+        ep = db_mgr.get_or_create(Endpoint, url=url, status_code=status_code)
+        if ep not in tgt.endpoints:
+            tgt.endpoints.append(ep)
+        db_mgr.add(tgt)
+
+
+def bulk_gobuster(db_mgr, records):
+    for batch in batched(records, BATCH_SIZE):
+        db_mgr.bulk_add_endpoints(batch)
+
+
+def scaled_targets(scale):
+    for entry in scaled_amass(scale):
+        yield entry.get("name")
+
+
+def legacy_targets(db_mgr, hostnames):
+    """ TargetList.output prior to the unit of work """
+    for hostname in hostnames:
+        db_mgr.add(db_mgr.get_or_create(Target, hostname=hostname, is_web=True))
+
+
+def transaction_targets(db_mgr, hostnames):
+    with db_mgr.transaction(commit_every=BATCH_SIZE):
+        legacy_targets(db_mgr, hostnames)
+
+
+def measure(func, records):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_mgr = DBManager(db_location=Path(tmpdir) / "bench.sqlite")
+
+        with redirect_stdout(io.StringIO()):  # the legacy path reports every handled unique key constraint
+            start = time.perf_counter()
+            func(db_mgr, records)
+            elapsed = time.perf_counter() - start
+
+        db_mgr.close()
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=10, help="number of copies of each fixture (default: 10)")
+    args = parser.parse_args()
+
+    suites = [
+        ("amass", scaled_amass, legacy_amass, bulk_amass),
+        ("masscan", scaled_masscan, legacy_masscan, bulk_masscan),
+        ("gobuster", scaled_gobuster, legacy_gobuster, bulk_gobuster),
+        ("targets", scaled_targets, legacy_targets, transaction_targets),
+    ]
+
+    print(f"{'input':<10}{'rows':>10}{'before (rows/s)':>20}{'after (rows/s)':>20}{'speedup':>10}")
+
+    for name, generator, legacy, bulk in suites:
+        records = list(generator(args.scale))
+
+        before = measure(legacy, records)
+        after = measure(bulk, records)
+
+        print(
+            f"{name:<10}{len(records):>10}{len(records) / before:>20.0f}{len(records) / after:>20.0f}"
+            f"{before / after:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+""" Time ThreadedNmapScan.parse_nmap_output over a generated corpus of nmap xml files, parsing in the main process
+and across a pool of --parse-workers processes.
+
+Each generated file holds one host with --ports open ports, each port reporting a couple of small NSE scripts and a
+large ssl-enum-ciphers style table of --cipher-rows rows, which is what makes real -sC output expensive to parse.
+
+Usage:
+    python benchmarks/bench_nmap_parse.py [--files 2000] [--ports 5] [--cipher-rows 200] [--workers 1,2,4,0]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).expanduser().resolve().parents[1]))
+
+from pipeline.recon.nmap import ThreadedNmapScan  # noqa: E402
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE nmaprun>
+<nmaprun scanner="nmap" args="{args}" start="1585480756" version="7.80" xmloutputversion="1.04">
+<scaninfo type="connect" protocol="tcp" numservices="{num_ports}" services="{services}"/>
+<host starttime="1585480756" endtime="1585480770"><status state="up" reason="user-set" reason_ttl="0"/>
+<address addr="{ip}" addrtype="ipv4"/>
+<hostnames>
+</hostnames>
+<ports>"""
+
+PORT = """<port protocol="tcp" portid="{port}"><state state="open" reason="syn-ack" reason_ttl="0"/>\
+<service name="http" product="nginx" version="1.16.1" method="probed" conf="10"><cpe>cpe:/a:igor_sysoev:nginx</cpe>\
+</service><script id="http-server-header" output="nginx/1.16.1"><elem>nginx/1.16.1</elem></script>\
+<script id="http-title" output="Site title for {ip}:{port}"></script>\
+<script id="ssl-enum-ciphers" output="{output}"><table key="TLSv1.2"><table key="ciphers">{ciphers}</table></table>\
+</script></port>
+"""
+
+CIPHER = """<table><elem key="name">TLS_ECDHE_RSA_WITH_AES_{i}_GCM_SHA384</elem><elem key="kex_info">secp256r1</elem>\
+<elem key="strength">A</elem></table>"""
+
+FOOTER = """</ports>
+<times srtt="1000" rttvar="1000" to="100000"/>
+</host>
+<runstats><finished time="1585480770" elapsed="14.00" exit="success"/><hosts up="1" down="0" total="1"/></runstats>
+</nmaprun>
+"""
+
+
+def ip_address(i):
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+
+def build_corpus(location, num_files, num_ports, cipher_rows):
+    ports = [80 + x for x in range(num_ports)]
+    ciphers = "".join(CIPHER.format(i=i) for i in range(cipher_rows))
+    output = "&#xa;".join(f"TLS_ECDHE_RSA_WITH_AES_{i}_GCM_SHA384 - A" for i in range(cipher_rows))
+
+    for i in range(num_files):
+        ip = ip_address(i)
+        args = f"nmap --open -sT -n -sC -T 4 -sV -Pn -p {','.join(map(str, ports))} {ip}"
+
+        with open(location / f"nmap.{ip}-tcp.xml", "w") as f:
+            f.write(HEADER.format(args=args, num_ports=num_ports, services=",".join(map(str, ports)), ip=ip))
+            for port in ports:
+                f.write(PORT.format(port=port, ip=ip, output=output, ciphers=ciphers))
+            f.write(FOOTER)
+
+
+def time_parse(tmpdir, parse_workers):
+    """ Parse the corpus into a fresh database with the given number of workers """
+    db_location = Path(tmpdir) / f"workers-{parse_workers}.sqlite"
+
+    scan = ThreadedNmapScan(
+        target_file=__file__, results_dir=tmpdir, db_location=str(db_location), parse_workers=parse_workers
+    )
+
+    start = time.perf_counter()
+    scan.parse_nmap_output()
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2000, help="number of nmap xml files (default: 2000)")
+    parser.add_argument("--ports", type=int, default=5, help="open ports per file (default: 5)")
+    parser.add_argument("--cipher-rows", type=int, default=200, help="ssl-enum-ciphers rows per port (default: 200)")
+    parser.add_argument(
+        "--workers", default="1,2,4,0", help="worker counts to time, 0 is one per cpu (default: 1,2,4,0)"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus = Path(tmpdir) / "nmap-results"
+        corpus.mkdir()
+
+        build_corpus(corpus, args.files, args.ports, args.cipher_rows)
+
+        size = sum(x.stat().st_size for x in corpus.iterdir())
+        print(f"[*] generated {args.files} nmap xml files ({size / 2 ** 20:.1f} MiB), {os.cpu_count()} cpus")
+
+        timings = {workers: time_parse(tmpdir, workers) for workers in args.workers.split(",")}
+
+    baseline = timings.get("1")
+
+    print(f"{'parse workers':<20}{'time (s)':>12}{'files/s':>12}{'speedup':>10}")
+
+    for workers, elapsed in timings.items():
+        speedup = f"{baseline / elapsed:>9.1f}x" if baseline else ""
+        print(f"{workers:<20}{elapsed:>12.2f}{args.files / elapsed:>12.0f}{speedup}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+""" Compare peak memory and throughput of libnmap's NmapParser against the pipeline's iterparse based read_nmap_xml.
+
+A single nmap xml file is generated with --hosts hosts, each having --ports open ports that report a large
+ssl-enum-ciphers style table of --cipher-rows rows.  Peak memory is measured with tracemalloc in a separate run from
+the timing, since tracing slows both parsers down.
+
+Usage:
+    python benchmarks/bench_nmap_reader.py [--hosts 500] [--ports 5] [--cipher-rows 200] [--repeat 3]
+"""
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).expanduser().resolve().parents[1]))
+
+from libnmap.parser import NmapParser  # noqa: E402
+
+from bench_nmap_parse import PORT, CIPHER, ip_address  # noqa: E402
+from pipeline.recon.nmap import read_nmap_xml  # noqa: E402
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE nmaprun>
+<nmaprun scanner="nmap" args="nmap --open -sT -n -sC -T 4 -sV -Pn -oA bench 10.0.0.0/16" start="1585480756" \
+version="7.80" xmloutputversion="1.04">
+<scaninfo type="connect" protocol="tcp" numservices="{num_ports}" services="{services}"/>
+"""
+
+HOST = """<host starttime="1585480756" endtime="1585480770"><status state="up" reason="user-set" reason_ttl="0"/>
+<address addr="{ip}" addrtype="ipv4"/>
+<hostnames>
+</hostnames>
+<ports>"""
+
+FOOTER = """<runstats><finished time="1585480770" elapsed="14.00" exit="success"/><hosts up="{num_hosts}" down="0" \
+total="{num_hosts}"/></runstats>
+</nmaprun>
+"""
+
+
+def build_file(location, num_hosts, num_ports, cipher_rows):
+    ports = [80 + x for x in range(num_ports)]
+    ciphers = "".join(CIPHER.format(i=i) for i in range(cipher_rows))
+    output = "&#xa;".join(f"TLS_ECDHE_RSA_WITH_AES_{i}_GCM_SHA384 - A" for i in range(cipher_rows))
+
+    with open(location, "w") as f:
+        f.write(HEADER.format(num_ports=num_ports, services=",".join(map(str, ports))))
+
+        for i in range(num_hosts):
+            ip = ip_address(i)
+            f.write(HOST.format(ip=ip))
+            for port in ports:
+                f.write(PORT.format(port=port, ip=ip, output=output, ciphers=ciphers))
+            f.write("</ports>\n</host>\n")
+
+        f.write(FOOTER.format(num_hosts=num_hosts))
+
+
+def libnmap_services(location):
+    """ count services the way parse_nmap_output used to walk them """
+    report = NmapParser.parse_fromfile(str(location))
+
+    return sum(len(service.scripts_results) for host in report.hosts for service in host.services)
+
+
+def reader_services(location):
+    return sum(len(service.scripts) for service in read_nmap_xml(location))
+
+
+def measure(func, location, repeat):
+    """ Returns (best time, peak traced memory) for func(location) """
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(location)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    func(location)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=500, help="number of hosts in the file (default: 500)")
+    parser.add_argument("--ports", type=int, default=5, help="open ports per host (default: 5)")
+    parser.add_argument("--cipher-rows", type=int, default=200, help="ssl-enum-ciphers rows per port (default: 200)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per parser, best time is kept (default: 3)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        location = Path(tmpdir) / "nmap.bench-tcp.xml"
+        build_file(location, args.hosts, args.ports, args.cipher_rows)
+
+        size = location.stat().st_size
+        print(f"[*] generated {args.hosts * args.ports} services in one {size / 2 ** 20:.1f} MiB nmap xml file")
+
+        assert libnmap_services(location) == reader_services(location)
+
+        results = {
+            "libnmap NmapParser": measure(libnmap_services, location, args.repeat),
+            "read_nmap_xml": measure(reader_services, location, args.repeat),
+        }
+
+    print(f"{'parser':<24}{'time (s)':>12}{'services/s':>14}{'peak (MiB)':>14}")
+
+    for label, (elapsed, peak) in results.items():
+        print(f"{label:<24}{elapsed:>12.2f}{args.hosts * args.ports / elapsed:>14.0f}{peak / 2 ** 20:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+""" Time the shell's view commands against a generated database, with and without the secondary indexes added in
+schema revision 1.
+
+The database holds --endpoints endpoints spread evenly over --hosts hosts, each host having a handful of open ports,
+an nmap result per port, and a couple of headers per endpoint.  The "before" copy is the same database with every
+ix_* index dropped.
+
+Usage:
+    python benchmarks/bench_view.py [--endpoints 100000] [--hosts 2000] [--repeat 3]
+"""
+import io
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import importlib
+from pathlib import Path
+from contextlib import redirect_stdout
+
+sys.path.append(str(Path(__file__).expanduser().resolve().parents[1]))
+
+from sqlalchemy import text  # noqa: E402
+
+from pipeline.models.db_manager import DBManager  # noqa: E402
+from pipeline.models.nmap_model import NmapResult  # noqa: E402
+
+recon_shell = importlib.import_module("pipeline.recon-pipeline")
+
+PORTS = [22, 80, 443, 8080, 8443]
+STATUS_CODES = [200, 301, 403, 404, 500]
+HEADERS = [("Server", "nginx"), ("Server", "cloudflare"), ("X-Frame-Options", "DENY"), ("Cache-Control", "no-cache")]
+
+
+def hostname(i):
+    return f"host{i}.example.com"
+
+
+def ip_address(i):
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+
+def build_database(location, num_endpoints, num_hosts):
+    db_mgr = DBManager(db_location=location)
+
+    with db_mgr.transaction(commit_every=10 ** 9):
+        db_mgr.bulk_add_ip_addresses((hostname(i), ip_address(i)) for i in range(num_hosts))
+        db_mgr.bulk_add_ports((hostname(i), "tcp", port) for i in range(num_hosts) for port in PORTS)
+
+        endpoints = [
+            (f"https://{hostname(i % num_hosts)}/path{i}", STATUS_CODES[i % len(STATUS_CODES)])
+            for i in range(num_endpoints)
+        ]
+        db_mgr.bulk_add_endpoints(endpoints)
+        db_mgr.bulk_add_headers(
+            (url, *HEADERS[(i + offset) % len(HEADERS)]) for i, (url, _) in enumerate(endpoints) for offset in (0, 1)
+        )
+
+        ip_addresses = db_mgr.bulk_get_or_create_ip_addresses(ip_address(i) for i in range(num_hosts))
+        port_ids = db_mgr.bulk_get_or_create_ports(("tcp", port) for port in PORTS)
+
+        db_mgr.session.execute(
+            NmapResult.__table__.insert(),
+            [
+                {
+                    "open": True,
+                    "reason": "syn-ack",
+                    "service": "http",
+                    "product": "nginx",
+                    "commandline": f"nmap --open -sT -n -sC -T 4 -sV -Pn -p {port} {ip_address(i)}",
+                    "host": ip_address(i),
+                    "port_id": port_ids.get(("tcp", port)),
+                    "ip_address_id": ip_addresses.get(ip_address(i))[0],
+                    "target_id": ip_addresses.get(ip_address(i))[1],
+                }
+                for i in range(num_hosts)
+                for port in PORTS
+            ],
+        )
+
+    db_mgr.close()
+
+
+def drop_indexes(location):
+    db_mgr = DBManager(db_location=location)
+
+    for (name,) in db_mgr.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).fetchall():
+        if name.startswith("ix_"):
+            db_mgr.session.execute(text(f"DROP INDEX {name}"))
+
+    db_mgr.session.commit()
+    db_mgr.close()
+
+
+def time_commands(location, commands, repeat):
+    """ Time each command; a command is either a shell command line or a (label, callable(db_mgr)) pair """
+    shell = recon_shell.ReconShell()
+    shell.db_mgr = DBManager(db_location=location)
+    shell.add_dynamic_parser_arguments()
+    shell.poutput = lambda *args, **kwargs: None
+
+    timings = dict()
+
+    with redirect_stdout(io.StringIO()):
+        for command in commands:
+            label, func = command if isinstance(command, tuple) else (command, lambda db_mgr: shell.onecmd(command))
+            best = None
+
+            for _ in range(repeat):
+                shell.db_mgr.session.expunge_all()  # don't let the identity map carry results between runs
+
+                start = time.perf_counter()
+                func(shell.db_mgr)
+                elapsed = time.perf_counter() - start
+
+                best = elapsed if best is None else min(best, elapsed)
+
+            timings[label] = best
+
+    shell.db_mgr.close()
+
+    return timings
+
+
+def endpoint_headers(db_mgr, count=1000):
+    """ endpoint.headers as loaded per endpoint by view endpoints --headers """
+    for endpoint in db_mgr.get_all_endpoints()[:count]:
+        endpoint.headers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", type=int, default=100000, help="number of endpoints (default: 100000)")
+    parser.add_argument("--hosts", type=int, default=2000, help="number of hosts (default: 2000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per command, best time is kept (default: 3)")
+    args = parser.parse_args()
+
+    host = hostname(args.hosts // 2)
+
+    commands = [
+        "view endpoints --status-code 200 --plain",
+        f"view endpoints --host {host} --headers",
+        f"view nmap-scans --host {ip_address(args.hosts // 2)}",
+        "view nmap-scans --port 443",
+        f"view ports --host {host}",
+        "view targets --type domain-name",
+        # the queries behind those commands
+        ("get_endpoint_by_status_code(200)", lambda db_mgr: db_mgr.get_endpoint_by_status_code(200)),
+        (
+            "target.endpoints (endpoint.target_id)",
+            lambda db_mgr: db_mgr.get_or_create_target_by_ip_or_hostname(host).endpoints,
+        ),
+        (
+            "target.open_ports (port_association)",
+            lambda db_mgr: db_mgr.get_ports_by_ip_or_host_and_protocol(host, "tcp"),
+        ),
+        (
+            "target.nmap_results (nmap_result.target_id)",
+            lambda db_mgr: db_mgr.get_or_create_target_by_ip_or_hostname(host).nmap_results,
+        ),
+        ("1000x endpoint.headers (header_association)", endpoint_headers),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        after_db, before_db = Path(tmpdir) / "after.sqlite", Path(tmpdir) / "before.sqlite"
+
+        start = time.perf_counter()
+        build_database(after_db, args.endpoints, args.hosts)
+        print(f"[*] built {args.endpoints} endpoint database in {time.perf_counter() - start:.1f}s")
+
+        shutil.copy(after_db, before_db)
+        drop_indexes(before_db)
+
+        before = time_commands(before_db, commands, args.repeat)
+        after = time_commands(after_db, commands, args.repeat)
+
+    print(f"{'command':<60}{'before (s)':>12}{'after (s)':>12}{'speedup':>10}")
+
+    for label in before:
+        print(f"{label:<60}{before[label]:>12.4f}{after[label]:>12.4f}{before[label] / after[label]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
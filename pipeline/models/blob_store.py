@@ -0,0 +1,72 @@
+import os
+import struct
+import hashlib
+import tempfile
+from pathlib import Path
+
+# a database's blobs live in a directory next to it, i.e. ~/.local/recon-pipeline/databases/DBNAME-blobs
+BLOB_STORE_SUFFIX = "-blobs"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def get_blob_store(db_location):
+    """ Simple helper that returns the BlobStore belonging to the database at the given location """
+    return BlobStore(f"{db_location}{BLOB_STORE_SUFFIX}")
+
+
+def get_image_dimensions(image):
+    """ Simple helper that returns a png's (width, height) from its IHDR chunk; (None, None) for anything else """
+    if image[:8] != PNG_SIGNATURE or image[12:16] != b"IHDR":
+        return None, None
+
+    return struct.unpack(">II", image[16:24])
+
+
+class BlobStore:
+    """ Content-addressed file store for large binary data (screenshots) that would otherwise bloat the database.
+
+    Each blob is written once to ``root/<first two hex digits>/<sha256 hex digest>``; storing the same bytes again
+    returns the same digest without writing anything, so identical blobs are deduplicated for free.
+
+    Args:
+        root: directory under which blobs are stored; created on first write
+    """
+
+    def __init__(self, root):
+        self.root = Path(root).expanduser().resolve()
+
+    def path(self, digest):
+        """ Simple helper that returns the location on disk of the blob with the given digest """
+        return self.root / digest[:2] / digest
+
+    def __contains__(self, digest):
+        return self.path(digest).exists()
+
+    def put(self, data):
+        """ Store the given bytes if they're not already stored and return their sha256 hex digest """
+        digest = hashlib.sha256(data).hexdigest()
+        location = self.path(digest)
+
+        if location.exists():
+            return digest
+
+        location.parent.mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file in the same directory and rename it into place; readers and concurrent writers of
+        # the same blob never see a partial file
+        fd, tmp_name = tempfile.mkstemp(dir=location.parent, prefix=".tmp-")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, location)
+        except BaseException:
+            Path(tmp_name).unlink()
+            raise
+
+        return digest
+
+    def get(self, digest):
+        """ Return the bytes stored under the given digest; raises FileNotFoundError if there's no such blob """
+        return self.path(digest).read_bytes()
@@ -1,34 +1,298 @@
+import os
+import time
+import types
+import atexit
 import sqlite3
+import ipaddress
+import threading
 from pathlib import Path
-from urllib.parse import urlparse
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
 
 from cmd2 import ansi
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import exc, or_, create_engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import sessionmaker, selectinload
 from sqlalchemy.sql.expression import ClauseElement
+from sqlalchemy import exc, or_, and_, event, create_engine, text
 
 from .base_model import Base
-from .port_model import Port
+from .migrations import migrate
 from .nse_model import NSEResult
 from .target_model import Target
 from .nmap_model import NmapResult
-from .endpoint_model import Endpoint
-from .ip_address_model import IPAddress
-from .technology_model import Technology
-from .searchsploit_model import SearchsploitResult
-from ..recon.helpers import get_ip_address_version, is_ip_address
+from .blob_store import get_blob_store, get_image_dimensions
+from .endpoint_model import Endpoint, split_url
+from .ip_address_model import IPAddress, pack_ipv4_address, pack_ipv6_address
+from .technology_model import Technology, technology_association_table
+from .screenshot_cluster_model import ScreenshotCluster
+from .ingested_file_model import IngestedFile
+from .port_model import Port, port_association_table
+from .searchsploit_model import SearchsploitResult, searchsploit_association_table
+from .header_model import Header, header_association_table
+from ..recon.config import defaults
+from ..recon.helpers import get_ip_address_version, is_ip_address, batched
+
+# SQLITE_MAX_VARIABLE_NUMBER defaults to 999 on older sqlite builds; stay well under it for IN (...) clauses
+MAX_QUERY_PARAMETERS = 500
+
+# pragma -> recon/config.py defaults key; busy_timeout goes first so that switching the journal mode waits on locks
+SQLITE_PRAGMAS = {
+    "busy_timeout": "database-busy-timeout",
+    "journal_mode": "database-journal-mode",
+    "synchronous": "database-synchronous",
+    "mmap_size": "database-mmap-size",
+    "cache_size": "database-cache-size",
+    "temp_store": "database-temp-store",
+}
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """ Apply the sqlite connection profile defined in recon/config.py's defaults to each new connection """
+    cursor = dbapi_connection.cursor()
+
+    for pragma, setting in SQLITE_PRAGMAS.items():
+        if defaults.get(setting):
+            cursor.execute(f"PRAGMA {pragma}={defaults.get(setting)}")
+
+    cursor.close()
+
+
+def set_query_only(dbapi_connection, connection_record):
+    """ Refuse writes on connections handed out by the read-only session factory """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class TargetCache:
+    """ In-process map of hostname/ip address -> Target.id, used to resolve targets without querying the database.
+
+    With no maxsize, the cache is meant to be loaded with every known hostname/ip address in one go (see
+    DBManager.load_target_cache).  With a maxsize, it's an LRU cache that fills up as lookups miss.
+
+    Entries put since the last commit are tracked so that they can be dropped if the transaction is rolled back;
+    sqlite is free to hand a rolled back primary key to the next insert.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self.loaded = False
+        self._target_ids = OrderedDict()
+        self._uncommitted = set()
+
+    def __len__(self):
+        return len(self._target_ids)
+
+    def __contains__(self, ip_or_host):
+        return ip_or_host in self._target_ids
+
+    def get(self, ip_or_host):
+        """ Return the cached Target.id for the given ip address/hostname, or None; counts as a hit or a miss """
+        target_id = self._target_ids.get(ip_or_host)
+
+        if target_id is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        if self.maxsize is not None:
+            self._target_ids.move_to_end(ip_or_host)
+
+        return target_id
+
+    def put(self, ip_or_host, target_id, committed=False):
+        """ Cache the Target.id of the given ip address/hostname, evicting the least recently used entry if full """
+        if ip_or_host is None or target_id is None:
+            return
+
+        self._target_ids[ip_or_host] = target_id
+
+        if not committed:
+            self._uncommitted.add(ip_or_host)
+
+        if self.maxsize is not None:
+            self._target_ids.move_to_end(ip_or_host)
+
+            while len(self._target_ids) > self.maxsize:
+                evicted, _ = self._target_ids.popitem(last=False)
+                self._uncommitted.discard(evicted)
+
+    def update(self, target_ids, committed=False):
+        """ Bulk version of put; target_ids is a mapping or iterable of (ip address/hostname, Target.id) """
+        for ip_or_host, target_id in dict(target_ids).items():
+            self.put(ip_or_host, target_id, committed=committed)
+
+    def discard(self, ip_or_host):
+        """ Drop the given ip address/hostname from the cache, if present """
+        self._target_ids.pop(ip_or_host, None)
+        self._uncommitted.discard(ip_or_host)
+
+    def commit(self):
+        """ Mark every entry as backed by a committed row """
+        self._uncommitted.clear()
+
+    def rollback(self):
+        """ Drop every entry put since the last commit """
+        for ip_or_host in self._uncommitted:
+            self._target_ids.pop(ip_or_host, None)
+
+        self._uncommitted.clear()
+
+    def clear(self):
+        self._target_ids.clear()
+        self._uncommitted.clear()
+        self.loaded = False
+
+    def info(self):
+        """ Simple helper that returns hit/miss counters and size, a la functools.lru_cache's cache_info """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._target_ids))
+
+
+class Database:
+    """ Process-wide state of one database file, shared by every DBManager connected to it; see get_database.
+
+    Setting up a database (engine, schema, migrations) happens once per process rather than once per DBManager, which
+    luigi constructs every time it instantiates a Task.
+
+    Attributes:
+        engine: writer engine; connections aren't kept between transactions
+        writer: the single session through which this process writes to the database
+        reader: session factory for read-only (PRAGMA query_only) sessions backed by their own connection pool
+        target_cache: TargetCache kept coherent with the writer session's flushes, commits, and rollbacks
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self.connection_string = f"sqlite:///{location}"
+
+        self.engine = create_engine(self.connection_string)
+        event.listen(self.engine, "connect", set_sqlite_pragmas)
+        Base.metadata.create_all(self.engine)  # noqa: F405
+        migrate(self.engine)
+
+        self.file_id = self.get_file_id(location)
+
+        # readers get a connection pool; pysqlite connections are otherwise tied to the thread that opened them
+        self.reader_engine = create_engine(
+            self.connection_string, poolclass=QueuePool, connect_args={"check_same_thread": False}
+        )
+        event.listen(self.reader_engine, "connect", set_sqlite_pragmas)
+        event.listen(self.reader_engine, "connect", set_query_only)
+        self.reader = sessionmaker(bind=self.reader_engine)
+
+        self.writer = sessionmaker(bind=self.engine)()
+        self.unit_of_work = None
+
+        cache_size = int(defaults.get("database-target-cache-size") or 0)
+        self.target_cache = TargetCache(maxsize=cache_size or None)
+
+        # connection level events; the session's after_commit also fires when a savepoint is released
+        event.listen(self.writer, "after_flush", self._cache_flushed_targets)
+        event.listen(self.engine, "commit", lambda connection: self.target_cache.commit())
+        event.listen(self.engine, "rollback", lambda connection: self.target_cache.rollback())
+        event.listen(self.engine, "rollback_savepoint", lambda connection, name, context: self.target_cache.rollback())
+
+    @staticmethod
+    def get_file_id(location):
+        """ Simple helper that identifies the file at location; None if there isn't one """
+        try:
+            stat = Path(location).stat()
+        except FileNotFoundError:
+            return None
+
+        return stat.st_dev, stat.st_ino
+
+    def _cache_flushed_targets(self, session, flush_context):
+        """ after_flush hook that keeps the target cache coherent with Targets/IPAddresses written by the ORM """
+        for instance in session.new.union(session.dirty):
+            if isinstance(instance, Target):
+                self.target_cache.put(instance.hostname, instance.id)
+            elif isinstance(instance, IPAddress) and instance.target_id is not None:
+                self.target_cache.put(instance.ipv4_address or instance.ipv6_address, instance.target_id)
+
+    def dispose(self):
+        """ Close the writer session and every pooled connection; everything reconnects on next use """
+        self.writer.close()
+        self.engine.dispose()
+        self.reader_engine.dispose()
+
+
+# (pid, database location) -> Database.  DBManagers look their Database up when they're created, and tasks create theirs
+# in __init__, in the scheduling process before luigi forks its workers; so a worker keeps using the Database it
+# inherited (the writer engine doesn't pool connections, so none are shared across the fork) and only DBManagers
+# created in the worker itself get one of their own
+_databases = dict()
+_databases_lock = threading.Lock()
+
+
+def get_database(db_location):
+    """ Return the process-wide Database for the given location, setting it up on first use
+
+    A database file that was deleted or replaced since it was set up (i.e. by database delete in the shell) is set up
+    again, and the Database that was set up for the old file is disposed of.
+    """
+    location = Path(db_location).expanduser().resolve()
+    key = (os.getpid(), location)
+
+    with _databases_lock:
+        database = _databases.get(key)
+
+        if database is None or database.file_id != Database.get_file_id(location):
+            if database is not None:
+                database.dispose()
+
+            database = _databases[key] = Database(location)
+
+        return database
+
+
+@atexit.register
+def dispose_databases():
+    """ Dispose of every Database this process set up; closing their last connections lets sqlite checkpoint the WAL """
+    with _databases_lock:
+        for key in [key for key in _databases if key[0] == os.getpid()]:
+            _databases.pop(key).dispose()
 
 
 class DBManager:
-    """ Class that encapsulates database transactions and queries """
+    """ Class that encapsulates database transactions and queries
+
+    Args:
+        db_location: path to the sqlite database; created if it doesn't exist
+        read_only: query through a pooled read-only session instead of the process' writer session
+    """
 
-    def __init__(self, db_location):
+    def __init__(self, db_location, read_only=False):
         self.location = Path(db_location).expanduser().resolve()
         self.connection_string = f"sqlite:///{self.location}"
-        engine = create_engine(self.connection_string)
-        Base.metadata.create_all(engine)  # noqa: F405
-        session_factory = sessionmaker(bind=engine)
-        self.session = session_factory()
+        self.read_only = read_only
+        self.database = get_database(self.location)
+        self.engine = self.database.engine
+        self.blob_store = get_blob_store(self.location)
+
+        if read_only:
+            # a pooled query_only session of its own; the target cache and unit of work belong to the writer
+            self.session = self.database.reader()
+            self._state = types.SimpleNamespace(unit_of_work=None)
+            self.target_cache = TargetCache(maxsize=self.database.target_cache.maxsize)
+        else:
+            self.session = self.database.writer
+            self._state = self.database
+            self.target_cache = self.database.target_cache
+
+    @property
+    def unit_of_work(self):
+        """ State of the unit of work in progress (see begin); shared by every writer DBManager of the database """
+        return self._state.unit_of_work
+
+    @unit_of_work.setter
+    def unit_of_work(self, value):
+        self._state.unit_of_work = value
 
     def get_or_create(self, model, **kwargs):
         """ Simple helper to either get an existing record if it exists otherwise create and return a new instance """
@@ -41,44 +305,185 @@ class DBManager:
             return instance
 
     def add(self, item):
-        """ Simple helper to add a record to the database """
+        """ Simple helper to add a record to the database
+
+        Within a unit of work (see begin/transaction), the record is flushed inside its own SAVEPOINT so that an
+        integrity error only discards that record, and the commit is deferred to the unit of work's commit policy.
+        """
+        if self.unit_of_work is None:
+            try:
+                self.session.add(item)
+                self.session.commit()
+            except (sqlite3.IntegrityError, exc.IntegrityError):
+                print(ansi.style("[-] unique key constraint handled, moving on...", fg="bright_white"))
+                self.session.rollback()
+            return
+
         try:
             self.session.add(item)
+            self.unit_of_work["savepoint"].commit()  # flushes the record and releases its savepoint
+        except (sqlite3.IntegrityError, exc.IntegrityError):
+            print(ansi.style("[-] unique key constraint handled, moving on...", fg="bright_white"))
+            self.unit_of_work["savepoint"].rollback()
+
+        self.unit_of_work["savepoint"] = self.session.begin_nested()
+        self._commit_rows(1)
+
+    def add_all(self, items):
+        """ Simple helper to add several records to the database with a single commit """
+        if self.unit_of_work is not None:
+            for item in items:
+                self.add(item)
+            return
+
+        try:
+            self.session.add_all(items)
             self.session.commit()
         except (sqlite3.IntegrityError, exc.IntegrityError):
-            print(ansi.style(f"[-] unique key constraint handled, moving on...", fg="bright_white"))
+            print(ansi.style("[-] unique key constraint handled, moving on...", fg="bright_white"))
             self.session.rollback()
 
+    def begin(self, commit_every=None, commit_interval=None):
+        """ Start a unit of work; rows written afterwards are committed every commit_every rows or every
+        commit_interval seconds, whichever comes first, instead of once per call.
+
+        Any outstanding changes in the session are committed before the unit of work starts.
+        """
+        if self.unit_of_work is not None:
+            raise RuntimeError("a unit of work is already in progress")
+
+        self.session.commit()
+
+        self.unit_of_work = {
+            "commit_every": int(commit_every or defaults.get("database-batch-size")),
+            "commit_interval": float(commit_interval or defaults.get("database-commit-interval")),
+        }
+
+        self._begin_batch()
+
+    def _begin_batch(self):
+        """ Open the transaction for the next batch of the current unit of work """
+        # pysqlite only emits BEGIN ahead of DML, which would let the first SAVEPOINT open (and its RELEASE commit)
+        # the transaction; begin explicitly so savepoints nest inside the batch.  IMMEDIATE takes the write lock up
+        # front (waiting up to busy_timeout), a deferred transaction that reads first fails outright in WAL mode if
+        # another writer commits before it upgrades to a write
+        self.session.execute(text("BEGIN IMMEDIATE"))
+        self.unit_of_work["savepoint"] = self.session.begin_nested()
+        self.unit_of_work["pending"] = 0
+        self.unit_of_work["started"] = time.monotonic()
+
+    def flush(self):
+        """ Simple helper to push pending changes to the database without committing them """
+        self.session.flush()
+
+    def commit(self):
+        """ Commit everything written so far; a unit of work in progress continues with a fresh batch """
+        if self.unit_of_work is None:
+            self.session.commit()
+            return
+
+        self.unit_of_work["savepoint"].commit()
+        self.session.commit()
+        self._begin_batch()
+
+    def end(self, rollback=False):
+        """ Finish the current unit of work, committing (or discarding) the rows of its last batch """
+        if self.unit_of_work is None:
+            return
+
+        try:
+            if rollback:
+                self.session.rollback()  # savepoint
+                self.session.rollback()  # batch
+            else:
+                self.unit_of_work["savepoint"].commit()
+                self.session.commit()
+        finally:
+            self.unit_of_work = None
+
+    @contextmanager
+    def transaction(self, commit_every=None, commit_interval=None):
+        """ Context manager wrapping begin/end; the last batch is discarded if the block raises """
+        self.begin(commit_every=commit_every, commit_interval=commit_interval)
+
+        try:
+            yield self
+        except BaseException:
+            self.end(rollback=True)
+            raise
+
+        self.end()
+
+    def _commit_rows(self, count):
+        """ Commit ``count`` newly written rows now, or defer them to the unit of work's commit policy """
+        if self.unit_of_work is None:
+            self.session.commit()
+            return
+
+        self.unit_of_work["pending"] += count
+
+        if (
+            self.unit_of_work["pending"] >= self.unit_of_work["commit_every"]
+            or time.monotonic() - self.unit_of_work["started"] >= self.unit_of_work["commit_interval"]
+        ):
+            self.commit()
+
+    def load_target_cache(self):
+        """ Fill the target cache with every known hostname/ip address using a single join query """
+        query = self.session.query(
+            Target.id, Target.hostname, IPAddress.ipv4_address, IPAddress.ipv6_address
+        ).outerjoin(Target.ip_addresses)
+
+        for target_id, hostname, ipv4_address, ipv6_address in query:
+            for ip_or_host in (hostname, ipv4_address, ipv6_address):
+                # rows read mid unit of work may not be committed yet
+                self.target_cache.put(ip_or_host, target_id, committed=self.unit_of_work is None)
+
+        self.target_cache.loaded = True
+
+    def get_target_id_by_ip_or_hostname(self, ip_or_host):
+        """ Simple helper to resolve an ip address or hostname to a Target.id (or None) via the target cache """
+        if self.target_cache.maxsize is None and not self.target_cache.loaded:
+            self.load_target_cache()
+
+        target_id = self.target_cache.get(ip_or_host)
+
+        if target_id is not None:
+            return target_id
+
+        # a miss isn't proof that the target doesn't exist; other processes write to the same database
+        if get_ip_address_version(ip_or_host) in ("4", "6"):
+            column = IPAddress.ipv4_address if get_ip_address_version(ip_or_host) == "4" else IPAddress.ipv6_address
+            target_id = self.session.query(IPAddress.target_id).filter(column == ip_or_host).scalar()
+
+        if target_id is None:
+            target_id = self.session.query(Target.id).filter(Target.hostname == ip_or_host).scalar()
+
+        self.target_cache.put(ip_or_host, target_id)
+
+        return target_id
+
     def get_or_create_target_by_ip_or_hostname(self, ip_or_host):
         """ Simple helper to query a Target record by either hostname or ip address, whichever works """
         # get existing instance
-        instance = (
-            self.session.query(Target)
-            .filter(
-                or_(
-                    Target.ip_addresses.any(
-                        or_(IPAddress.ipv4_address.in_([ip_or_host]), IPAddress.ipv6_address.in_([ip_or_host]))
-                    ),
-                    Target.hostname == ip_or_host,
-                )
-            )
-            .first()
-        )
-        if instance:
-            return instance
-        else:
-            # create new entry
-            tgt = self.get_or_create(Target)
+        target_id = self.get_target_id_by_ip_or_hostname(ip_or_host)
 
-            if get_ip_address_version(ip_or_host) == "4":
-                tgt.ip_addresses.append(IPAddress(ipv4_address=ip_or_host))
-            elif get_ip_address_version(ip_or_host) == "6":
-                tgt.ip_addresses.append(IPAddress(ipv6_address=ip_or_host))
-            else:
-                # we've already determined it's not an IP, only other possibility is a hostname
-                tgt.hostname = ip_or_host
+        if target_id is not None:
+            instance = self.session.query(Target).get(target_id)  # identity map first, then the primary key
+
+            if instance is not None:
+                return instance
+
+            self.target_cache.discard(ip_or_host)  # stale; the target is gone
 
-            return tgt
+        # create new entry; a Target of its own, rather than whichever one an unfiltered query happens to return
+        if get_ip_address_version(ip_or_host) == "4":
+            return Target(ip_addresses=[IPAddress(ipv4_address=ip_or_host)])
+        elif get_ip_address_version(ip_or_host) == "6":
+            return Target(ip_addresses=[IPAddress(ipv6_address=ip_or_host)])
+
+        # we've already determined it's not an IP, only other possibility is a hostname
+        return Target(hostname=ip_or_host)
 
     def get_all_hostnames(self) -> list:
         """ Simple helper to return all hostnames from Target records """
@@ -90,6 +495,14 @@ class DBManager:
             x[0] for x in self.session.query(IPAddress.ipv4_address).filter(IPAddress.ipv4_address != None)
         ]  # noqa: E711
 
+    def get_ipv4_addresses_after(self, last_id=0) -> list:
+        """ Simple helper to return (id, ipv4 address) for each ipv4 address added since the IPAddress with id last_id """
+        query = self.session.query(IPAddress.id, IPAddress.ipv4_address).filter(
+            IPAddress.id > last_id, IPAddress.ipv4_address != None  # noqa: E711
+        )
+
+        return query.order_by(IPAddress.id).all()
+
     def get_all_ipv6_addresses(self) -> list:
         """ Simple helper to return all ipv6 addresses from Target records """
         return [
@@ -97,8 +510,14 @@ class DBManager:
         ]  # noqa: E711
 
     def close(self):
-        """ Simple helper to close the database session """
-        self.session.close()
+        """ Simple helper to close this manager's session, handing its connection back
+
+        The writer session is shared by every writer DBManager of the database; it's left alone while a unit of work
+        is in progress.  The engines stay registered for the next DBManager of this database, and are disposed of when
+        the process exits (see get_database).
+        """
+        if self.unit_of_work is None:
+            self.session.close()
 
     def get_all_targets(self):
         """ Simple helper to return all ipv4/6 and hostnames produced by running amass """
@@ -118,26 +537,71 @@ class DBManager:
 
     def get_endpoints_by_ip_or_hostname(self, ip_or_host):
         """ Simple helper that returns all Endpoints filtered by ip or hostname """
-        endpoints = list()
+        return self.session.query(Endpoint).filter(Endpoint.host == ip_or_host).all()
 
-        tmp_endpoints = self.session.query(Endpoint).filter(Endpoint.url.contains(ip_or_host)).all()
+    def get_endpoints(self, status_code=None, ip_or_host=None, headers=False):
+        """ Simple helper that returns Endpoints, optionally filtered by status code and/or ip or hostname
 
-        for ep in tmp_endpoints:
-            parsed_url = urlparse(ep.url)
-            if parsed_url.hostname == ip_or_host:
-                endpoints.append(ep)
+        With headers=True, every returned Endpoint's headers are loaded up front by a single additional query.
+        """
+        query = self.session.query(Endpoint)
 
-        return endpoints
+        if status_code is not None:
+            query = query.filter(Endpoint.status_code == status_code)
+        if ip_or_host is not None:
+            query = query.filter(Endpoint.host == ip_or_host)
+        if headers:
+            query = query.options(selectinload(Endpoint.headers))
+
+        return query.order_by(Endpoint.id).all()
+
+    def get_nmap_scans(self, ip_or_host=None):
+        """ Simple helper that returns NmapResults, optionally filtered by ip or hostname, with everything
+        NmapResult.pretty needs already loaded
+        """
+        query = self.session.query(NmapResult).options(
+            selectinload(NmapResult.port), selectinload(NmapResult.ip_address), selectinload(NmapResult.nse_results)
+        )
+
+        if ip_or_host is not None:
+            query = query.filter(NmapResult.host == ip_or_host)
+
+        return query.order_by(NmapResult.id).all()
 
     def get_nmap_scans_by_ip_or_hostname(self, ip_or_host):
-        """ Simple helper that returns all Endpoints filtered by ip or hostname """
-        scans = list()
+        """ Simple helper that returns all NmapResults filtered by ip or hostname """
+        return self.get_nmap_scans(ip_or_host)
 
-        for result in self.session.query(NmapResult).filter(NmapResult.commandline.contains(ip_or_host)).all():
-            if result.commandline.split()[-1] == ip_or_host:
-                scans.append(result)
+    def get_nse_results_by_script_id(self, script_id):
+        """ Simple helper that returns the NSEResults of the given script along with their NmapResults """
+        return (
+            self.session.query(NSEResult)
+            .filter(NSEResult.script_id == script_id)
+            .options(selectinload(NSEResult.nmap_results))
+            .all()
+        )
+
+    def get_nmap_software(self):
+        """ Simple helper that returns each distinct (host, service, product, product_version) reported open by nmap """
+        query = self.session.query(NmapResult.host, NmapResult.service, NmapResult.product, NmapResult.product_version)
+
+        return set(query.filter(NmapResult.open.is_(True)).distinct())
+
+    def get_ingested_files(self):
+        """ Simple helper that returns {path: (size, mtime_ns)} for every results file that's been ingested """
+        query = self.session.query(IngestedFile.path, IngestedFile.size, IngestedFile.mtime_ns)
+
+        return {path: (size, mtime_ns) for path, size, mtime_ns in query}
 
-        return scans
+    def set_file_ingested(self, path, size, mtime_ns, commit=True):
+        """ Simple helper that records a results file as ingested with the size and modification time it was read at """
+        ingested_file = self.get_or_create(IngestedFile, path=str(path))
+        ingested_file.size, ingested_file.mtime_ns = size, mtime_ns
+
+        self.session.add(ingested_file)
+
+        if commit:
+            self._commit_rows(1)
 
     def get_status_codes(self):
         """ Simple helper that returns all status codes found during scanning """
@@ -173,20 +637,60 @@ class DBManager:
 
         return tgt
 
+    def set_screenshot_image(self, screenshot, image):
+        """ Simple helper to store a png in the blob store and record its digest, size, and dimensions on the Screenshot """
+        screenshot.digest = self.blob_store.put(image)
+        screenshot.size = len(image)
+        screenshot.width, screenshot.height = get_image_dimensions(image)
+
+    def get_targets_with_addresses(self, **filters):
+        """ Return (Target, [ip addresses]) for every Target matching the given column filters, in a single query
+
+        Targets and their addresses are outer joined instead of lazily loading target.ip_addresses per Target.
+        """
+        targets = OrderedDict()
+
+        query = (
+            self.session.query(Target, IPAddress.ipv4_address, IPAddress.ipv6_address)
+            .filter(*(getattr(Target, column) == value for column, value in filters.items()))
+            .outerjoin(Target.ip_addresses)
+            .order_by(Target.id, IPAddress.id)
+        )
+
+        for target, ipv4_address, ipv6_address in query:
+            addresses = targets.setdefault(target, list())
+            addresses.extend(x for x in (ipv4_address, ipv6_address) if x)
+
+        return list(targets.items())
+
+    def get_targets_with_addresses_and_ports(self, **filters):
+        """ Return (Target, [ip addresses], [Ports]) for every Target matching the given column filters
+
+        Two queries in total: the targets joined to their addresses, and the open ports of all of those targets.
+        """
+        targets = self.get_targets_with_addresses(**filters)
+        open_ports = dict()
+
+        query = (
+            self.session.query(Target.id, Port)
+            .filter(*(getattr(Target, column) == value for column, value in filters.items()))
+            .join(Target.open_ports)
+            .order_by(Target.id)
+        )
+
+        for target_id, port in query:
+            open_ports.setdefault(target_id, list()).append(port)
+
+        return [(target, addresses, open_ports.get(target.id, list())) for target, addresses in targets]
+
     def get_all_web_targets(self):
         """ Simple helper that returns all Targets tagged as having an open web port """
-        # return set(str(x[0]) for x in self.session.query(Target).all())
         web_targets = list()
-        targets = self.get_and_filter(Target, is_web=True)
 
-        for target in targets:
+        for target, addresses in self.get_targets_with_addresses(is_web=True):
             if target.hostname:
                 web_targets.append(target.hostname)
-            for ipaddr in target.ip_addresses:
-                if ipaddr.ipv4_address:
-                    web_targets.append(ipaddr.ipv4_address)
-                if ipaddr.ipv6_address:
-                    web_targets.append(ipaddr.ipv6_address)
+            web_targets.extend(addresses)
 
         return web_targets
 
@@ -202,10 +706,515 @@ class DBManager:
         return ports
 
     def get_all_searchsploit_results(self):
-        return self.get_and_filter(SearchsploitResult)
+        """ Simple helper that returns all SearchsploitResults along with their Targets' addresses and results """
+        target = selectinload(SearchsploitResult.targets)
+
+        return (
+            self.session.query(SearchsploitResult)
+            .options(target.selectinload(Target.ip_addresses), target.selectinload(Target.searchsploit_results))
+            .all()
+        )
+
+    def get_web_technologies(self, **filters):
+        """ Simple helper that returns the Technologies matching the given filters along with their Targets' addresses """
+        return (
+            self.session.query(Technology)
+            .filter_by(**filters)
+            .options(selectinload(Technology.targets).selectinload(Target.ip_addresses))
+            .all()
+        )
 
     def get_all_web_technology_types(self):
         return set(str(x[0]) for x in self.session.query(Technology.type).all())
 
     def get_all_web_technology_products(self):
         return set(str(x[0]) for x in self.session.query(Technology.text).all())
+
+    def _upsert(self, table, rows, index_elements, set_=None):
+        """ Insert rows with INSERT ... ON CONFLICT; DO NOTHING unless set_ (column -> sql expression) is given
+
+        All rows are sent to sqlite as a single executemany.
+        """
+        rows = list(rows)
+
+        if not rows:
+            return
+
+        columns = list(rows[0].keys())
+
+        statement = (
+            f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join(f':{x}' for x in columns)}) "
+            f"ON CONFLICT ({', '.join(index_elements)}) "
+        )
+
+        if set_:
+            statement += "DO UPDATE SET " + ", ".join(f"{column} = {expr}" for column, expr in set_.items())
+        else:
+            statement += "DO NOTHING"
+
+        self.session.execute(text(statement), rows)
+
+    def _add_associations(self, table, left, right, pairs):
+        """ Insert (left, right) rows into an association table, skipping pairs that already exist
+
+        ``right`` should be the more selective of the two columns (i.e. endpoint_id rather than header_id).
+        """
+        pairs = set(pairs)
+
+        if not pairs:
+            return
+
+        # unary + keeps sqlite from probing the existence check through the (far less selective) index on left
+        statement = (
+            f"INSERT INTO {table.name} ({left}, {right}) SELECT :left, :right "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table.name} WHERE +{left} = :left AND {right} = :right)"
+        )
+
+        self.session.execute(text(statement), [{"left": x, "right": y} for x, y in pairs])
+
+    @staticmethod
+    def _get_ip_address_columns(version):
+        """ Simple helper that returns the (address column, packed column, packing function) for ip version 4 or 6 """
+        if str(version) == "4":
+            return IPAddress.ipv4_address, IPAddress.ipv4_int, pack_ipv4_address
+        return IPAddress.ipv6_address, IPAddress.ipv6_packed, pack_ipv6_address
+
+    def get_ip_addresses_by_range(self, first, last, port_number=None, protocol="tcp"):
+        """ Return the ip addresses between first and last (inclusive) in address order
+
+        The range is resolved as a BETWEEN on the indexed ipv4_int/ipv6_packed column.
+
+        Args:
+            first: lowest ipv4/6 address of the range
+            last: highest address of the range; must be the same ip version as first
+            port_number: only return addresses whose Target has this port open
+            protocol: protocol of port_number
+        """
+        first, last = ipaddress.ip_address(first), ipaddress.ip_address(last)
+
+        if first.version != last.version:
+            raise ValueError(f"{first} and {last} are not the same ip version")
+
+        column, packed, pack = self._get_ip_address_columns(first.version)
+
+        query = self.session.query(column).filter(packed.between(pack(str(first)), pack(str(last))))
+
+        if port_number is not None:
+            query = query.join(Target, IPAddress.target_id == Target.id).filter(
+                Target.open_ports.any(and_(Port.port_number == int(port_number), Port.protocol == protocol))
+            )
+
+        return [x[0] for x in query.order_by(packed)]
+
+    def get_ip_addresses_by_cidr(self, cidr, port_number=None, protocol="tcp"):
+        """ Return the ip addresses within the given network (i.e. 10.10.0.0/16), see get_ip_addresses_by_range """
+        network = ipaddress.ip_network(cidr, strict=False)
+
+        return self.get_ip_addresses_by_range(
+            network.network_address, network.broadcast_address, port_number=port_number, protocol=protocol
+        )
+
+    def bulk_get_or_create_ip_addresses(self, ip_addresses, is_web=False, commit=True):
+        """ Bulk helper that ensures each ip address exists and is tied to a Target
+
+        Args:
+            ip_addresses: iterable of ipv4/6 addresses
+            is_web: value of is_web for any Target created along the way
+            commit: whether or not to commit the transaction before returning
+
+        Returns:
+            dict of ip address -> (IPAddress.id, Target.id)
+        """
+        by_version = {"4": set(), "6": set()}
+
+        for ipaddr in ip_addresses:
+            by_version[get_ip_address_version(ipaddr)].add(ipaddr)
+
+        results = dict()
+
+        for version, addresses in by_version.items():
+            if not addresses:
+                continue
+
+            column, packed, pack = self._get_ip_address_columns(version)
+
+            self._upsert(
+                IPAddress.__table__,
+                [{column.name: x, packed.name: pack(x)} for x in addresses],
+                index_elements=(column.name,),
+            )
+
+            for chunk in batched(addresses, MAX_QUERY_PARAMETERS):
+                for ip_id, ipaddr, target_id in self.session.query(IPAddress.id, column, IPAddress.target_id).filter(
+                    column.in_(chunk)
+                ):
+                    results[ipaddr] = (ip_id, target_id)
+
+        orphans = [(ipaddr, ip_id) for ipaddr, (ip_id, target_id) in results.items() if target_id is None]
+
+        for ipaddr, ip_id in orphans:
+            # account for ip addresses that aren't already tied to a target; a Target has no natural key of its
+            # own in this case, so each one needs its own insert to learn the new primary key
+            result = self.session.execute(Target.__table__.insert().values(is_web=is_web, vuln_to_sub_takeover=False))
+            results[ipaddr] = (ip_id, result.inserted_primary_key[0])
+
+        if orphans:
+            self.session.execute(
+                text("UPDATE ip_address SET target_id = :target_id WHERE id = :ip_id"),
+                [{"target_id": results[ipaddr][1], "ip_id": ip_id} for ipaddr, ip_id in orphans],
+            )
+
+        self.target_cache.update((ipaddr, target_id) for ipaddr, (_, target_id) in results.items())
+
+        if commit:
+            self._commit_rows(len(results))
+
+        return results
+
+    def _set_targets_web(self, target_ids):
+        """ Bulk helper to tag the given Targets as having an open web port """
+        for chunk in batched(set(target_ids), MAX_QUERY_PARAMETERS):
+            self.session.query(Target).filter(Target.id.in_(chunk)).update({"is_web": True}, synchronize_session=False)
+
+    def bulk_get_or_create_targets(self, ips_or_hosts, is_web=False, commit=True):
+        """ Bulk version of get_or_create_target_by_ip_or_hostname
+
+        Args:
+            ips_or_hosts: iterable of ip addresses and/or hostnames
+            is_web: whether or not the resolved Targets should be tagged as web targets
+            commit: whether or not to commit the transaction before returning
+
+        Returns:
+            dict of ip address/hostname -> Target.id
+        """
+        hostnames, ip_addresses = set(), set()
+
+        for ip_or_host in ips_or_hosts:
+            if ip_or_host is None:
+                continue
+            if get_ip_address_version(ip_or_host) in ("4", "6"):
+                ip_addresses.add(ip_or_host)
+            else:
+                # we've already determined it's not an IP, only other possibility is a hostname
+                hostnames.add(ip_or_host)
+
+        target_ids = dict()
+
+        if hostnames:
+            self._upsert(
+                Target.__table__,
+                [{"hostname": x, "is_web": is_web, "vuln_to_sub_takeover": False} for x in hostnames],
+                index_elements=("hostname",),
+                set_={"is_web": "target.is_web OR excluded.is_web"},
+            )
+
+            for chunk in batched(hostnames, MAX_QUERY_PARAMETERS):
+                target_ids.update(self.session.query(Target.hostname, Target.id).filter(Target.hostname.in_(chunk)))
+
+        if ip_addresses:
+            ip_results = self.bulk_get_or_create_ip_addresses(ip_addresses, is_web=is_web, commit=False)
+
+            target_ids.update((ipaddr, target_id) for ipaddr, (_, target_id) in ip_results.items())
+
+            if is_web:
+                self._set_targets_web(target_id for _, target_id in ip_results.values())
+
+        self.target_cache.update(target_ids)
+
+        if commit:
+            self._commit_rows(len(target_ids))
+
+        return target_ids
+
+    def bulk_add_ip_addresses(self, records, commit=True):
+        """ Bulk version of add_ipv4_or_v6_address_to_target
+
+        Args:
+            records: iterable of (ip address/hostname, ip address to tie to that target); non-ip addresses are ignored
+            commit: whether or not to commit the transaction before returning
+        """
+        by_version = {"4": dict(), "6": dict()}
+
+        records = [(ip_or_host, ipaddr) for ip_or_host, ipaddr in records if is_ip_address(ipaddr)]
+
+        target_ids = self.bulk_get_or_create_targets((ip_or_host for ip_or_host, _ in records), commit=False)
+
+        for ip_or_host, ipaddr in records:
+            # an address seen more than once is tied to the last target that claimed it
+            by_version[get_ip_address_version(ipaddr)][ipaddr] = target_ids.get(ip_or_host)
+
+        for version, addresses in by_version.items():
+            column, packed, pack = self._get_ip_address_columns(version)
+
+            self._upsert(
+                IPAddress.__table__,
+                [
+                    {column.name: ipaddr, packed.name: pack(ipaddr), "target_id": target_id}
+                    for ipaddr, target_id in addresses.items()
+                ],
+                index_elements=(column.name,),
+                set_={"target_id": "excluded.target_id"},
+            )
+
+            self.target_cache.update(addresses)
+
+        if commit:
+            self._commit_rows(len(records))
+
+    def bulk_get_or_create_ports(self, protocols_and_ports, commit=True):
+        """ Bulk version of get_or_create(Port, ...)
+
+        Args:
+            protocols_and_ports: iterable of (protocol, port number)
+            commit: whether or not to commit the transaction before returning
+
+        Returns:
+            dict of (protocol, port number) -> Port.id
+        """
+        wanted = {(protocol, int(port_number)) for protocol, port_number in protocols_and_ports}
+
+        self._upsert(
+            Port.__table__,
+            [{"protocol": protocol, "port_number": port_number} for protocol, port_number in wanted],
+            index_elements=("protocol", "port_number"),
+        )
+
+        port_ids = dict()
+
+        for chunk in batched({port_number for _, port_number in wanted}, MAX_QUERY_PARAMETERS):
+            for port_id, protocol, port_number in self.session.query(Port.id, Port.protocol, Port.port_number).filter(
+                Port.port_number.in_(chunk)
+            ):
+                if (protocol, port_number) in wanted:
+                    port_ids[(protocol, port_number)] = port_id
+
+        if commit:
+            self._commit_rows(len(port_ids))
+
+        return port_ids
+
+    def bulk_add_ports(self, records, commit=True):
+        """ Bulk helper to add open ports to the Targets on which they were found
+
+        Args:
+            records: iterable of (ip address/hostname, protocol, port number)
+            commit: whether or not to commit the transaction before returning
+        """
+        records = [(ip_or_host, protocol, int(port_number)) for ip_or_host, protocol, port_number in records]
+
+        target_ids = self.bulk_get_or_create_targets((x[0] for x in records), commit=False)
+        port_ids = self.bulk_get_or_create_ports(((x[1], x[2]) for x in records), commit=False)
+
+        self._add_associations(
+            port_association_table,
+            "port_id",
+            "target_id",
+            (
+                (port_ids[(protocol, port_number)], target_ids[ip_or_host])
+                for ip_or_host, protocol, port_number in records
+            ),
+        )
+
+        if commit:
+            self._commit_rows(len(records))
+
+    def bulk_add_searchsploit_results(self, records, commit=True):
+        """ Bulk helper to add SearchsploitResults to the Targets for which they were found
+
+        Each distinct result is inserted once no matter how many Targets it was found for; every Target just gets an
+        association row.
+
+        Args:
+            records: iterable of (ip address/hostname, type, title, path)
+            commit: whether or not to commit the transaction before returning
+        """
+        records = set(records)
+
+        self._upsert(
+            SearchsploitResult.__table__,
+            [{"type": type_, "title": title, "path": path} for type_, title, path in {x[1:] for x in records}],
+            index_elements=("title",),
+        )
+
+        target_ids = self.bulk_get_or_create_targets((x[0] for x in records), commit=False)
+        result_ids = dict()
+
+        for chunk in batched({x[2] for x in records}, MAX_QUERY_PARAMETERS):
+            result_ids.update(
+                self.session.query(SearchsploitResult.title, SearchsploitResult.id).filter(
+                    SearchsploitResult.title.in_(chunk)
+                )
+            )
+
+        self._add_associations(
+            searchsploit_association_table,
+            "searchsploit_result_id",
+            "target_id",
+            ((result_ids[title], target_ids[ip_or_host]) for ip_or_host, _, title, _ in records),
+        )
+
+        if commit:
+            self._commit_rows(len(records))
+
+    def bulk_set_screenshot_clusters(self, clusters, commit=True):
+        """ Bulk helper to put Screenshots in the ScreenshotClusters of similar pages, creating the clusters as needed
+
+        Args:
+            clusters: dict of url -> cluster uuid; urls without a Screenshot are skipped
+            commit: whether or not to commit the transaction before returning
+        """
+        self._upsert(
+            ScreenshotCluster.__table__, [{"uuid": x} for x in set(clusters.values())], index_elements=("uuid",)
+        )
+
+        cluster_ids = dict()
+
+        for chunk in batched(set(clusters.values()), MAX_QUERY_PARAMETERS):
+            cluster_ids.update(
+                self.session.query(ScreenshotCluster.uuid, ScreenshotCluster.id).filter(
+                    ScreenshotCluster.uuid.in_(chunk)
+                )
+            )
+
+        if clusters:
+            self.session.execute(
+                text("UPDATE screenshot SET cluster_id = :cluster_id WHERE url = :url"),
+                [{"url": url, "cluster_id": cluster_ids.get(x)} for url, x in clusters.items()],
+            )
+
+        if commit:
+            self._commit_rows(len(clusters))
+
+    def bulk_add_endpoints(self, records, commit=True):
+        """ Bulk helper to add Endpoints, tying each one to the Target found in its url
+
+        An existing Endpoint's status code is left untouched.
+
+        Args:
+            records: iterable of (url, status code)
+            commit: whether or not to commit the transaction before returning
+
+        Returns:
+            dict of url -> Endpoint.id
+        """
+        status_codes = {url: status_code for url, status_code in records}
+
+        url_parts = {url: split_url(url) for url in status_codes}
+
+        target_ids = self.bulk_get_or_create_targets((host for _, host, _ in url_parts.values()), commit=False)
+
+        self._upsert(
+            Endpoint.__table__,
+            [
+                {
+                    "url": url,
+                    "scheme": url_parts.get(url)[0],
+                    "host": url_parts.get(url)[1],
+                    "port": url_parts.get(url)[2],
+                    "status_code": status_code,
+                    "target_id": target_ids.get(url_parts.get(url)[1]),
+                }
+                for url, status_code in status_codes.items()
+            ],
+            index_elements=("url",),
+            set_={
+                "status_code": "COALESCE(endpoint.status_code, excluded.status_code)",
+                "target_id": "COALESCE(excluded.target_id, endpoint.target_id)",
+            },
+        )
+
+        endpoint_ids = dict()
+
+        for chunk in batched(status_codes, MAX_QUERY_PARAMETERS):
+            endpoint_ids.update(self.session.query(Endpoint.url, Endpoint.id).filter(Endpoint.url.in_(chunk)))
+
+        if commit:
+            self._commit_rows(len(endpoint_ids))
+
+        return endpoint_ids
+
+    def bulk_add_headers(self, records, commit=True, header_ids=None, endpoint_ids=None):
+        """ Bulk helper to add Headers to the Endpoints on which they were seen
+
+        Headers and their associations are written as plain rows; no relationship collections are loaded.
+
+        Args:
+            records: iterable of (url, header name, header value); the url's Endpoint is expected to exist
+            commit: whether or not to commit the transaction before returning
+            header_ids: dict of (name, value) -> Header.id kept across calls (i.e. for the length of an ingestion);
+                only headers missing from it are written and looked up, after which it's updated with them
+            endpoint_ids: dict of url -> Endpoint.id for Endpoints whose ids are already known
+        """
+        records = set(records)
+        header_ids = dict() if header_ids is None else header_ids
+        endpoint_ids = dict(endpoint_ids or dict())
+
+        new_headers = {(x[1], x[2]) for x in records} - header_ids.keys()
+
+        self._upsert(
+            Header.__table__,
+            [{"name": name, "value": value} for name, value in new_headers],
+            index_elements=("name", "value"),
+        )
+
+        for chunk in batched({x[0] for x in records} - endpoint_ids.keys(), MAX_QUERY_PARAMETERS):
+            endpoint_ids.update(self.session.query(Endpoint.url, Endpoint.id).filter(Endpoint.url.in_(chunk)))
+
+        # each name/value pair costs two parameters
+        for chunk in batched(new_headers, MAX_QUERY_PARAMETERS // 2):
+            for header_id, name, value in self.session.query(Header.id, Header.name, Header.value).filter(
+                or_(*[and_(Header.name == name, Header.value == value) for name, value in chunk])
+            ):
+                header_ids[(name, value)] = header_id
+
+        self._add_associations(
+            header_association_table,
+            "header_id",
+            "endpoint_id",
+            ((header_ids[(name, value)], endpoint_ids[url]) for url, name, value in records if url in endpoint_ids),
+        )
+
+        if commit:
+            self._commit_rows(len(records))
+
+    def bulk_add_technologies(self, records, commit=True, technology_ids=None):
+        """ Bulk helper to add Technologies to the Targets on which they were found
+
+        Technologies and their associations are written as plain rows; no relationship collections are loaded, and
+        an association that already exists isn't added again.
+
+        Args:
+            records: iterable of (ip address/hostname, type, text)
+            commit: whether or not to commit the transaction before returning
+            technology_ids: dict of (type, text) -> Technology.id kept across calls (i.e. for the length of a scan);
+                only technologies missing from it are written and looked up, after which it's updated with them
+        """
+        records = {x for x in records if x[0]}
+        technology_ids = dict() if technology_ids is None else technology_ids
+
+        new_technologies = {(x[1], x[2]) for x in records} - technology_ids.keys()
+
+        self._upsert(
+            Technology.__table__,
+            [{"type": type_, "text": text_} for type_, text_ in new_technologies],
+            index_elements=("type", "text"),
+        )
+
+        # each type/text pair costs two parameters
+        for chunk in batched(new_technologies, MAX_QUERY_PARAMETERS // 2):
+            for technology_id, type_, text_ in self.session.query(
+                Technology.id, Technology.type, Technology.text
+            ).filter(or_(*[and_(Technology.type == type_, Technology.text == text_) for type_, text_ in chunk])):
+                technology_ids[(type_, text_)] = technology_id
+
+        target_ids = self.bulk_get_or_create_targets((x[0] for x in records), commit=False)
+
+        self._add_associations(
+            technology_association_table,
+            "technology_id",
+            "target_id",
+            ((technology_ids[(type_, text_)], target_ids[ip_or_host]) for ip_or_host, type_, text_ in records),
+        )
+
+        if commit:
+            self._commit_rows(len(records))
@@ -1,14 +1,40 @@
-from sqlalchemy.orm import relationship
+import re
+from urllib.parse import urlparse
+
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy import Column, Integer, ForeignKey, String
 
 from .base_model import Base
 from .header_model import header_association_table
 
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# scheme://host[:port] followed by the path, query, fragment, or nothing; anything fancier goes through urlparse
+SIMPLE_URL = re.compile(r"([a-z][a-z0-9+.-]*)://([a-z0-9_.-]+)(?::([0-9]{1,5}))?(?=[/?#]|$)", re.I)
+
+
+def split_url(url):
+    """ Simple helper that returns a url's (scheme, host, port); port falls back to the scheme's default port """
+    match = SIMPLE_URL.match(url)
+
+    if match is not None and int(match.group(3) or 0) <= 65535:
+        scheme, host, port = match.group(1).lower(), match.group(2).lower(), int(match.group(3) or 0)
+        return scheme, host, port or DEFAULT_PORTS.get(scheme)
+
+    parsed_url = urlparse(url)
+
+    try:
+        port = parsed_url.port
+    except ValueError:  # out of range/non-numeric port
+        port = None
+
+    return parsed_url.scheme or None, parsed_url.hostname, port or DEFAULT_PORTS.get(parsed_url.scheme)
+
 
 class Endpoint(Base):
     """ Database model that describes a URL/endpoint.
 
-    Represents gobuster data.
+    Represents gobuster data.  The host, port, and scheme columns are derived from the url whenever it's set.
 
     Relationships:
         ``target``: many to one -> :class:`pipeline.models.target_model.Target`
@@ -20,7 +46,16 @@ class Endpoint(Base):
 
     id = Column(Integer, primary_key=True)
     url = Column(String, unique=True)
-    status_code = Column(Integer)
-    target_id = Column(Integer, ForeignKey("target.id"))
+    host = Column(String, index=True)
+    port = Column(Integer)
+    scheme = Column(String)
+    status_code = Column(Integer, index=True)
+    target_id = Column(Integer, ForeignKey("target.id"), index=True)
     target = relationship("Target", back_populates="endpoints")
     headers = relationship("Header", secondary=header_association_table, back_populates="endpoints")
+
+    @validates("url")
+    def validate_url(self, key, url):
+        """ Keep host/port/scheme in sync with the url """
+        self.scheme, self.host, self.port = split_url(url)
+        return url
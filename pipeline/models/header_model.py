@@ -6,8 +6,8 @@ from .base_model import Base
 header_association_table = Table(
     "header_association",
     Base.metadata,
-    Column("header_id", Integer, ForeignKey("header.id")),
-    Column("endpoint_id", Integer, ForeignKey("endpoint.id")),
+    Column("header_id", Integer, ForeignKey("header.id"), index=True),
+    Column("endpoint_id", Integer, ForeignKey("endpoint.id"), index=True),
 )
 
 
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String
+
+from .base_model import Base
+
+
+class IngestedFile(Base):
+    """ Database model that describes a results file whose contents have been added to the database.
+
+        Records the size and modification time the file had when it was parsed, so that a restarted scan only parses
+        results files that are new or have changed since.
+    """
+
+    __tablename__ = "ingested_file"
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String, unique=True)
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
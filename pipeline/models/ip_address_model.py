@@ -1,13 +1,34 @@
-from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, ForeignKey, String
+import ipaddress
+
+from sqlalchemy.orm import relationship, validates
+from sqlalchemy import Column, Integer, ForeignKey, String, LargeBinary
 
 from .base_model import Base
 
 
+def pack_ipv4_address(ipaddr):
+    """ Simple helper that returns an ipv4 address as an integer, None if it isn't one; integer order is address order """
+    try:
+        return int(ipaddress.IPv4Address(ipaddr))
+    except ValueError:
+        return None
+
+
+def pack_ipv6_address(ipaddr):
+    """ Simple helper that returns an ipv6 address as its 16 network order bytes (None if it isn't one); sqlite compares
+    blobs with memcmp, so byte order is address order
+    """
+    try:
+        return ipaddress.IPv6Address(ipaddr).packed
+    except ValueError:
+        return None
+
+
 class IPAddress(Base):
     """ Database model that describes an ip address (ipv4 or ipv6).
 
-        Represents amass data or targets specified manually as part of the ``target-file``.
+        Represents amass data or targets specified manually as part of the ``target-file``.  The packed ``ipv4_int``
+        and ``ipv6_packed`` columns are derived from the address whenever it's set and back range/CIDR queries.
 
         Relationships:
             ``target``: many to one -> :class:`pipeline.models.target_model.Target`
@@ -18,5 +39,19 @@ class IPAddress(Base):
     id = Column(Integer, primary_key=True)
     ipv4_address = Column(String, unique=True)
     ipv6_address = Column(String, unique=True)
-    target_id = Column(Integer, ForeignKey("target.id"))
+    ipv4_int = Column(Integer, index=True)
+    ipv6_packed = Column(LargeBinary(16), index=True)
+    target_id = Column(Integer, ForeignKey("target.id"), index=True)
     target = relationship("Target", back_populates="ip_addresses")
+
+    @validates("ipv4_address")
+    def validate_ipv4_address(self, key, ipv4_address):
+        """ Keep ipv4_int in sync with the address """
+        self.ipv4_int = pack_ipv4_address(ipv4_address)
+        return ipv4_address
+
+    @validates("ipv6_address")
+    def validate_ipv6_address(self, key, ipv6_address):
+        """ Keep ipv6_packed in sync with the address """
+        self.ipv6_packed = pack_ipv6_address(ipv6_address)
+        return ipv6_address
@@ -0,0 +1,286 @@
+""" In-place schema migrations for existing databases.
+
+The schema revision of a database is tracked in sqlite's ``user_version`` pragma.  ``Base.metadata.create_all`` only
+creates missing tables, so any change to an existing table (new index, new column, ...) gets a numbered entry in
+``MIGRATIONS`` that brings a database from the previous revision up to that one.  Each migration must be idempotent;
+a database created by the current code has already got everything ``create_all`` emits.  A migration may return True
+to have the database VACUUMed once it's been committed.
+
+Every database under ``defaults["database-dir"]`` can be upgraded in one go with
+
+    python -m pipeline.models.migrations
+"""
+import uuid
+import logging
+import sqlite3
+from pathlib import Path
+
+from sqlalchemy import exc, text
+
+from .base_model import Base
+from .endpoint_model import split_url
+from .ip_address_model import pack_ipv4_address, pack_ipv6_address
+from ..recon.config import defaults
+from .blob_store import get_blob_store, get_image_dimensions
+
+
+def get_columns(connection, table_name):
+    """ Simple helper that returns the names of the columns the given table currently has """
+    return {x[1] for x in connection.execute(text(f"PRAGMA table_info({table_name})"))}
+
+
+def add_missing_columns(connection, table_name, column_names):
+    """ Simple helper to ALTER TABLE ... ADD COLUMN the given model columns if the table doesn't have them yet """
+    existing = get_columns(connection, table_name)
+
+    for name in column_names:
+        if name in existing:
+            continue
+
+        column = Base.metadata.tables.get(table_name).c[name]
+        connection.execute(
+            text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column.type.compile(connection.dialect)}")
+        )
+
+
+def create_missing_indexes(connection):
+    """ Revision 1: secondary indexes on foreign keys, association tables, and filtered columns
+
+    Indexes on columns that a later revision adds are left for that revision to create.
+    """
+    existing = {x[0] for x in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+
+    for table in Base.metadata.sorted_tables:
+        columns = get_columns(connection, table.name)
+
+        for index in table.indexes:
+            if index.name not in existing and all(column.name in columns for column in index.columns):
+                index.create(bind=connection)
+
+
+def add_host_columns(connection):
+    """ Revision 2: indexed host columns on endpoint (plus port/scheme) and nmap_result, backfilled from each row's
+    url/commandline
+    """
+    add_missing_columns(connection, "endpoint", ["host", "port", "scheme"])
+    add_missing_columns(connection, "nmap_result", ["host"])
+
+    rows = connection.execute(text("SELECT id, url FROM endpoint WHERE host IS NULL AND url IS NOT NULL")).fetchall()
+    updates = list()
+
+    for endpoint_id, url in rows:
+        scheme, host, port = split_url(url)
+        updates.append({"id": endpoint_id, "scheme": scheme, "host": host, "port": port})
+
+    if updates:
+        connection.execute(
+            text("UPDATE endpoint SET scheme = :scheme, host = :host, port = :port WHERE id = :id"), updates
+        )
+
+    rows = connection.execute(text("SELECT id, commandline FROM nmap_result WHERE host IS NULL")).fetchall()
+    updates = [{"id": x, "host": y.split()[-1]} for x, y in rows if y and y.split()]
+
+    if updates:
+        connection.execute(text("UPDATE nmap_result SET host = :host WHERE id = :id"), updates)
+
+    create_missing_indexes(connection)
+
+
+def move_screenshots_to_blob_store(connection):
+    """ Revision 3: screenshot.image moves out of the database into its blob store; the row keeps the png's digest,
+    size, and dimensions
+
+    Returns True when images were moved, as the database is then mostly free pages that a VACUUM gives back.
+    """
+    add_missing_columns(connection, "screenshot", ["digest", "size", "width", "height"])
+
+    if "image" not in get_columns(connection, "screenshot"):
+        return False
+
+    blob_store = get_blob_store(connection.engine.url.database)
+    ids = [x[0] for x in connection.execute(text("SELECT id FROM screenshot WHERE image IS NOT NULL"))]
+
+    for screenshot_id in ids:
+        # one image at a time; the whole column can be gigabytes
+        image = connection.execute(text("SELECT image FROM screenshot WHERE id = :id"), id=screenshot_id).scalar()
+        width, height = get_image_dimensions(image)
+
+        connection.execute(
+            text(
+                "UPDATE screenshot SET digest = :digest, size = :size, width = :width, height = :height WHERE id = :id"
+            ),
+            id=screenshot_id,
+            digest=blob_store.put(image),
+            size=len(image),
+            width=width,
+            height=height,
+        )
+
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        connection.execute(text("ALTER TABLE screenshot DROP COLUMN image"))
+    else:
+        connection.execute(text("UPDATE screenshot SET image = NULL"))
+
+    return bool(ids)
+
+
+def add_packed_ip_address_columns(connection):
+    """ Revision 4: indexed ipv4_int/ipv6_packed columns on ip_address, backfilled from each row's address """
+    add_missing_columns(connection, "ip_address", ["ipv4_int", "ipv6_packed"])
+
+    for column, packed, pack in (
+        ("ipv4_address", "ipv4_int", pack_ipv4_address),
+        ("ipv6_address", "ipv6_packed", pack_ipv6_address),
+    ):
+        rows = connection.execute(
+            text(f"SELECT id, {column} FROM ip_address WHERE {column} IS NOT NULL AND {packed} IS NULL")
+        ).fetchall()
+        updates = [{"id": x, "packed": pack(y)} for x, y in rows]
+
+        if updates:
+            connection.execute(text(f"UPDATE ip_address SET {packed} = :packed WHERE id = :id"), updates)
+
+    create_missing_indexes(connection)
+
+
+def add_searchsploit_association(connection):
+    """ Revision 5: searchsploit results are shared between targets through the searchsploit_association table
+    instead of belonging to the single target in searchsploit_result.target_id
+
+    The old column is emptied rather than dropped; sqlite can't drop a column that's part of a foreign key.
+    """
+    if "target_id" not in get_columns(connection, "searchsploit_result"):
+        return
+
+    connection.execute(
+        text(
+            "INSERT INTO searchsploit_association (searchsploit_result_id, target_id) "
+            "SELECT id, target_id FROM searchsploit_result WHERE target_id IS NOT NULL"
+        )
+    )
+    connection.execute(text("UPDATE searchsploit_result SET target_id = NULL"))
+
+
+def add_screenshot_clusters(connection):
+    """ Revision 6: similar screenshots share a screenshot_cluster row (screenshot.cluster_id) instead of linking to
+    each other pairwise through the screenshot_association table
+
+    Each group of screenshots connected through the old table becomes a cluster; aquatone's cluster ids weren't kept,
+    so new ones are generated.
+    """
+    add_missing_columns(connection, "screenshot", ["cluster_id"])
+    create_missing_indexes(connection)
+
+    tables = {x[0] for x in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+
+    if "screenshot_association" not in tables:
+        return
+
+    parents = dict()
+
+    def find(screenshot_id):
+        parents.setdefault(screenshot_id, screenshot_id)
+
+        while parents[screenshot_id] != screenshot_id:
+            parents[screenshot_id] = parents[parents[screenshot_id]]
+            screenshot_id = parents[screenshot_id]
+
+        return screenshot_id
+
+    pairs = connection.execute(
+        text("SELECT screenshot_id, similar_page_id FROM screenshot_association WHERE similar_page_id IS NOT NULL")
+    )
+
+    for screenshot_id, similar_page_id in pairs:
+        parents[find(screenshot_id)] = find(similar_page_id)
+
+    clusters = dict()
+
+    for screenshot_id in list(parents):
+        clusters.setdefault(find(screenshot_id), list()).append(screenshot_id)
+
+    for members in clusters.values():
+        cluster_id = connection.execute(
+            text("INSERT INTO screenshot_cluster (uuid) VALUES (:uuid)"), {"uuid": str(uuid.uuid4())}
+        ).lastrowid
+        connection.execute(
+            text("UPDATE screenshot SET cluster_id = :cluster_id WHERE id = :id"),
+            [{"cluster_id": cluster_id, "id": x} for x in members],
+        )
+
+    connection.execute(text("DROP TABLE screenshot_association"))
+
+
+MIGRATIONS = {
+    1: create_missing_indexes,
+    2: add_host_columns,
+    3: move_screenshots_to_blob_store,
+    4: add_packed_ip_address_columns,
+    5: add_searchsploit_association,
+    6: add_screenshot_clusters,
+}
+
+SCHEMA_VERSION = max(MIGRATIONS)
+
+
+def get_schema_version(connection):
+    """ Simple helper that returns the schema revision of the connected database """
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+def migrate(engine):
+    """ Bring the database behind ``engine`` up to SCHEMA_VERSION.
+
+    Returns:
+        list of the revisions that were applied
+    """
+    with engine.connect() as connection:
+        if get_schema_version(connection) >= SCHEMA_VERSION:
+            return []
+
+    with engine.begin() as connection:
+        # pysqlite doesn't begin a transaction ahead of DDL; begin explicitly so that a migration is applied atomically
+        # and concurrent processes opening the same database wait on each other instead of migrating twice
+        connection.execute(text("BEGIN IMMEDIATE"))
+
+        version = get_schema_version(connection)
+        applied = [revision for revision in sorted(MIGRATIONS) if revision > version]
+        vacuum = False
+
+        for revision in applied:
+            vacuum = MIGRATIONS.get(revision)(connection) or vacuum
+
+        connection.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+
+    if vacuum:
+        # can't run inside a transaction; a failure (i.e. a long running reader) only leaves the file larger
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("VACUUM"))
+        except exc.OperationalError as e:
+            logging.warning(f"VACUUM after migrating {engine.url.database} failed: {e}")
+
+    return applied
+
+
+def migrate_database_dir(database_dir=None):
+    """ Upgrade every database in the given directory (default: defaults["database-dir"]) in place """
+    # imported here; db_manager imports this module
+    from .db_manager import DBManager
+
+    for location in sorted(Path(database_dir or defaults.get("database-dir")).expanduser().iterdir()):
+        if not location.is_file() or location.name.endswith(("-wal", "-shm", "-journal")):
+            continue
+
+        with location.open("rb") as f:
+            if f.read(16) != b"SQLite format 3\x00":
+                continue
+
+        db_mgr = DBManager(db_location=location)  # migrates on open
+        db_mgr.close()
+
+        print(f"[+] {location} is at schema revision {SCHEMA_VERSION}")
+
+
+if __name__ == "__main__":
+    migrate_database_dir()
@@ -1,6 +1,6 @@
 import textwrap
 
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy import Column, Integer, ForeignKey, String, Boolean
 
 from .base_model import Base
@@ -12,7 +12,8 @@ from .nse_model import nse_result_association_table
 class NmapResult(Base):
     """ Database model that describes the TARGET.nmap scan results.
 
-        Represents nmap data.
+        Represents nmap data.  The host column holds the scanned host (the last argument in the commandline), or the
+        reported address when several hosts were scanned at once with -iL.
 
         Relationships:
             ``target``: many to one -> :class:`pipeline.models.target_model.Target`
@@ -65,13 +66,20 @@ class NmapResult(Base):
     reason = Column(String)
     service = Column(String)
     product = Column(String)
-    commandline = Column(String)
+    commandline = Column(String, index=True)
+    host = Column(String, index=True)
     product_version = Column(String)
 
     port = relationship(Port)
     port_id = Column(Integer, ForeignKey("port.id"))
     ip_address = relationship(IPAddress)
     ip_address_id = Column(Integer, ForeignKey("ip_address.id"))
-    target_id = Column(Integer, ForeignKey("target.id"))
+    target_id = Column(Integer, ForeignKey("target.id"), index=True)
     target = relationship("Target", back_populates="nmap_results")
     nse_results = relationship("NSEResult", secondary=nse_result_association_table, back_populates="nmap_results")
+
+    @validates("commandline")
+    def validate_commandline(self, key, commandline):
+        """ Keep host in sync with the commandline """
+        self.host = commandline.split()[-1] if commandline else None
+        return commandline
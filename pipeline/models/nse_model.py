@@ -6,8 +6,8 @@ from .base_model import Base
 nse_result_association_table = Table(
     "nse_result_association",
     Base.metadata,
-    Column("nse_result_id", Integer, ForeignKey("nse_result.id")),
-    Column("nmap_result_id", Integer, ForeignKey("nmap_result.id")),
+    Column("nse_result_id", Integer, ForeignKey("nse_result.id"), index=True),
+    Column("nmap_result_id", Integer, ForeignKey("nmap_result.id"), index=True),
 )
 
 
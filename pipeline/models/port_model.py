@@ -1,5 +1,5 @@
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, ForeignKey, String, Table, UniqueConstraint
+from sqlalchemy import Column, Integer, ForeignKey, String, Table, UniqueConstraint, Index
 
 from .base_model import Base
 
@@ -7,8 +7,8 @@ from .base_model import Base
 port_association_table = Table(
     "port_association",
     Base.metadata,
-    Column("port_id", Integer, ForeignKey("port.id")),
-    Column("target_id", Integer, ForeignKey("target.id")),
+    Column("port_id", Integer, ForeignKey("port.id"), index=True),
+    Column("target_id", Integer, ForeignKey("target.id"), index=True),
 )
 
 
@@ -20,7 +20,11 @@ class Port(Base):
     """
 
     __tablename__ = "port"
-    __table_args__ = (UniqueConstraint("protocol", "port_number"),)  # combination of proto/port == unique
+    __table_args__ = (
+        UniqueConstraint("protocol", "port_number"),  # combination of proto/port == unique
+        # the unique constraint already indexes (protocol, port_number); this one serves lookups by port number alone
+        Index("ix_port_port_number_protocol", "port_number", "protocol"),
+    )
 
     id = Column(Integer, primary_key=True)
     protocol = Column("protocol", String)
@@ -0,0 +1,21 @@
+from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String
+
+from .base_model import Base
+
+
+class ScreenshotCluster(Base):
+    """ Database model that describes a group of visually similar pages, as found by aquatone.
+
+        Represents one of aquatone's pageSimilarityClusters; uuid is the id aquatone gave the cluster.  Each
+        Screenshot belongs to at most one cluster.
+
+        Relationships:
+            ``screenshots``: one to many -> :class:`pipeline.models.screenshot_model.Screenshot`
+    """
+
+    __tablename__ = "screenshot_cluster"
+
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String, unique=True)
+    screenshots = relationship("Screenshot", back_populates="cluster")
@@ -1,21 +1,17 @@
-from sqlalchemy.orm import relationship, relation
-from sqlalchemy import Column, Integer, ForeignKey, LargeBinary, Table, String
+from sqlalchemy.orm import relationship, object_session, foreign, remote
+from sqlalchemy import Column, Integer, ForeignKey, String, and_
 
 from .base_model import Base
-
-
-screenshot_association_table = Table(
-    "screenshot_association",
-    Base.metadata,
-    Column("screenshot_id", Integer, ForeignKey("screenshot.id")),
-    Column("similar_page_id", Integer, ForeignKey("screenshot.id")),
-)
+from .blob_store import get_blob_store
+from .screenshot_cluster_model import ScreenshotCluster  # noqa: F401
 
 
 class Screenshot(Base):
     """ Database model that describes a screenshot of a given webpage hosted on a ``Target``.
 
-        Represents aquatone data.
+        Represents aquatone data.  The png itself lives in the database's
+        :class:`pipeline.models.blob_store.BlobStore`; the row keeps its sha256 digest, size, and dimensions, and
+        ``image`` reads the bytes from the blob store on access.
 
         Relationships:
             ``port``: one to one -> :class:`pipeline.models.port_model.Port`
@@ -24,26 +20,38 @@ class Screenshot(Base):
 
             ``endpoint``: one to one -> :class:`pipeline.models.endpoint_model.Endpoint`
 
-            ``similar_pages``: black magic -> :class:`pipeline.models.screenshot_model.Screenshot`
+            ``cluster``: many to one -> :class:`pipeline.models.screenshot_cluster_model.ScreenshotCluster`
+
+            ``similar_pages``: many to many (read only) -> :class:`pipeline.models.screenshot_model.Screenshot`; the
+            other Screenshots in the same cluster
     """
 
     __tablename__ = "screenshot"
 
+    @property
+    def image(self):
+        """ The screenshot's png bytes, read from the blob store of the database this Screenshot was loaded from """
+        if self.digest is None:
+            return None
+
+        return get_blob_store(object_session(self).bind.url.database).get(self.digest)
+
     id = Column(Integer, primary_key=True)
-    image = Column(LargeBinary)
+    digest = Column(String)
+    size = Column(Integer)
+    width = Column(Integer)
+    height = Column(Integer)
     url = Column(String, unique=True)
 
     port = relationship("Port")
     port_id = Column(Integer, ForeignKey("port.id"))
-    target_id = Column(Integer, ForeignKey("target.id"))
+    target_id = Column(Integer, ForeignKey("target.id"), index=True)
     target = relationship("Target", back_populates="screenshots")
     endpoint = relationship("Endpoint")
     endpoint_id = Column(Integer, ForeignKey("endpoint.id"))
+    cluster_id = Column(Integer, ForeignKey("screenshot_cluster.id"), index=True)
+    cluster = relationship("ScreenshotCluster", back_populates="screenshots")
 
-    similar_pages = relation(
-        "Screenshot",
-        secondary=screenshot_association_table,
-        primaryjoin=screenshot_association_table.c.screenshot_id == id,
-        secondaryjoin=screenshot_association_table.c.similar_page_id == id,
-        backref="similar_to",
+    similar_pages = relationship(
+        "Screenshot", primaryjoin=and_(foreign(remote(cluster_id)) == cluster_id, remote(id) != id), viewonly=True,
     )
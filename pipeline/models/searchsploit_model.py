@@ -2,10 +2,17 @@ import textwrap
 from pathlib import Path
 
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, ForeignKey, String
+from sqlalchemy import Column, Integer, ForeignKey, String, Table
 
 from .base_model import Base
 
+searchsploit_association_table = Table(
+    "searchsploit_association",
+    Base.metadata,
+    Column("searchsploit_result_id", Integer, ForeignKey("searchsploit_result.id"), index=True),
+    Column("target_id", Integer, ForeignKey("target.id"), index=True),
+)
+
 
 class SearchsploitResult(Base):
     """ Database model that describes results from running searchsploit --nmap TARGET.xml.
@@ -13,7 +20,7 @@ class SearchsploitResult(Base):
         Represents searchsploit data.
 
         Relationships:
-            ``target``: many to one -> :class:`pipeline.models.target_model.Target`
+            ``targets``: many to many -> :class:`pipeline.models.target_model.Target`
     """
 
     __tablename__ = "searchsploit_result"
@@ -55,5 +62,4 @@ class SearchsploitResult(Base):
     title = Column(String, unique=True)
     path = Column(String)
     type = Column(String)
-    target_id = Column(Integer, ForeignKey("target.id"))
-    target = relationship("Target", back_populates="searchsploit_results")
+    targets = relationship("Target", secondary=searchsploit_association_table, back_populates="searchsploit_results")
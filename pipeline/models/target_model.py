@@ -3,6 +3,7 @@ from sqlalchemy import Column, Integer, String, Boolean
 
 from .base_model import Base
 from .port_model import port_association_table
+from .searchsploit_model import searchsploit_association_table
 from .technology_model import technology_association_table
 
 
@@ -16,7 +17,7 @@ class Target(Base):
 
         ``nmap_results``: one to many -> :class:`pipeline.models.nmap_model.NmapResult`
 
-        ``searchsploit_results``: one to many -> :class:`pipeline.models.searchsploit_model.SearchsploitResult`
+        ``searchsploit_results``: many to many -> :class:`pipeline.models.searchsploit_model.SearchsploitResult`
 
         ``endpoints``: one to many -> :class:`pipeline.models.endpoint_model.Endpoint`
 
@@ -37,6 +38,8 @@ class Target(Base):
     ip_addresses = relationship("IPAddress", back_populates="target")
     screenshots = relationship("Screenshot", back_populates="target")
     nmap_results = relationship("NmapResult", back_populates="target")
-    searchsploit_results = relationship("SearchsploitResult", back_populates="target")
+    searchsploit_results = relationship(
+        "SearchsploitResult", secondary=searchsploit_association_table, back_populates="targets"
+    )
     open_ports = relationship("Port", secondary=port_association_table, back_populates="targets")
     technologies = relationship("Technology", secondary=technology_association_table, back_populates="targets")
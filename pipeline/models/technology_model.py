@@ -7,8 +7,8 @@ from .base_model import Base
 technology_association_table = Table(
     "technology_association",
     Base.metadata,
-    Column("technology_id", Integer, ForeignKey("technology.id")),
-    Column("target_id", Integer, ForeignKey("target.id")),
+    Column("technology_id", Integer, ForeignKey("technology.id"), index=True),
+    Column("target_id", Integer, ForeignKey("target.id"), index=True),
 )
 
 
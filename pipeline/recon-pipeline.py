@@ -5,6 +5,7 @@ import sys
 import shlex
 import shutil
 import pickle
+import ipaddress
 import selectors
 import tempfile
 import threading
@@ -13,6 +14,7 @@ import webbrowser
 from pathlib import Path
 
 DEFAULT_PROMPT = "recon-pipeline> "
+SQLITE_SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
 
 # fix up the PYTHONPATH so we can simply execute the shell from wherever in the filesystem
 os.environ["PYTHONPATH"] = f"{os.environ.get('PYTHONPATH')}:{str(Path(__file__).expanduser().resolve().parents[1])}"
@@ -53,6 +55,7 @@ cluge_package_imports(name=__name__, package=__package__)
 from .recon.config import defaults  # noqa: F401,E402
 from .models.nse_model import NSEResult  # noqa: F401,E402
 from .models.db_manager import DBManager  # noqa: F401,E402
+from .models.blob_store import get_blob_store  # noqa: F401,E402
 from .models.nmap_model import NmapResult  # noqa: F401,E402
 from .models.technology_model import Technology  # noqa: F401,E402
 from .models.searchsploit_model import SearchsploitResult  # noqa: F401,E402
@@ -386,6 +389,12 @@ class ReconShell(cmd2.Cmd):
         dbdir = defaults.get("database-dir")
 
         for db in sorted(Path(dbdir).iterdir()):
+            if db.name.endswith(SQLITE_SIDECAR_SUFFIXES):
+                # write-ahead log / shared memory files that live alongside a database in WAL mode
+                continue
+            if db.is_dir():
+                # a database's screenshot blob store
+                continue
             yield db
 
     def database_list(self, args):
@@ -412,7 +421,7 @@ class ReconShell(cmd2.Cmd):
             new_location = str(Path(defaults.get("database-dir")) / location)
             index = sorted([new_location] + locations[:-1]).index(new_location) + 1
 
-            self.db_mgr = DBManager(db_location=new_location)
+            self.db_mgr = DBManager(db_location=new_location, read_only=True)
 
             self.poutput(style(f"[*] created database @ {new_location}", fg="bright_yellow"))
 
@@ -420,7 +429,7 @@ class ReconShell(cmd2.Cmd):
 
         else:
             index = locations.index(location) + 1
-            self.db_mgr = DBManager(db_location=location)
+            self.db_mgr = DBManager(db_location=location, read_only=True)
 
         self.add_dynamic_parser_arguments()
 
@@ -486,6 +495,13 @@ class ReconShell(cmd2.Cmd):
 
         Path(to_delete).unlink()
 
+        for suffix in SQLITE_SIDECAR_SUFFIXES:
+            sidecar = Path(f"{to_delete}{suffix}")
+            if sidecar.exists():
+                sidecar.unlink()
+
+        shutil.rmtree(get_blob_store(to_delete).root, ignore_errors=True)
+
         if f"[db-{index}]" in self.prompt:
             self.poutput(style(f"[*] detached from sqlite database at {self.db_mgr.location}", fg="bright_yellow"))
             self.prompt = DEFAULT_PROMPT
@@ -510,7 +526,15 @@ class ReconShell(cmd2.Cmd):
         results = list()
         printer = self.ppaged if args.paged else self.poutput
 
-        if args.type == "ipv4":
+        if args.cidr is not None:
+            try:
+                targets = self.db_mgr.get_ip_addresses_by_cidr(args.cidr)
+            except ValueError as e:
+                return self.poutput(style(f"[!] {e}", fg="bright_red"))
+
+            # a network only holds addresses of its own version; domain names never match
+            targets = [x for x in targets if args.type in (None, f"ipv{ipaddress.ip_address(x).version}")]
+        elif args.type == "ipv4":
             targets = self.db_mgr.get_all_ipv4_addresses()
         elif args.type == "ipv6":
             targets = self.db_mgr.get_all_ipv6_addresses()
@@ -519,10 +543,14 @@ class ReconShell(cmd2.Cmd):
         else:
             targets = self.db_mgr.get_all_targets()
 
+        if args.vuln_to_subdomain_takeover:
+            vulnerable = set()
+            for tgt, addresses in self.db_mgr.get_targets_with_addresses(vuln_to_sub_takeover=True):
+                vulnerable.update([tgt.hostname, *addresses])
+
         for target in targets:
             if args.vuln_to_subdomain_takeover:
-                tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(target)
-                if not tgt.vuln_to_sub_takeover:
+                if target not in vulnerable:
                     # skip targets that aren't vulnerable
                     continue
                 vulnstring = style("vulnerable", fg="green")
@@ -536,22 +564,11 @@ class ReconShell(cmd2.Cmd):
 
     def print_endpoint_results(self, args):
         """ Display all Endpoints from the database """
-        host_endpoints = status_endpoints = None
         printer = self.ppaged if args.paged else self.poutput
 
         color_map = {"2": "green", "3": "blue", "4": "bright_red", "5": "bright_magenta"}
 
-        if args.status_code is not None:
-            status_endpoints = self.db_mgr.get_endpoint_by_status_code(args.status_code)
-
-        if args.host is not None:
-            host_endpoints = self.db_mgr.get_endpoints_by_ip_or_hostname(args.host)
-
-        endpoints = self.db_mgr.get_all_endpoints()
-
-        for subset in [status_endpoints, host_endpoints]:
-            if subset is not None:
-                endpoints = set(endpoints).intersection(set(subset))
+        endpoints = self.db_mgr.get_endpoints(status_code=args.status_code, ip_or_host=args.host, headers=args.headers)
 
         results = list()
 
@@ -579,11 +596,8 @@ class ReconShell(cmd2.Cmd):
         results = list()
         printer = self.ppaged if args.paged else self.poutput
 
-        if args.host is not None:
-            # limit by host, if necessary
-            scans = self.db_mgr.get_nmap_scans_by_ip_or_hostname(args.host)
-        else:
-            scans = self.db_mgr.get_and_filter(NmapResult)
+        # limit by host, if necessary
+        scans = self.db_mgr.get_nmap_scans(args.host)
 
         if args.port is not None or args.product is not None:
             # limit by port, if necessary
@@ -597,7 +611,8 @@ class ReconShell(cmd2.Cmd):
 
         if args.nse_script:
             # grab the specific nse-script, check that the corresponding nmap result is one we care about, and print
-            for nse_scan in self.db_mgr.get_and_filter(NSEResult, script_id=args.nse_script):
+            scans = set(scans)
+            for nse_scan in self.db_mgr.get_nse_results_by_script_id(args.nse_script):
                 for nmap_result in nse_scan.nmap_results:
                     if nmap_result not in scans:
                         continue
@@ -633,7 +648,7 @@ class ReconShell(cmd2.Cmd):
                     continue
                 printer(f"   - {tech.text} ({tech.type})")
         else:
-            for scan in self.db_mgr.get_and_filter(Technology, **filters):
+            for scan in self.db_mgr.get_web_technologies(**filters):
                 results.append(scan.pretty(padlen=1))
 
         if results:
@@ -645,36 +660,37 @@ class ReconShell(cmd2.Cmd):
         targets = self.db_mgr.get_all_targets()
         printer = self.ppaged if args.paged else self.poutput
 
-        for ss_scan in self.db_mgr.get_and_filter(SearchsploitResult):
-            tmp_targets = set()
+        if args.host is not None:
+            host_target = self.db_mgr.get_or_create_target_by_ip_or_hostname(args.host)
 
-            if (
-                args.host is not None
-                and self.db_mgr.get_or_create_target_by_ip_or_hostname(args.host) != ss_scan.target
-            ):
-                continue
+        for ss_scan in self.db_mgr.get_all_searchsploit_results():
+            for target in ss_scan.targets:
+                tmp_targets = set()
 
-            if ss_scan.target.hostname in targets:
-                # hostname is in targets, so hasn't been reported yet
-                tmp_targets.add(ss_scan.target.hostname)  # add to this report
-                targets.remove(ss_scan.target.hostname)  # remove from targets list, having been reported
+                if args.host is not None and host_target != target:
+                    continue
 
-            for ipaddr in ss_scan.target.ip_addresses:
-                address = ipaddr.ipv4_address or ipaddr.ipv6_address
-                if address is not None and address in targets:
-                    tmp_targets.add(ipaddr.ipv4_address)
-                    targets.remove(ipaddr.ipv4_address)
+                if target.hostname in targets:
+                    # hostname is in targets, so hasn't been reported yet
+                    tmp_targets.add(target.hostname)  # add to this report
+                    targets.remove(target.hostname)  # remove from targets list, having been reported
 
-            if tmp_targets:
-                header = ", ".join(tmp_targets)
-                results.append(header)
-                results.append("=" * len(header))
+                for ipaddr in target.ip_addresses:
+                    address = ipaddr.ipv4_address or ipaddr.ipv6_address
+                    if address is not None and address in targets:
+                        tmp_targets.add(ipaddr.ipv4_address)
+                        targets.remove(ipaddr.ipv4_address)
 
-                for scan in ss_scan.target.searchsploit_results:
-                    if args.type is not None and scan.type != args.type:
-                        continue
+                if tmp_targets:
+                    header = ", ".join(tmp_targets)
+                    results.append(header)
+                    results.append("=" * len(header))
+
+                    for scan in target.searchsploit_results:
+                        if args.type is not None and scan.type != args.type:
+                            continue
 
-                    results.append(scan.pretty(fullpath=args.fullpath))
+                        results.append(scan.pretty(fullpath=args.fullpath))
 
         if results:
             printer("\n".join(results))
@@ -685,14 +701,17 @@ class ReconShell(cmd2.Cmd):
         targets = self.db_mgr.get_all_targets()
         printer = self.ppaged if args.paged else self.poutput
 
+        open_ports = dict()  # ip or hostname -> port numbers
+        for tgt, addresses, ports in self.db_mgr.get_targets_with_addresses_and_ports():
+            for ip_or_host in [tgt.hostname, *addresses]:
+                open_ports[ip_or_host] = [str(port.port_number) for port in ports]
+
         for target in targets:
             if args.host is not None and target != args.host:
                 # host specified, but it's not this particular target
                 continue
 
-            ports = [
-                str(port.port_number) for port in self.db_mgr.get_or_create_target_by_ip_or_hostname(target).open_ports
-            ]
+            ports = open_ports.get(target, list())
 
             if args.port_number and args.port_number not in ports:
                 continue
@@ -1,4 +1,6 @@
 import json
+import time
+import logging
 import subprocess
 from pathlib import Path
 
@@ -7,9 +9,132 @@ from luigi.util import inherits
 from luigi.contrib.sqla import SQLAlchemyTarget
 
 import pipeline.models.db_manager
-from .config import tool_paths
 from .targets import TargetList
-from ..models.target_model import Target
+from .config import tool_paths, defaults
+from .helpers import batched, get_file_state
+
+# seconds to wait between checks of a running amass's output for new results
+POLL_INTERVAL = 1
+
+
+def tail_amass_json(path, proc, poll_interval=POLL_INTERVAL):
+    """ Simple helper that follows amass's -json output while amass is running, yielding a list of the entries written
+    since the last check.  An empty list means nothing new turned up; the helper waits poll_interval seconds before
+    checking again.
+
+    Only complete lines are parsed; the rest of a line is picked up once amass finishes writing it.  Once proc has
+    exited, the rest of the file is read and the helper returns.  A truncated final line, as left behind by an
+    interrupted scan, is logged and skipped.
+    """
+    path = Path(path)
+
+    while not path.exists():
+        if proc.poll() is not None:
+            return  # amass exited without writing anything
+        time.sleep(poll_interval)
+
+    with open(path) as f:
+        partial = ""
+
+        while True:
+            # check before reading, so that everything amass wrote before exiting is read on the last pass
+            running = proc.poll() is None
+            entries = list()
+
+            for line in iter(f.readline, ""):
+                line, partial = partial + line, ""
+
+                if not line.endswith("\n"):
+                    partial = line  # amass is still writing it
+                    break
+
+                if line.strip():
+                    entries.append(json.loads(line))
+
+            if not running:
+                if partial.strip():
+                    try:
+                        entries.append(json.loads(partial))
+                    except json.JSONDecodeError:
+                        logging.warning(f"Skipping truncated amass entry at the end of {path}")
+
+                if entries:
+                    yield entries
+
+                return
+
+            yield entries
+
+            if not entries:
+                time.sleep(poll_interval)
+
+
+def add_amass_entries(db_mgr, entries, commit=True):
+    """ Simple helper that adds each of amass's names as a web Target, along with the ip addresses it resolved to """
+    db_mgr.bulk_get_or_create_targets((entry.get("name") for entry in entries), is_web=True, commit=False)
+    db_mgr.bulk_add_ip_addresses(
+        ((entry.get("name"), address.get("ip")) for entry in entries for address in entry.get("addresses")),
+        commit=commit,
+    )
+
+
+def run_amass(db_mgr, hostnames, output_path, exempt_list=""):
+    """ Simple helper that runs amass against hostnames, adding its results to the database while it runs.
+
+    Each time amass's output goes quiet (or a full batch has built up) the names and addresses found so far are
+    committed, so that they can be queried and scanned long before a -brute enumeration finishes.  The output file is
+    then recorded as ingested, which lets ParseAmassOutput skip parsing it a second time.
+    """
+    output_path = Path(output_path)
+    amass_input_file = output_path.parent / "input-from-targetlist"
+
+    with open(amass_input_file, "w") as f:
+        for hostname in hostnames:
+            f.write(f"{hostname}\n")
+
+    command = [
+        f"{tool_paths.get('amass')}",
+        "enum",
+        "-active",
+        "-ip",
+        "-brute",
+        "-min-for-recursive",
+        "3",
+        "-df",
+        str(amass_input_file),
+        "-json",
+        str(output_path),
+    ]
+
+    if exempt_list:
+        command.append("-blf")  # Path to a file providing blacklisted subdomains
+        command.append(exempt_list)
+
+    batch_size = int(defaults.get("database-batch-size"))
+
+    with subprocess.Popen(command) as proc:
+        try:
+            pending = list()
+
+            for entries in tail_amass_json(output_path, proc):
+                pending.extend(entries)
+
+                if pending and (not entries or len(pending) >= batch_size):
+                    add_amass_entries(db_mgr, pending)
+                    pending = list()
+
+            if pending:
+                add_amass_entries(db_mgr, pending)
+        except BaseException:
+            proc.kill()  # don't wait on an hours long enumeration whose results can't be stored
+            raise
+
+    amass_input_file.unlink()
+
+    state = get_file_state(output_path)
+
+    if state is not None:
+        db_mgr.set_file_ingested(str(output_path), *state)
 
 
 @inherits(TargetList)
@@ -76,6 +201,8 @@ class AmassScan(luigi.Task):
     def run(self):
         """ Defines the options/arguments sent to amass after processing.
 
+        amass's results are added to the database while it runs, see run_amass.
+
         Returns:
             list: list of options/arguments, beginning with the name of the executable to run
         """
@@ -84,36 +211,13 @@ class AmassScan(luigi.Task):
 
         hostnames = self.db_mgr.get_all_hostnames()
 
-        if hostnames:
-            # TargetList generated some domains for us to scan with amass
-            amass_input_file = self.results_subfolder / "input-from-targetlist"
-            with open(amass_input_file, "w") as f:
-                for hostname in hostnames:
-                    f.write(f"{hostname}\n")
-        else:
+        if not hostnames:
             return subprocess.run(f"touch {self.output().path}".split())
 
-        command = [
-            f"{tool_paths.get('amass')}",
-            "enum",
-            "-active",
-            "-ip",
-            "-brute",
-            "-min-for-recursive",
-            "3",
-            "-df",
-            str(amass_input_file),
-            "-json",
-            self.output().path,
-        ]
-
-        if self.exempt_list:
-            command.append("-blf")  # Path to a file providing blacklisted subdomains
-            command.append(self.exempt_list)
-
-        subprocess.run(command)
+        # TargetList generated some domains for us to scan with amass
+        run_amass(self.db_mgr, hostnames, self.output().path, self.exempt_list)
 
-        amass_input_file.unlink()
+        self.db_mgr.close()
 
 
 @inherits(AmassScan)
@@ -182,24 +286,19 @@ class ParseAmassOutput(luigi.Task):
         """
         self.results_subfolder.mkdir(parents=True, exist_ok=True)
 
-        if Path(self.input().path).stat().st_size == 0:
+        state = get_file_state(self.input().path)
+
+        if state[0] == 0 or self.db_mgr.get_ingested_files().get(self.input().path) == state:
+            # nothing found, or AmassScan already added everything in the file while amass was running
             self.output().touch()
-            return
+            return self.db_mgr.close()
 
         amass_json = self.input().open()
 
         with amass_json as amass_json_file:
-            for line in amass_json_file:
-                entry = json.loads(line)
-
-                tgt = self.db_mgr.get_or_create(Target, hostname=entry.get("name"), is_web=True)
-
-                for address in entry.get("addresses"):
-                    ipaddr = address.get("ip")
+            for batch in batched(amass_json_file, int(defaults.get("database-batch-size"))):
+                add_amass_entries(self.db_mgr, [json.loads(line) for line in batch if line.strip()])
 
-                    tgt = self.db_mgr.add_ipv4_or_v6_address_to_target(tgt, ipaddr)
-
-                self.db_mgr.add(tgt)
-                self.output().touch()
+            self.output().touch()
 
             self.db_mgr.close()
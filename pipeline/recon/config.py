@@ -5,11 +5,26 @@ from pathlib import Path
 defaults = {
     "proxy": "",
     "threads": "10",
+    "parse-workers": "0",
     "masscan-rate": "1000",
     "masscan-iface": "tun0",
+    "masscan-batch-size": "256",
+    "masscan-batch-interval": "60",
+    "nmap-hosts-per-scan": "32",
+    "nmap-ports-per-scan": "256",
+    "nmap-load-limit": "1.5",
     "gobuster-extensions": "",
     "results-dir": "recon-results",
     "aquatone-scan-timeout": "900",
+    "database-batch-size": "1000",
+    "database-commit-interval": "5",
+    "database-journal-mode": "wal",
+    "database-synchronous": "normal",
+    "database-busy-timeout": "30000",
+    "database-mmap-size": "268435456",
+    "database-cache-size": "-65536",
+    "database-temp-store": "memory",
+    "database-target-cache-size": "0",
     "tools-dir": f"{Path.home()}/.local/recon-pipeline/tools",
     "database-dir": f"{Path.home()}/.local/recon-pipeline/databases",
 }
@@ -0,0 +1,119 @@
+import csv
+import pickle
+import logging
+from pathlib import Path
+
+from .helpers import get_file_state
+from .config import defaults, tool_paths
+
+# exploit-db's index of exploits, kept next to the searchsploit script in the exploitdb checkout
+EXPLOITDB_CSV = "files_exploits.csv"
+
+
+def get_exploitdb_csv():
+    """ Simple helper that returns the location of the exploitdb checkout's files_exploits.csv """
+    return Path(tool_paths.get("searchsploit")).expanduser().parent / EXPLOITDB_CSV
+
+
+def get_search_terms(service, product, version):
+    """ Simple helper that returns what searchsploit --nmap searches for a single nmap service
+
+    searchsploit reads a service's name, product, and version attributes in that order; the product replaces the name
+    and the version is appended to whichever of the two it has.  Search terms are lower case.
+    """
+    software = product or service
+
+    if software and version:
+        software = f"{software} {version}"
+
+    return (software or "").lower()
+
+
+class ExploitIndex:
+    """ In-process title search over exploit-db's files_exploits.csv, standing in for one searchsploit process per nmap
+    .xml file.
+
+    Searches follow ``searchsploit -t -v``: an exploit matches when every whitespace separated search term appears,
+    case insensitively, somewhere in its title.  When nothing matches, the last term is dropped and the search is
+    repeated until something does or no terms are left.  Results of each distinct search are remembered.
+
+    Args:
+        exploits: list of (lower cased title, type, title, path) tuples
+    """
+
+    def __init__(self, exploits):
+        self.exploits = exploits
+        self.searches = dict()
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        """ Build an index from an exploit-db csv; paths are made absolute, as searchsploit -v reports them """
+        exploits = list()
+
+        with open(csv_path, newline="", encoding="utf-8", errors="replace") as f:
+            for row in csv.DictReader(f):
+                title, path = row.get("description") or "", csv_path.parent / (row.get("file") or "")
+                exploits.append((title.lower(), row.get("type"), title, str(path)))
+
+        return cls(exploits)
+
+    @classmethod
+    def load(cls, csv_path=None, cache_path=None):
+        """ Return the index for the given exploit-db csv (default: the exploitdb checkout's), reusing the one pickled
+        at cache_path (default: tools-dir/.exploit-index.pkl) unless the csv has changed since it was built
+        """
+        csv_path = Path(csv_path or get_exploitdb_csv()).expanduser().resolve()
+        cache_path = Path(cache_path or Path(defaults.get("tools-dir")) / ".exploit-index.pkl").expanduser()
+        state = get_file_state(csv_path)
+
+        try:
+            cached = pickle.loads(cache_path.read_bytes())
+
+            if cached.get("csv") == str(csv_path) and cached.get("state") == state:
+                return cls(cached.get("exploits"))
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            pass  # no usable cache; build a new one
+
+        index = cls.from_csv(csv_path)
+
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_bytes(pickle.dumps({"csv": str(csv_path), "state": state, "exploits": index.exploits}))
+        except OSError as e:
+            logging.warning(f"Couldn't cache the exploit index at {cache_path}: {e}")
+
+        return index
+
+    def search(self, software):
+        """ Return (type, title, path) for every exploit matching the search terms in software, dropping the last term
+        until there's a match
+        """
+        terms = software.lower().split()
+
+        while terms:
+            results = self.match(tuple(terms))
+
+            if results:
+                return results
+
+            terms.pop()
+
+        return list()
+
+    def match(self, terms):
+        """ Return (type, title, path) for every exploit whose title contains all of the given terms """
+        return [exploit[1:] for exploit in self.filter(terms)]
+
+    def filter(self, terms):
+        """ Return the exploits whose titles contain all of the given terms, narrowing the (remembered) exploits that
+        match all but the last term
+        """
+        if terms not in self.searches:
+            exploits = self.filter(terms[:-1]) if len(terms) > 1 else self.exploits
+            self.searches[terms] = [exploit for exploit in exploits if terms[-1] in exploit[0]]
+
+        return self.searches.get(terms)
+
+    def search_service(self, service, product, version):
+        """ Return (type, title, path) for every exploit searchsploit --nmap would report for a single nmap service """
+        return self.search(get_search_terms(service, product, version))
@@ -4,6 +4,7 @@ import pkgutil
 import importlib
 import ipaddress
 from pathlib import Path
+from functools import lru_cache
 from collections import defaultdict
 
 
@@ -50,6 +51,7 @@ def get_scans():
     return scans
 
 
+@lru_cache(maxsize=65536)
 def is_ip_address(ipaddr):
     """ Simple helper to determine if given string is an ip address or subnet """
     try:
@@ -59,6 +61,7 @@ def is_ip_address(ipaddr):
         return False
 
 
+@lru_cache(maxsize=65536)
 def get_ip_address_version(ipaddr):
     """ Simple helper to determine whether a given ip address is ipv4 or ipv6 """
     if is_ip_address(ipaddr):
@@ -66,3 +69,28 @@ def get_ip_address_version(ipaddr):
             return "4"
         elif isinstance(ipaddress.ip_address(ipaddr), ipaddress.IPv6Address):  # ipv6
             return "6"
+
+
+def batched(iterable, size):
+    """ Simple helper to split an iterable into lists of at most size items """
+    batch = list()
+
+    for item in iterable:
+        batch.append(item)
+
+        if len(batch) >= size:
+            yield batch
+            batch = list()
+
+    if batch:
+        yield batch
+
+
+def get_file_state(path):
+    """ Simple helper that returns a file's (size, mtime_ns), used to tell whether it changed; None if it's missing """
+    try:
+        stat = Path(path).stat()
+    except FileNotFoundError:
+        return None
+
+    return stat.st_size, stat.st_mtime_ns
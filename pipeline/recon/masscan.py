@@ -1,21 +1,274 @@
 import json
+import time
+import shutil
 import logging
+import ipaddress
 import subprocess
 from pathlib import Path
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import luigi
 from luigi.util import inherits
 from luigi.contrib.sqla import SQLAlchemyTarget
 
 import pipeline.models.db_manager
+from .helpers import batched
 from .targets import TargetList
-from .amass import ParseAmassOutput
-from ..models.port_model import Port
-from ..models.ip_address_model import IPAddress
+from .amass import AmassScan, ParseAmassOutput, run_amass
 
 from .config import top_tcp_ports, top_udp_ports, defaults, tool_paths, web_ports
 
 
+# masscan -oJ wraps its records in a json array, separated by commas; between records we only skip these
+JSON_SEPARATORS = " \t\r\n[],"
+
+# read results files this many bytes/characters at a time
+READ_SIZE = 64 * 1024
+
+# masscan -oB records; the file header and trailer are both fixed size records that start with 'm'
+BINARY_SIGNATURE = b"masscan/"
+BINARY_HEADER_SIZE = 2 + ord("a")
+BINARY_OPEN, BINARY_OPEN2, BINARY_OPEN6 = 1, 6, 10
+BINARY_BANNER3, BINARY_BANNER4, BINARY_BANNER5, BINARY_BANNER9, BINARY_BANNER6 = 3, 4, 5, 9, 13
+IP_PROTOCOLS = {1: "icmp", 6: "tcp", 17: "udp", 132: "sctp"}
+
+# seconds to wait between checks for newly resolved addresses while amass is running
+POLL_INTERVAL = 5
+
+MasscanRecord = namedtuple("MasscanRecord", ["ip", "proto", "port", "ttl", "banner"])
+
+
+def read_masscan_json(path):
+    """ Simple helper that yields a MasscanRecord per open port/banner in a masscan -oJ file, one record at a time.
+
+    Only a single record (plus one read) is held in memory.  A truncated final record, as left behind by an interrupted
+    scan, is logged and skipped; anything that isn't masscan json raises json.JSONDecodeError.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(path) as f:
+        buffer, pos, eof = "", 0, False
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in JSON_SEPARATORS:
+                pos += 1
+
+            if pos == len(buffer):
+                if eof:
+                    return
+                buffer, pos = f.read(READ_SIZE), 0
+                eof = not buffer
+                continue
+
+            if buffer[pos] != "{":
+                raise json.JSONDecodeError("Expecting value", buffer, pos)
+
+            try:
+                entry, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    return logging.warning(f"Skipping truncated masscan record at the end of {path}")
+
+                # the record continues in the next read
+                data = f.read(READ_SIZE)
+                buffer, pos, eof = buffer[pos:] + data, 0, not data
+                continue
+
+            for port_entry in entry.get("ports", list()):
+                if port_entry.get("status") not in (None, "open"):
+                    continue
+
+                yield MasscanRecord(
+                    entry.get("ip"),
+                    port_entry.get("proto"),
+                    port_entry.get("port"),
+                    port_entry.get("ttl"),
+                    (port_entry.get("service") or dict()).get("banner"),
+                )
+
+
+def read_masscan_list(path):
+    """ Simple helper that yields a MasscanRecord per open port/banner line in a masscan -oL file; ttl isn't recorded
+    in that format and is always None
+    """
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split(" ", 6)
+
+            if fields[0] not in ("open", "banner") or len(fields) < 5 or not fields[2].isdigit():
+                continue  # comments and the truncated final line of an interrupted scan
+
+            banner = fields[6] if fields[0] == "banner" and len(fields) == 7 else None
+
+            yield MasscanRecord(fields[3], fields[1], int(fields[2]), None, banner)
+
+
+def parse_binary_record(record_type, data):
+    """ Simple helper that turns the body of a masscan -oB record into a MasscanRecord; None for types we don't keep """
+    if record_type == BINARY_OPEN and len(data) >= 12:
+        ip, port, ttl = data[4:8], int.from_bytes(data[8:10], "big"), data[11]
+        return MasscanRecord(str(ipaddress.IPv4Address(ip)), "tcp", port, ttl, None)
+
+    if record_type == BINARY_OPEN2 and len(data) >= 13:
+        ip, proto, port, ttl = data[4:8], data[8], int.from_bytes(data[9:11], "big"), data[12]
+        return MasscanRecord(str(ipaddress.IPv4Address(ip)), IP_PROTOCOLS.get(proto), port, ttl, None)
+
+    if record_type == BINARY_OPEN6 and len(data) >= 25:
+        proto, port, ttl, ip = data[4], int.from_bytes(data[5:7], "big"), data[8], data[9:25]
+        return MasscanRecord(str(ipaddress.IPv6Address(ip)), IP_PROTOCOLS.get(proto), port, ttl, None)
+
+    if record_type == BINARY_BANNER3 and len(data) >= 12:
+        ip, port, banner = data[4:8], int.from_bytes(data[8:10], "big"), data[12:]
+        return MasscanRecord(str(ipaddress.IPv4Address(ip)), "tcp", port, None, banner.decode(errors="replace"))
+
+    if record_type in (BINARY_BANNER4, BINARY_BANNER5) and len(data) >= 13:
+        ip, proto, port, banner = data[4:8], data[8], int.from_bytes(data[9:11], "big"), data[13:]
+        return MasscanRecord(
+            str(ipaddress.IPv4Address(ip)), IP_PROTOCOLS.get(proto), port, None, banner.decode(errors="replace")
+        )
+
+    if record_type == BINARY_BANNER9 and len(data) >= 14:
+        ip, proto, port, ttl, banner = data[4:8], data[8], int.from_bytes(data[9:11], "big"), data[13], data[14:]
+        return MasscanRecord(
+            str(ipaddress.IPv4Address(ip)), IP_PROTOCOLS.get(proto), port, ttl, banner.decode(errors="replace")
+        )
+
+    if record_type == BINARY_BANNER6 and len(data) >= 26:
+        proto, port, ttl, ip, banner = data[4], int.from_bytes(data[5:7], "big"), data[9], data[10:26], data[26:]
+        return MasscanRecord(
+            str(ipaddress.IPv6Address(ip)), IP_PROTOCOLS.get(proto), port, ttl, banner.decode(errors="replace")
+        )
+
+
+def read_binary_length(f):
+    """ Simple helper that reads the length of a masscan -oB record; 7 bits per byte, a set high bit in the first byte
+    means a second byte follows.  None if the file ends first
+    """
+    first = f.read(1)
+
+    if not first:
+        return None
+
+    if not first[0] & 0x80:
+        return first[0]
+
+    second = f.read(1)
+
+    return (first[0] & 0x7F) << 7 | second[0] & 0x7F if second else None
+
+
+def read_masscan_binary(path):
+    """ Simple helper that yields a MasscanRecord per open port/banner record in a masscan -oB file.
+
+    Each record is a type byte, a 7-bit encoded length (one or two bytes) and the record body; closed ports and record
+    types we don't know are skipped.  A truncated final record is logged and skipped.
+    """
+    with open(path, "rb") as f:
+        while True:
+            record_type = f.read(1)
+
+            if not record_type:
+                return
+
+            if record_type == b"m":
+                f.read(BINARY_HEADER_SIZE - 1)  # file header/trailer
+                continue
+
+            length = read_binary_length(f)
+            data = f.read(length) if length is not None else b""
+
+            if length is None or len(data) < length:
+                return logging.warning(f"Skipping truncated masscan record at the end of {path}")
+
+            record = parse_binary_record(record_type[0], data)
+
+            if record is not None:
+                yield record
+
+
+def get_batch_number(path):
+    """ Simple helper that returns N, given the path to a masscan-batch-N.json """
+    return int(Path(path).stem.rsplit("-", 1)[1])
+
+
+def read_masscan(path):
+    """ Simple helper that yields a MasscanRecord per open port/banner in a masscan results file, whether it was written
+    with -oJ, -oL, or -oB
+    """
+    with open(path, "rb") as f:
+        start = f.read(len(BINARY_SIGNATURE))
+
+    if start == BINARY_SIGNATURE:
+        return read_masscan_binary(path)
+
+    if start.startswith((b"#", b"open ", b"banner ")):
+        return read_masscan_list(path)
+
+    return read_masscan_json(path)
+
+
+class AddressHandoff:
+    """ Hands ipv4 addresses off to masscan in batches, as they're added to the database.
+
+    Addresses are picked up in the order they were added and coalesced until batch_size of them are waiting, or the
+    oldest has waited batch_interval seconds.  Each address that's been swept is appended to swept_file, so that
+    every address is scanned only once, even across restarts.
+    """
+
+    def __init__(self, db_mgr, swept_file, batch_size=None, batch_interval=None):
+        self.db_mgr = db_mgr
+        self.swept_file = Path(swept_file)
+        self.batch_size = int(batch_size or defaults.get("masscan-batch-size"))
+        self.batch_interval = float(batch_interval or defaults.get("masscan-batch-interval"))
+
+        self.swept = set(self.swept_file.read_text().split()) if self.swept_file.exists() else set()
+        self.pending = dict()  # address -> None; insertion ordered
+        self.waiting_since = None
+        self.last_id = 0
+
+    def poll(self):
+        """ Pick up the addresses added to the database since the last poll """
+        for self.last_id, ip_address in self.db_mgr.get_ipv4_addresses_after(self.last_id):
+            if ip_address not in self.swept and ip_address not in self.pending:
+                self.pending[ip_address] = None
+
+        if self.pending and self.waiting_since is None:
+            self.waiting_since = time.monotonic()
+
+        self.db_mgr.session.commit()  # end the read transaction, so the next poll sees what's been committed since
+
+    def next_batch(self, final=False):
+        """ Returns the next batch of addresses to sweep, or an empty list if it isn't time to sweep any yet.
+
+        Once final is set (no more addresses are coming), everything that's waiting is returned as one last batch.
+        """
+        self.poll()
+
+        if not self.pending:
+            return list()
+
+        if not final and len(self.pending) < self.batch_size:
+            if time.monotonic() - self.waiting_since < self.batch_interval:
+                return list()
+
+        batch = list(self.pending) if final else list(self.pending)[: self.batch_size]
+
+        for ip_address in batch:
+            del self.pending[ip_address]
+
+        self.waiting_since = time.monotonic() if self.pending else None
+
+        return batch
+
+    def mark_swept(self, batch):
+        """ Record a batch of addresses as swept """
+        with open(self.swept_file, "a") as f:
+            f.write("".join(f"{ip_address}\n" for ip_address in batch))
+
+        self.swept.update(batch)
+
+
 @inherits(TargetList, ParseAmassOutput)
 class MasscanScan(luigi.Task):
     """ Run ``masscan`` against a target specified via the TargetList Task.
@@ -61,6 +314,7 @@ class MasscanScan(luigi.Task):
         super().__init__(*args, **kwargs)
         self.db_mgr = pipeline.models.db_manager.DBManager(db_location=self.db_location)
         self.results_subfolder = (Path(self.results_dir) / "masscan-results").expanduser().resolve()
+        self.batch_number = 0  # N of the next masscan-batch-N.json
 
     def output(self):
         """ Returns the target output for this task.
@@ -77,6 +331,11 @@ class MasscanScan(luigi.Task):
     def run(self):
         """ Defines the options/arguments sent to masscan after processing.
 
+        When there are domains for amass to enumerate, amass is started alongside masscan rather than ahead of it.  The
+        ipv4 addresses it resolves are handed off to masscan in batches (see AddressHandoff) as they show up in the
+        database, so masscan doesn't sit idle for the hours a large enumeration can take.  Each batch's results go to
+        masscan-batch-N.json; once amass is done and every address has been swept, they're merged into masscan.json.
+
         Returns:
             list: list of options/arguments, beginning with the name of the executable to run
         """
@@ -97,15 +356,73 @@ class MasscanScan(luigi.Task):
 
         yield TargetList(target_file=self.target_file, results_dir=self.results_dir, db_location=self.db_location)
 
-        if self.db_mgr.get_all_hostnames():
-            # TargetList generated some domains for us to scan with amass
+        amass_args = {
+            "target_file": self.target_file,
+            "exempt_list": self.exempt_list,
+            "results_dir": self.results_dir,
+            "db_location": self.db_location,
+        }
 
-            yield ParseAmassOutput(
-                target_file=self.target_file,
-                exempt_list=self.exempt_list,
-                results_dir=self.results_dir,
-                db_location=self.db_location,
-            )
+        # TargetList generated some domains for us to scan with amass; nothing else runs it, by the time ParseAmassOutput
+        # is yielded below AmassScan's output already exists
+        hostnames = self.db_mgr.get_all_hostnames()
+        self.db_mgr.session.commit()  # hand the writer's connection back; amass writes from another thread
+
+        amass_output = Path(AmassScan(**amass_args).output().path)
+
+        # amass writes through this process' writer session from its own thread, poll through a reader instead
+        reader = pipeline.models.db_manager.DBManager(db_location=self.db_location, read_only=True)
+        handoff = AddressHandoff(reader, self.results_subfolder / "swept-ips.txt")
+
+        # batches swept by an earlier, interrupted run are kept (their addresses are in swept-ips.txt); number after them
+        self.batch_number = 1 + max(
+            map(get_batch_number, self.results_subfolder.glob("masscan-batch-*.json")), default=-1
+        )
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            running = None
+
+            if hostnames and not amass_output.exists():
+                amass_output.parent.mkdir(parents=True, exist_ok=True)
+                running = executor.submit(run_amass, self.db_mgr, hostnames, amass_output, self.exempt_list)
+
+            while True:
+                done = running is None or running.done()
+                batch = handoff.next_batch(final=done)
+
+                if batch:
+                    self.run_masscan(batch)
+                    handoff.mark_swept(batch)
+                elif done:
+                    break
+                else:
+                    time.sleep(POLL_INTERVAL)
+
+            if running is not None:
+                running.result()  # amass's exceptions
+
+        reader.close()
+
+        if hostnames:
+            if not amass_output.exists():
+                amass_output.touch()  # amass exited without finding anything
+
+            # amass's results are already in the database; this only marks them parsed
+            yield ParseAmassOutput(**amass_args)
+
+        with self.output().open("w") as merged:
+            for batch_output in sorted(self.results_subfolder.glob("masscan-batch-*.json"), key=get_batch_number):
+                with open(batch_output) as f:
+                    shutil.copyfileobj(f, merged)
+
+        self.db_mgr.close()
+
+    def run_masscan(self, ip_addresses):
+        """ Run masscan against a batch of ipv4 addresses; its results go to the next masscan-batch-N.json """
+        batch_number, self.batch_number = self.batch_number, self.batch_number + 1
+        masscan_input_file = self.results_subfolder / f"input-batch-{batch_number}"
+
+        masscan_input_file.write_text("".join(f"{ip_address}\n" for ip_address in ip_addresses))
 
         command = [
             tool_paths.get("masscan"),
@@ -117,30 +434,16 @@ class MasscanScan(luigi.Task):
             "-e",
             self.interface,
             "-oJ",
-            self.output().path,
+            str(self.results_subfolder / f"masscan-batch-{batch_number}.json"),
             "--ports",
             self.ports,
             "-iL",
+            str(masscan_input_file),
         ]
 
-        # masscan only understands how to scan ipv4
-        ip_addresses = self.db_mgr.get_all_ipv4_addresses()
-        masscan_input_file = None
-
-        if ip_addresses:
-            # TargetList generated ip addresses for us to scan with masscan
-            masscan_input_file = self.results_subfolder / "input-from-amass"
-
-            with open(masscan_input_file, "w") as f:
-                for ip_address in ip_addresses:
-                    f.write(f"{ip_address}\n")
+        subprocess.run(command)
 
-            command.append(str(masscan_input_file))
-
-        subprocess.run(command)  # will fail if no ipv4 addresses were found
-
-        if masscan_input_file is not None:
-            masscan_input_file.unlink()
+        masscan_input_file.unlink()
 
 
 @inherits(MasscanScan)
@@ -178,6 +481,7 @@ class ParseMasscanOutput(luigi.Task):
             "interface": self.interface,
             "ports": self.ports,
             "db_location": self.db_location,
+            "exempt_list": self.exempt_list,
         }
         return MasscanScan(**args)
 
@@ -194,19 +498,11 @@ class ParseMasscanOutput(luigi.Task):
         )
 
     def run(self):
-        """ Reads masscan JSON results and creates a pickled dictionary of pertinent information for processing. """
-        try:
-            # load masscan results from Masscan Task
-            entries = json.load(self.input().open())
-        except json.decoder.JSONDecodeError as e:
-            # return on exception; no output file created; pipeline should start again from
-            # this task if restarted because we never hit pickle.dump
-            return print(e)
-
+        """ Reads masscan results one record at a time and adds their open ports to the database in batches. """
         self.results_subfolder.mkdir(parents=True, exist_ok=True)
 
         """
-        populate database from the loaded JSON
+        populate database from the masscan results; -oJ, -oL, and -oB output are all understood
 
         masscan JSON structure over which we're looping
         [
@@ -216,25 +512,24 @@ class ParseMasscanOutput(luigi.Task):
         ]
         """
 
-        for entry in entries:
-            single_target_ip = entry.get("ip")
-
-            tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(single_target_ip)
+        web_targets = set()
 
-            if single_target_ip not in tgt.ip_addresses:
-                tgt.ip_addresses.append(self.db_mgr.get_or_create(IPAddress, ipv4_address=single_target_ip))
-
-            for port_entry in entry.get("ports"):
-                protocol = port_entry.get("proto")
+        try:
+            records = read_masscan(self.input().path)
 
-                port = self.db_mgr.get_or_create(Port, protocol=protocol, port_number=port_entry.get("port"))
+            for batch in batched(records, int(defaults.get("database-batch-size"))):
+                for record in batch:
+                    if str(record.port) in web_ports:
+                        web_targets.add(record.ip)
 
-                if str(port.port_number) in web_ports:
-                    tgt.is_web = True
+                self.db_mgr.bulk_add_ports((record.ip, record.proto, record.port) for record in batch)
+        except ValueError as e:
+            # return on exception; no output created; pipeline should start again from this task if restarted because
+            # we never touch the output
+            return print(e)
 
-                tgt.open_ports.append(port)
+        self.db_mgr.bulk_get_or_create_targets(web_targets, is_web=True)
 
-            self.db_mgr.add(tgt)
-            self.output().touch()
+        self.output().touch()
 
         self.db_mgr.close()
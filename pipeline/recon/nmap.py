@@ -1,26 +1,261 @@
-import ast
+import os
+import re
+import json
+import time
+import hashlib
 import logging
+import statistics
 import subprocess
 import concurrent.futures
 from pathlib import Path
+from xml.etree import ElementTree
+from contextlib import contextmanager
+from collections import namedtuple
 
 import luigi
-import sqlalchemy
 from luigi.util import inherits
-from libnmap.parser import NmapParser
 from luigi.contrib.sqla import SQLAlchemyTarget
 
 import pipeline.models.db_manager
 from .masscan import ParseMasscanOutput
+from .exploits import ExploitIndex, get_exploitdb_csv
 from .config import defaults, tool_paths
-from .helpers import get_ip_address_version, is_ip_address
+from .helpers import get_ip_address_version, is_ip_address, get_file_state, batched
 
-from ..models.port_model import Port
 from ..models.nse_model import NSEResult
-from ..models.target_model import Target
 from ..models.nmap_model import NmapResult
-from ..models.ip_address_model import IPAddress
-from ..models.searchsploit_model import SearchsploitResult
+
+# exploitdb's 15 Apr 2020 update doubled the quote closing each value, i.e.
+#   {"Title":"PHP-FPM + Nginx - Remote Code Execution"", ...
+# a "" right after the colon is an empty value and is left alone
+DOUBLED_QUOTE = re.compile(r'(?<=[^:\s])""(?=\s*[,}])')
+
+# nmap files handed to a parsing process at a time
+PARSE_CHUNK_SIZE = 8
+
+# nmap results are named nmap.HOST-PROTOCOL, with a .partN suffix when a host's ports were split over several scans;
+# scans of several hosts at once are named nmap.group-DIGEST-PROTOCOL
+NMAP_RESULTS_NAME = re.compile(r"^nmap\.(?P<host>.+)-(?:tcp|udp)(?:\.part\d+)?$")
+
+# a single nmap invocation: the name its -oA results are written under and the hosts and ports it scans
+NmapJob = namedtuple("NmapJob", ["name", "protocol", "ipv6", "hosts", "ports"])
+
+# everything parse_nmap_output needs from a single nmap service; plain tuples are cheap to send between processes
+NmapService = namedtuple(
+    "NmapService", ["address", "protocol", "port", "open", "reason", "service", "product", "version", "scripts"]
+)
+
+# a single NSE script's results when read with elements=True; elements is its elem/table output, structured the same
+# way libnmap does.  Otherwise scripts are plain (id, output) pairs
+NSEScript = namedtuple("NSEScript", ["id", "output", "elements"])
+
+
+def get_script_elements(element):
+    """ Simple helper that turns the elem/table children of an NSE script (or table) into a dict keyed on their key
+    attribute; repeated keys collect their values in a list
+    """
+    elements = dict()
+
+    for child in element:
+        if child.tag not in ("elem", "table"):
+            continue
+
+        key = child.get("key")
+        value = child.text if child.tag == "elem" else get_script_elements(child)
+
+        if key not in elements:
+            elements[key] = value
+        elif isinstance(elements[key], list):
+            elements[key].append(value)
+        else:
+            elements[key] = [elements[key], value]
+
+    return elements
+
+
+def get_nmap_commandline(path):
+    """ Simple helper that returns the commandline recorded at the top of an nmap .xml file """
+    for _, element in ElementTree.iterparse(str(path), events=("start",)):
+        return element.get("args")
+
+
+def read_nmap_xml(path, elements=False):
+    """ Simple helper that yields an NmapService per port reported in an nmap .xml file, one at a time.
+
+    The file is read with iterparse; each port's elements are discarded as soon as its NmapService is built, and each
+    host's once it ends, so memory use doesn't grow with the size of the file or its NSE output.  Each NSE script is
+    an (id, output) pair, unless elements is set, in which case it's an NSEScript that includes its elem/table output.
+    """
+    context = iter(ElementTree.iterparse(str(path), events=("start", "end")))
+    _, root = next(context)  # nmaprun
+    addresses = dict()
+
+    for event, element in context:
+        if event == "start":
+            continue
+
+        if element.tag == "address":
+            addresses[element.get("addrtype")] = element.get("addr")
+        elif element.tag == "port":
+            state = element.find("state")
+            state = state.attrib if state is not None else dict()
+            service = element.find("service")
+            service = service.attrib if service is not None else dict()
+
+            yield NmapService(
+                addresses.get("ipv4") or addresses.get("ipv6") or "",
+                element.get("protocol"),
+                int(element.get("portid")),
+                state.get("state") == "open",
+                state.get("reason", ""),
+                service.get("name", ""),
+                service.get("product"),
+                service.get("version"),
+                tuple(
+                    NSEScript(x.get("id"), x.get("output"), get_script_elements(x))
+                    if elements
+                    else (x.get("id"), x.get("output"))
+                    for x in element.iter("script")
+                ),
+            )
+
+            element.clear()
+        elif element.tag == "host":
+            addresses = dict()
+            root.clear()
+
+
+def read_searchsploit_json(lines):
+    """ Simple helper that yields (type, title, path) for each exploit in searchsploit -j output, one line at a time.
+
+    searchsploit writes each result as a json object on a line of its own, followed by a comma unless it's the last
+    one; everything else (search terms, database paths, --nmap's progress messages) is skipped.
+    """
+    decoder = json.JSONDecoder()
+
+    for line in lines:
+        start = line.find("{")
+
+        if start == -1 or '"Title"' not in line:
+            continue
+
+        try:
+            # raw_decode stops at the end of the object, ignoring a trailing comma
+            result, _ = decoder.raw_decode(line, start)
+        except json.JSONDecodeError:
+            try:
+                result, _ = decoder.raw_decode(DOUBLED_QUOTE.sub('"', line), start)
+            except json.JSONDecodeError as e:
+                logging.warning(f"Skipping unreadable searchsploit result {line.strip()}: {e}")
+                continue
+
+        yield result.get("Type"), result.get("Title"), result.get("Path")
+
+
+def parse_nmap_xml(path):
+    """ Simple helper that parses an nmap .xml file into (commandline, [NmapService, ...]).
+
+    Its results are sent back from parsing processes, so each NSE script is only an (id, output) pair.
+    """
+    return get_nmap_commandline(path), list(read_nmap_xml(path, elements=False))
+
+
+def plan_nmap_jobs(hosts, hosts_per_scan, ports_per_scan):
+    """ Simple helper that turns (host, protocol, ports) into the NmapJobs that scan them, largest first.
+
+    A host with more than ports_per_scan ports is split over several scans.  ip addresses with the same protocol and
+    ports are packed into a single scan, up to hosts_per_scan of them and ports_per_scan ports between them; hostnames
+    are always scanned on their own, so that their results can be tied back to them.
+    """
+    jobs = list()
+    packable = dict()  # (protocol, ipv6, ports) -> [ip addresses]
+
+    for host, protocol, ports in hosts:
+        ports = tuple(sorted(set(ports), key=int))
+        ipv6 = is_ip_address(host) and get_ip_address_version(host) == "6"
+
+        if len(ports) > ports_per_scan:
+            for i, start in enumerate(range(0, len(ports), ports_per_scan)):
+                chunk = ports[start : start + ports_per_scan]
+                jobs.append(NmapJob(f"nmap.{host}-{protocol}.part{i}", protocol, ipv6, (host,), chunk))
+        elif is_ip_address(host):
+            packable.setdefault((protocol, ipv6, ports), list()).append(host)
+        else:
+            jobs.append(NmapJob(f"nmap.{host}-{protocol}", protocol, ipv6, (host,), ports))
+
+    for (protocol, ipv6, ports), addresses in packable.items():
+        for group in batched(addresses, max(1, min(hosts_per_scan, ports_per_scan // len(ports)))):
+            if len(group) == 1:
+                name = f"nmap.{group[0]}-{protocol}"
+            else:
+                digest = hashlib.sha1("\n".join([*group, ",".join(ports)]).encode()).hexdigest()[:12]
+                name = f"nmap.group-{digest}-{protocol}"
+
+            jobs.append(NmapJob(name, protocol, ipv6, tuple(group), ports))
+
+    return sorted(jobs, key=lambda job: len(job.hosts) * len(job.ports), reverse=True)
+
+
+class NmapScheduler:
+    """ Runs nmap scans on a pool of threads, adapting how many run at a time to how the scans are going.
+
+    Starts out running max_workers scans at a time.  Each time a scan finishes, one fewer is run if the load average
+    per cpu is above load_limit, or if the scan took more than twice the median time per host and port so far (the
+    network or the targets are saturated); otherwise one more is run, up to max_workers.
+    """
+
+    def __init__(self, max_workers=None, load_limit=None):
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.load_limit = float(load_limit or defaults.get("nmap-load-limit"))
+        self.workers = self.max_workers
+        self.runtimes = list()  # seconds per host and port scanned
+
+    @staticmethod
+    def get_load():
+        """ Simple helper that returns the 1 minute load average per cpu; None where there isn't one """
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            return None
+
+    def record(self, job, seconds):
+        """ Adjust the number of scans run at a time, given that the job's scan took the given number of seconds """
+        runtime = seconds / (len(job.hosts) * len(job.ports))
+        slow = bool(self.runtimes) and runtime > 2 * statistics.median(self.runtimes)
+        load = self.get_load()
+
+        self.runtimes.append(runtime)
+
+        if slow or (load is not None and load > self.load_limit):
+            self.workers = max(1, self.workers - 1)
+        else:
+            self.workers = min(self.max_workers, self.workers + 1)
+
+    def run(self, func, jobs):
+        """ Yields func(job) for each of the jobs, in the order they finish, running up to self.workers at a time """
+        jobs = iter(jobs)
+        running = dict()  # future -> (job, when it started)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                while len(running) < self.workers:
+                    job = next(jobs, None)
+
+                    if job is None:
+                        break
+
+                    running[executor.submit(func, job)] = job, time.monotonic()
+
+                if not running:
+                    return
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    job, started = running.pop(future)
+                    self.record(job, time.monotonic() - started)
+
+                    yield future.result()
 
 
 @inherits(ParseMasscanOutput)
@@ -42,7 +277,8 @@ class ThreadedNmapScan(luigi.Task):
             PYTHONPATH=$(pwd) luigi --local-scheduler --module recon.nmap ThreadedNmap --target-file htb-targets --top-ports 5000
 
     Args:
-        threads: number of threads for parallel nmap command execution
+        threads: most nmap scans run at a time; fewer are run while the system is loaded or the scans slow down
+        parse_workers: number of processes used to parse nmap's xml output; 0 means one per cpu
         db_location: specifies the path to the database used for storing results *Required by upstream Task*
         rate: desired rate for transmitting packets (packets per second) *Required by upstream Task*
         interface: use the named raw network interface, such as "eth0" *Required by upstream Task*
@@ -53,6 +289,7 @@ class ThreadedNmapScan(luigi.Task):
     """
 
     threads = luigi.Parameter(default=defaults.get("threads"))
+    parse_workers = luigi.Parameter(default=defaults.get("parse-workers"), significant=False)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -76,6 +313,7 @@ class ThreadedNmapScan(luigi.Task):
             "interface": self.interface,
             "ports": self.ports,
             "db_location": self.db_location,
+            "exempt_list": self.exempt_list,
         }
         return ParseMasscanOutput(**args)
 
@@ -98,73 +336,133 @@ class ThreadedNmapScan(luigi.Task):
             "localtarget": luigi.LocalTarget(str(self.results_subfolder)),
         }
 
+    @contextmanager
+    def parse_pool(self):
+        """ Context manager providing the ProcessPoolExecutor nmap results are parsed in; None when parse_workers is 1
+        and parsing happens in this process
+        """
+        workers = abs(int(self.parse_workers))
+
+        if workers == 1:
+            yield None
+            return
+
+        # parsing is cpu bound dom work, so it's spread over processes; only the compact results come back
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers or None) as pool:
+            yield pool
+
+    def parse_nmap_files(self, files):
+        """ Parse the given nmap .xml files across parse_workers processes, yielding parse_nmap_xml's results in order """
+        with self.parse_pool() as pool:
+            if pool is None:
+                yield from map(parse_nmap_xml, files)
+            else:
+                yield from pool.map(parse_nmap_xml, files, chunksize=PARSE_CHUNK_SIZE)
+
+    def get_new_nmap_files(self):
+        """ Returns (path, state) for each nmap .xml result that's new or changed since it was last ingested """
+        ingested = self.db_mgr.get_ingested_files()
+        files = ((path, get_file_state(path)) for path in self.results_subfolder.glob("nmap*.xml"))
+
+        return [(path, state) for path, state in files if ingested.get(str(path)) != state]
+
+    def ingest_nmap_file(self, path, state, commandline, services):
+        """ Add the parsed contents of a single nmap .xml result to the database and record the file as ingested; meant
+        to be run in a transaction of its own, which commits it
+        """
+        ip_addresses = self.db_mgr.bulk_get_or_create_ip_addresses(
+            (service.address for service in services), commit=False
+        )
+        port_ids = self.db_mgr.bulk_get_or_create_ports(
+            ((service.protocol, service.port) for service in services), commit=False
+        )
+
+        nmap_results, nse_results = list(), dict()
+        packed = commandline is not None and "-iL" in commandline.split()
+
+        for service in services:
+            ip_address_id, target_id = ip_addresses.get(service.address)
+
+            nmap_result = self.db_mgr.get_or_create(
+                NmapResult,
+                port_id=port_ids.get((service.protocol, service.port)),
+                ip_address_id=ip_address_id,
+                target_id=target_id,
+            )
+
+            for script_id, script_output in service.scripts:
+                if (script_id, script_output) not in nse_results:
+                    # the same script output is commonly reported for multiple ports on a host
+                    nse_results[(script_id, script_output)] = self.db_mgr.get_or_create(
+                        NSEResult, script_id=script_id, script_output=script_output
+                    )
+
+                nse_result = nse_results.get((script_id, script_output))
+
+                if nse_result not in nmap_result.nse_results:
+                    # results for a changed file may already be partially present
+                    nmap_result.nse_results.append(nse_result)
+
+            nmap_result.open = service.open
+            nmap_result.reason = service.reason
+            nmap_result.service = service.service
+            nmap_result.commandline = commandline
+
+            if packed:
+                nmap_result.host = service.address  # several hosts were scanned, none of them is the last argument
+            nmap_result.product = service.product
+            nmap_result.product_version = service.version
+
+            nmap_results.append(nmap_result)
+
+        self.db_mgr.session.add_all(nmap_results)
+        self.db_mgr.set_file_ingested(path, *state, commit=False)
+
     def parse_nmap_output(self):
-        """ Read nmap .xml results and add entries into specified database """
-
-        for entry in self.results_subfolder.glob("nmap*.xml"):
-            # relying on python-libnmap here
-            report = NmapParser.parse_fromfile(entry)
-
-            for host in report.hosts:
-                for service in host.services:
-                    port = self.db_mgr.get_or_create(Port, protocol=service.protocol, port_number=service.port)
-
-                    if is_ip_address(host.address) and get_ip_address_version(host.address) == "4":
-                        ip_address = self.db_mgr.get_or_create(IPAddress, ipv4_address=host.address)
-                    else:
-                        ip_address = self.db_mgr.get_or_create(IPAddress, ipv6_address=host.address)
-
-                    if ip_address.target is None:
-                        # account for ip addresses identified that aren't already tied to a target
-                        # almost certainly ipv6 addresses
-                        tgt = self.db_mgr.get_or_create(Target)
-                        tgt.ip_addresses.append(ip_address)
-                    else:
-                        tgt = ip_address.target
-
-                    try:
-                        nmap_result = self.db_mgr.get_or_create(
-                            NmapResult, port=port, ip_address=ip_address, target=tgt
-                        )
-                    except sqlalchemy.exc.StatementError:
-                        # one of the three (port/ip/tgt) didn't exist and we're querying on ids that the db doesn't know
-                        self.db_mgr.add(port)
-                        self.db_mgr.add(ip_address)
-                        self.db_mgr.add(tgt)
-                        nmap_result = self.db_mgr.get_or_create(
-                            NmapResult, port=port, ip_address=ip_address, target=tgt
-                        )
-
-                    for nse_result in service.scripts_results:
-                        script_id = nse_result.get("id")
-                        script_output = nse_result.get("output")
-                        nse_obj = self.db_mgr.get_or_create(NSEResult, script_id=script_id, script_output=script_output)
-                        nmap_result.nse_results.append(nse_obj)
-
-                    nmap_result.open = service.open()
-                    nmap_result.reason = service.reason
-                    nmap_result.service = service.service
-                    nmap_result.commandline = report.commandline
-                    nmap_result.product = service.service_dict.get("product")
-                    nmap_result.product_version = service.service_dict.get("version")
-                    nmap_result.target.nmap_results.append(nmap_result)
-
-                    self.db_mgr.add(nmap_result)
-                    self.output().get("sqltarget").touch()
+        """ Read nmap .xml results that haven't been ingested yet, or have changed since, and add them to the database """
+        files = self.get_new_nmap_files()
+
+        for (path, state), parsed in zip(files, self.parse_nmap_files([path for path, _ in files])):
+            # the write lock is only held while a file's results are added, not while the next one is parsed
+            with self.db_mgr.transaction():
+                self.ingest_nmap_file(path, state, *parsed)
+
+        self.output().get("sqltarget").touch()
 
         self.db_mgr.close()
 
-    def run(self):
-        """ Parses pickled target info dictionary and runs targeted nmap scans against only open ports. """
-        try:
-            self.threads = abs(int(self.threads))
-        except (TypeError, ValueError):
-            return logging.error("The value supplied to --threads must be a non-negative integer.")
+    def get_hosts_and_ports(self):
+        """ Returns (host, protocol, ports) for each host with open ports, each address only once
+
+        A Target is known by its hostname as well as its addresses; its addresses are scanned, and the hostname only
+        when it hasn't resolved to any.
+        """
+        hosts, seen = list(), set()
+
+        for target, addresses, ports in self.db_mgr.get_targets_with_addresses_and_ports():
+            for host in addresses or [target.hostname]:
+                if host is None or host in seen:
+                    continue
 
-        nmap_command = [  # placeholders will be overwritten with appropriate info in loop below
+                seen.add(host)
+
+                for protocol in ("tcp", "udp"):
+                    protocol_ports = [str(port.port_number) for port in ports if port.protocol == protocol]
+
+                    if protocol_ports:
+                        hosts.append((host, protocol, protocol_ports))
+
+        return hosts
+
+    @staticmethod
+    def get_nmap_command(job, results_path):
+        """ Returns the nmap command that runs the given NmapJob, writing its results with -oA to results_path; scans of
+        several hosts read them from a RESULTS_PATH.hosts file, which is written here
+        """
+        command = [
             "nmap",
             "--open",
-            "PLACEHOLDER-IDX-2",
+            "-sT" if job.protocol == "tcp" else "-sU",
             "-n",
             "-sC",
             "-T",
@@ -172,38 +470,90 @@ class ThreadedNmapScan(luigi.Task):
             "-sV",
             "-Pn",
             "-p",
-            "PLACEHOLDER-IDX-10",
+            ",".join(job.ports),
             "-oA",
+            str(results_path),
         ]
 
-        commands = list()
+        if job.ipv6:
+            command.insert(-2, "-6")
+
+        if len(job.hosts) == 1:
+            command.append(job.hosts[0])  # target as final arg to nmap
+        else:
+            hosts_file = results_path.with_name(f"{results_path.name}.hosts")
+            hosts_file.write_text("".join(f"{host}\n" for host in job.hosts))
+            command.extend(["-iL", str(hosts_file)])
+
+        return command
+
+    @staticmethod
+    def scan_and_parse(command, path, pool):
+        """ Run a single nmap command and parse its .xml result; returns (path, state, parsed), where state and parsed
+        are None if nmap didn't leave a result behind
+        """
+        subprocess.run(command)
+
+        state = get_file_state(path)
+
+        if state is None:
+            return path, None, None
 
-        for target in self.db_mgr.get_all_targets():
-            for protocol in ("tcp", "udp"):
-                ports = self.db_mgr.get_ports_by_ip_or_host_and_protocol(target, protocol)
-                if ports:
-                    tmp_cmd = nmap_command[:]
-                    tmp_cmd[2] = "-sT" if protocol == "tcp" else "-sU"
+        return path, state, parse_nmap_xml(path) if pool is None else pool.submit(parse_nmap_xml, path).result()
 
-                    # arg to -oA, will drop into subdir off curdir
-                    tmp_cmd[10] = ",".join(ports)
-                    tmp_cmd.append(str(Path(self.output().get("localtarget").path) / f"nmap.{target}-{protocol}"))
+    def run(self):
+        """ Runs targeted nmap scans against only the open ports of each host, adding their results to the database.
 
-                    if is_ip_address(target) and get_ip_address_version(target) == "6":
-                        # got an ipv6 address
-                        tmp_cmd.insert(-2, "-6")
+        Hosts are deduplicated by address.  ip addresses with the same open ports are packed into a single scan (read
+        with -iL), up to nmap-hosts-per-scan of them, and hosts with more than nmap-ports-per-scan open ports are split
+        over several scans; see plan_nmap_jobs.  The scans are run largest first by an NmapScheduler, which runs up to
+        --threads of them at a time, fewer when the system is loaded or the scans slow down.
+        """
+        try:
+            self.threads = abs(int(self.threads))
+        except (TypeError, ValueError):
+            return logging.error("The value supplied to --threads must be a non-negative integer.")
 
-                    tmp_cmd.append(target)  # target as final arg to nmap
+        try:
+            self.parse_workers = abs(int(self.parse_workers))
+        except (TypeError, ValueError):
+            return logging.error("The value supplied to --parse-workers must be a non-negative integer.")
 
-                    commands.append(tmp_cmd)
+        hosts = self.get_hosts_and_ports()
+        jobs = plan_nmap_jobs(hosts, int(defaults.get("nmap-hosts-per-scan")), int(defaults.get("nmap-ports-per-scan")))
 
         # basically mkdir -p, won't error out if already there
         self.results_subfolder.mkdir(parents=True, exist_ok=True)
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
+        commands = dict()  # job -> (command, path to its .xml result)
+        ingested = self.db_mgr.get_ingested_files()
 
-            executor.map(subprocess.run, commands)
+        for job in jobs:
+            results_path = Path(self.output().get("localtarget").path) / job.name
+            xml_path = results_path.with_name(f"{results_path.name}.xml")
 
+            if xml_path.exists() and ingested.get(str(xml_path)) == get_file_state(xml_path):
+                # scanned and ingested before this task was interrupted and restarted
+                continue
+
+            commands[job] = self.get_nmap_command(job, results_path), xml_path
+
+        # each scan's results are added to the database as soon as it finishes, rather than after all of them; no
+        # transaction is open while nmap runs, other tasks' writes would otherwise wait on sqlite's write lock
+        with self.parse_pool() as pool:
+
+            def scan(job):
+                return self.scan_and_parse(*commands.get(job), pool)
+
+            for path, state, parsed in NmapScheduler(self.threads).run(scan, commands):
+                if parsed is not None:
+                    with self.db_mgr.transaction():
+                        self.ingest_nmap_file(path, state, *parsed)
+
+        for hosts_file in self.results_subfolder.glob("nmap.group-*.hosts"):
+            hosts_file.unlink()
+
+        # picks up any results left behind by earlier runs
         self.parse_nmap_output()
 
 
@@ -215,6 +565,9 @@ class SearchsploitScan(luigi.Task):
         ``searchcploit`` is already on your system if you're using kali.  If you're not using kali, refer to your own
         distributions instructions for installing ``searchcploit``.
 
+        When exploitdb's ``files_exploits.csv`` sits next to ``searchsploit``, services are looked up in an
+        in-process :class:`pipeline.recon.exploits.ExploitIndex` instead of starting ``searchsploit`` for each file.
+
     Basic Example:
         .. code-block:: console
 
@@ -226,7 +579,8 @@ class SearchsploitScan(luigi.Task):
             PYTHONPATH=$(pwd) luigi --local-scheduler --module recon.nmap Searchsploit --target-file htb-targets --top-ports 5000
 
     Args:
-        threads: number of threads for parallel nmap command execution *Required by upstream Task*
+        threads: number of threads for parallel nmap and searchsploit command execution *Required by upstream Task*
+        parse_workers: number of processes used to parse nmap's xml output *Required by upstream Task*
         db_location: specifies the path to the database used for storing results *Required by upstream Task*
         rate: desired rate for transmitting packets (packets per second) *Required by upstream Task*
         interface: use the named raw network interface, such as "eth0" *Required by upstream Task*
@@ -239,6 +593,7 @@ class SearchsploitScan(luigi.Task):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.db_mgr = pipeline.models.db_manager.DBManager(db_location=self.db_location)
+        self.results_subfolder = (Path(self.results_dir) / "searchsploit-results").expanduser().resolve()
 
     def requires(self):
         """ Searchsploit depends on ThreadedNmap to run.
@@ -254,11 +609,13 @@ class SearchsploitScan(luigi.Task):
             "rate": self.rate,
             "ports": self.ports,
             "threads": self.threads,
+            "parse_workers": self.parse_workers,
             "top_ports": self.top_ports,
             "interface": self.interface,
             "target_file": self.target_file,
             "results_dir": self.results_dir,
             "db_location": self.db_location,
+            "exempt_list": self.exempt_list,
         }
         return ThreadedNmapScan(**args)
 
@@ -277,48 +634,124 @@ class SearchsploitScan(luigi.Task):
             connection_string=self.db_mgr.connection_string, target_table="searchsploit_result", update_id=self.task_id
         )
 
+    @staticmethod
+    def has_open_services(path):
+        """ Simple helper that checks whether an nmap .xml file reports any open services, reading only as far as the
+        first one
+        """
+        try:
+            return any(service.open for service in read_nmap_xml(path))
+        except ElementTree.ParseError as e:
+            logging.warning(f"Skipping unreadable nmap results {path}: {e}")
+            return False
+
+    @staticmethod
+    def get_hosts(path):
+        """ Simple helper that returns the hosts an nmap .xml file holds results for; taken from the file's name, unless
+        the file holds a scan of several hosts
+        """
+        # change  wall-searchsploit-results/nmap.10.10.10.157-tcp to 10.10.10.157
+        match = NMAP_RESULTS_NAME.match(path.stem)
+
+        if match and not match.group("host").startswith("group-"):
+            return {match.group("host")}
+
+        try:
+            return {service.address for service in read_nmap_xml(path)}
+        except ElementTree.ParseError as e:
+            logging.warning(f"Skipping unreadable nmap results {path}: {e}")
+            return set()
+
+    def search_exploit_index(self, entries, csv_path):
+        """ Look up the software nmap reported for each host in an in-process index of exploitdb's csv
+
+        Returns:
+            set of (ip_or_host, type, title, path) tuples
+        """
+        records = set()
+        hosts = set().union(*(self.get_hosts(entry) for entry in entries))
+        index = ExploitIndex.load(csv_path)
+
+        for host, service, product, version in self.db_mgr.get_nmap_software():
+            if host in hosts:
+                records.update((host, *result) for result in index.search_service(service, product, version))
+
+        return records
+
+    @staticmethod
+    def search_nmap_file(path):
+        """ Run searchsploit --nmap against a single nmap .xml file
+
+        Returns:
+            tuple of the file's path, the seconds searchsploit took, and a list of (type, title, path) tuples
+        """
+        start = time.perf_counter()
+
+        with subprocess.Popen(
+            [tool_paths.get("searchsploit"), "-j", "-v", "--nmap", str(path)],
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
+            errors="replace",
+        ) as proc:
+            results = list(read_searchsploit_json(proc.stdout))
+
+        return path, time.perf_counter() - start, results
+
+    def run_searchsploit(self, entries):
+        """ Run searchsploit --nmap against each nmap .xml file that reports open services, up to --threads at a time
+
+        The time each file took is written to searchsploit-timings.tsv in the task's results folder.
+
+        Returns:
+            set of (ip_or_host, type, title, path) tuples
+        """
+        records = set()
+        timings = list()
+
+        # nothing for searchsploit to look up in files without open services; don't bother starting it
+        entries = [entry for entry in entries if self.has_open_services(entry)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads or None) as executor:
+            futures = [executor.submit(self.search_nmap_file, entry) for entry in entries]
+
+            for future in concurrent.futures.as_completed(futures):
+                path, elapsed, results = future.result()
+
+                # searchsploit can't tell which of a scan's hosts each result is for; it's added for each of them
+                records.update((host, *result) for host in self.get_hosts(path) for result in results)
+                timings.append(f"{path}\t{elapsed:.3f}\t{len(results)}\n")
+
+        if timings:
+            self.results_subfolder.mkdir(parents=True, exist_ok=True)
+            with open(self.results_subfolder / "searchsploit-timings.tsv", "w") as f:
+                f.write("file\tseconds\tresults\n")
+                f.writelines(timings)
+
+        return records
+
     def run(self):
-        """ Grabs the xml files created by ThreadedNmap and runs searchsploit --nmap on each one, saving the output. """
-        for entry in Path(self.input().get("localtarget").path).glob("nmap*.xml"):
-            proc = subprocess.run(
-                [tool_paths.get("searchsploit"), "-j", "-v", "--nmap", str(entry)], stdout=subprocess.PIPE
-            )
-            if proc.stdout:
-                # change  wall-searchsploit-results/nmap.10.10.10.157-tcp to 10.10.10.157
-                ipaddr = entry.stem.replace("nmap.", "").replace("-tcp", "").replace("-udp", "")
-
-                contents = proc.stdout.decode()
-                for line in contents.splitlines():
-                    if "Title" in line:
-                        # {'Title': "Nginx (Debian Based Distros + Gentoo) ... }
-
-                        # oddity introduced on 15 Apr 2020 from an exploitdb update
-                        #   entries have two double quotes in a row for no apparent reason
-                        #   {"Title":"PHP-FPM + Nginx - Remote Code Execution"", ...
-                        #   seems to affect all entries at the moment. will remove this line if it
-                        #   ever returns to normal
-                        line = line.replace('""', '"')
-
-                        if line.endswith(","):
-                            # result would be a tuple if the comma is left on the line; remove it
-                            tmp_result = ast.literal_eval(line.strip()[:-1])
-                        else:
-                            # normal dict
-                            tmp_result = ast.literal_eval(line.strip())
-
-                        tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(ipaddr)
-
-                        ssr_type = tmp_result.get("Type")
-                        ssr_title = tmp_result.get("Title")
-                        ssr_path = tmp_result.get("Path")
-
-                        ssr = self.db_mgr.get_or_create(
-                            SearchsploitResult, type=ssr_type, title=ssr_title, path=ssr_path
-                        )
-
-                        tgt.searchsploit_results.append(ssr)
-
-                        self.db_mgr.add(tgt)
-                        self.output().touch()
+        """ Finds exploits for the services ThreadedNmap found, saving them to the database.
+
+        Services are looked up in an index of the exploitdb checkout's csv when it's available, otherwise
+        searchsploit --nmap is run against each of the xml files created by ThreadedNmap, --threads at a time.
+        Either way, every result is written to the database in a single batch.
+        """
+        try:
+            self.threads = abs(int(self.threads))
+        except (TypeError, ValueError):
+            return logging.error("The value supplied to --threads must be a non-negative integer.")
+
+        entries = list(Path(self.input().get("localtarget").path).glob("nmap*.xml"))
+        csv_path = get_exploitdb_csv()
+
+        if csv_path.exists():
+            records = self.search_exploit_index(entries, csv_path)
+        else:
+            records = self.run_searchsploit(entries)
+
+        if records:
+            # the same exploits are typically found for many hosts; each one is inserted once
+            self.db_mgr.bulk_add_searchsploit_results(records)
+            self.output().touch()
 
         self.db_mgr.close()
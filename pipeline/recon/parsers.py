@@ -72,6 +72,10 @@ scan_parser.add_argument(
     "--threads",
     help=f"number of threads for all of the threaded applications to use (default: {defaults.get('threads')})",
 )
+scan_parser.add_argument(
+    "--parse-workers",
+    help=f"number of processes used to parse nmap results, 0 for one per cpu (default: {defaults.get('parse-workers')})",
+)
 scan_parser.add_argument(
     "--scan-timeout", help=f"scan timeout for aquatone (default: {defaults.get('aquatone-scan-timeout')})"
 )
@@ -121,6 +125,9 @@ target_results_parser.add_argument(
     help="show targets identified as vulnerable to subdomain takeover",
 )
 target_results_parser.add_argument("--type", choices=["ipv4", "ipv6", "domain-name"], help="filter by target type")
+target_results_parser.add_argument(
+    "--cidr", help="only show ip addresses within the given network, i.e. 10.10.0.0/16 (implies ipv4/6 targets)"
+)
 target_results_parser.add_argument(
     "--paged", action="store_true", default=False, help="display output page-by-page (default: False)"
 )
@@ -46,9 +46,10 @@ class TargetList(luigi.ExternalTask):
         )
 
         with open(Path(self.target_file).expanduser().resolve()) as f:
-            for line in f.readlines():
-                line = line.strip()
+            lines = [line.strip() for line in f.readlines()]
 
+        with self.db_mgr.transaction():
+            for line in lines:
                 if is_ip_address(line):
                     tgt = self.db_mgr.get_or_create(Target)
                     tgt = self.db_mgr.add_ipv4_or_v6_address_to_target(tgt, line)
@@ -57,8 +58,10 @@ class TargetList(luigi.ExternalTask):
                     tgt = self.db_mgr.get_or_create(Target, hostname=line, is_web=True)
 
                 self.db_mgr.add(tgt)
-                db_target.touch()
 
-            self.db_mgr.close()
+        if lines:
+            db_target.touch()
+
+        self.db_mgr.close()
 
         return db_target
@@ -8,15 +8,120 @@ import luigi
 from luigi.util import inherits
 from luigi.contrib.sqla import SQLAlchemyTarget
 
+from ..helpers import batched
 from .targets import GatherWebTargets
 from ..config import tool_paths, defaults
 
 import pipeline.models.db_manager
-from ...models.port_model import Port
-from ...models.header_model import Header
-from ...models.endpoint_model import Endpoint
 from ...models.screenshot_model import Screenshot
 
+# read aquatone_session.json this many characters at a time
+READ_SIZE = 64 * 1024
+
+
+class JsonStreamReader:
+    """ Reads a json document from a file a value at a time, so that large objects can be walked member by member
+    without the whole document in memory.
+
+    Only the part of the file that holds the value being read (plus one read) is kept in memory.  Truncated or
+    malformed json raises json.JSONDecodeError.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.pos, self.eof = "", 0, False
+
+    def fill(self):
+        """ Read more of the file, dropping what's already been consumed; reads grow with a value that's still
+        incomplete so that decoding it doesn't go quadratic
+        """
+        data = self.f.read(max(READ_SIZE, len(self.buffer) - self.pos))
+        self.buffer, self.pos, self.eof = self.buffer[self.pos :] + data, 0, not data
+
+    def peek(self):
+        """ Skip whitespace and return the next character, or an empty string at the end of the file """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos : self.pos + 1]
+
+            self.fill()
+
+    def expect(self, characters):
+        """ Consume and return the next character, which must be one of the given characters """
+        character = self.peek()
+
+        if not character or character not in characters:
+            raise json.JSONDecodeError(f"Expecting one of {characters!r}", self.buffer, self.pos)
+
+        self.pos += 1
+
+        return character
+
+    def value(self):
+        """ Decode and return the next complete json value """
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()  # the value continues in the next read
+                continue
+
+            if end == len(self.buffer) and not self.eof:
+                self.fill()  # a number could continue in the next read
+                continue
+
+            self.pos = end
+
+            return value
+
+    def members(self):
+        """ Yield the key of each member of the object that comes next; after each key, the caller reads the member's
+        value with value() or members() before asking for the next key.  A null is treated as an empty object.
+        """
+        if self.peek() == "n":
+            self.value()
+            return
+
+        self.expect("{")
+
+        if self.peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(":")
+
+            yield key
+
+            if self.expect(",}") == "}":
+                return
+
+
+def read_aquatone_session(f):
+    """ Simple helper that yields ("page", page) for each of an open aquatone_session.json's pages and
+    ("cluster", (cluster id, urls)) for each of its pageSimilarityClusters, in file order and one at a time
+    """
+    reader = JsonStreamReader(f)
+
+    for key in reader.members():
+        if key == "pages":
+            for _ in reader.members():
+                yield "page", reader.value()
+        elif key == "pageSimilarityClusters":
+            for cluster_id in reader.members():
+                yield "cluster", (cluster_id, reader.value() or list())
+        else:
+            reader.value()  # version, stats
+
 
 @inherits(GatherWebTargets)
 class AquatoneScan(luigi.Task):
@@ -93,23 +198,50 @@ class AquatoneScan(luigi.Task):
             connection_string=self.db_mgr.connection_string, target_table="screenshot", update_id=self.task_id
         )
 
-    def _get_similar_pages(self, url, results):
-        # populate similar pages if any exist
-        similar_pages = None
+    def parse_pages(self, pages, header_ids):
+        """ Add a batch of aquatone's pages to the database as Endpoints, their Headers, and Screenshots
 
-        for cluster_id, cluster in results.get("pageSimilarityClusters").items():
-            if url not in cluster:
-                continue
+        header_ids is the (name, value) -> Header.id intern table shared by every batch of the session.
+        """
+        endpoints, headers = list(), list()
+
+        for page_dict in pages:
+            url = page_dict.get("url")  # one url to one screenshot, unique key
+
+            # build out the endpoint's data to include headers, this has value whether or not there's a screenshot
+            status = page_dict.get("status").split(maxsplit=1)
+            endpoints.append((url, status[0]))
+
+            for header_dict in page_dict.get("headers"):
+                headers.append((url, header_dict.get("name"), header_dict.get("value")))
+
+        endpoint_ids = self.db_mgr.bulk_add_endpoints(endpoints, commit=False)
+        self.db_mgr.bulk_add_headers(headers, commit=False, header_ids=header_ids, endpoint_ids=endpoint_ids)
+
+        screenshots = [x for x in pages if x.get("hasScreenshot")]
+        parsed_urls = {x.get("url"): urlparse(x.get("url")) for x in screenshots}
 
-            similar_pages = list()
+        target_ids = self.db_mgr.bulk_get_or_create_targets((x.hostname for x in parsed_urls.values()), commit=False)
+        port_ids = self.db_mgr.bulk_get_or_create_ports(("tcp", x.port if x.port else 80) for x in parsed_urls.values())
 
-            for similar_url in cluster:
-                if similar_url == url:
-                    continue
+        # screenshots are added one at a time, each in a savepoint that an integrity error rolls back; commit the bulk
+        # rows first so that a failed screenshot can't take them (and the ids interned for later batches) with it
+        self.db_mgr.commit()
 
-                similar_pages.append(self.db_mgr.get_or_create(Screenshot, url=similar_url))
+        for page_dict in screenshots:
+            # build out screenshot data
+            url = page_dict.get("url")
+            parsed_url = parsed_urls.get(url)
 
-        return similar_pages
+            image = (self.results_subfolder / page_dict.get("screenshotPath")).read_bytes()
+
+            screenshot = self.db_mgr.get_or_create(Screenshot, url=url)
+            screenshot.port_id = port_ids.get(("tcp", parsed_url.port if parsed_url.port else 80))
+            screenshot.endpoint_id = endpoint_ids.get(url)
+            screenshot.target_id = target_ids.get(parsed_url.hostname)
+            self.db_mgr.set_screenshot_image(screenshot, image)
+
+            self.db_mgr.add(screenshot)
 
     def parse_results(self):
         """ Read in aquatone's .json file and update the associated Target record """
@@ -167,75 +299,31 @@ class AquatoneScan(luigi.Task):
                 ],
         """
         try:
-            with open(self.results_subfolder / "aquatone_session.json") as f:
-                # results.keys -> dict_keys(['version', 'stats', 'pages', 'pageSimilarityClusters'])
-                results = json.load(f)
+            f = open(self.results_subfolder / "aquatone_session.json")
         except FileNotFoundError as e:
             logging.error(e)
             return
 
-        for page, page_dict in results.get("pages").items():
-            headers = list()
-
-            url = page_dict.get("url")  # one url to one screenshot, unique key
+        clusters = dict()  # url -> id of the cluster of similar pages it belongs to
+        header_ids = dict()  # (name, value) -> Header.id; the same few headers show up on most pages
 
-            # build out the endpoint's data to include headers, this has value whether or not there's a screenshot
-            endpoint = self.db_mgr.get_or_create(Endpoint, url=url)
-            if not endpoint.status_code:
-                status = page_dict.get("status").split(maxsplit=1)
-                if len(status) > 1:
-                    endpoint.status_code, _ = status
+        def pages():
+            # results.keys -> dict_keys(['version', 'stats', 'pages', 'pageSimilarityClusters'])
+            for kind, item in read_aquatone_session(f):
+                if kind == "page":
+                    yield item
                 else:
-                    endpoint.status_code = status[0]
+                    cluster_id, urls = item
+                    clusters.update(dict.fromkeys(urls, cluster_id))
 
-            for header_dict in page_dict.get("headers"):
-                header = self.db_mgr.get_or_create(Header, name=header_dict.get("name"), value=header_dict.get("value"))
-
-                if endpoint not in header.endpoints:
-                    header.endpoints.append(endpoint)
-
-                headers.append(header)
-
-            endpoint.headers = headers
-
-            parsed_url = urlparse(url)
+        with f, self.db_mgr.transaction():
+            for batch in batched(pages(), int(defaults.get("database-batch-size"))):
+                self.parse_pages(batch, header_ids)
 
-            ip_or_hostname = parsed_url.hostname
-            tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(ip_or_hostname)
+            # aquatone writes the clusters after the pages; their screenshots are all in the database by now
+            self.db_mgr.bulk_set_screenshot_clusters(clusters, commit=False)
 
-            endpoint.target = tgt
-
-            if not page_dict.get("hasScreenshot"):
-                # if there isn't a screenshot, save the endpoint data and move along
-                self.db_mgr.add(endpoint)
-                # This causes an integrity error on insertion due to the task_id being the same for two
-                # different target tables.  Could subclass SQLAlchemyTarget and set the unique-ness to be the
-                # combination of update_id + target_table.  The question is, does it matter?
-                # TODO: assess above and act
-                # SQLAlchemyTarget(
-                #     connection_string=self.db_mgr.connection_string, target_table="endpoint", update_id=self.task_id
-                # ).touch()
-                continue
-
-            # build out screenshot data
-            port = parsed_url.port if parsed_url.port else 80
-            port = self.db_mgr.get_or_create(Port, protocol="tcp", port_number=port)
-
-            image = (self.results_subfolder / page_dict.get("screenshotPath")).read_bytes()
-
-            screenshot = self.db_mgr.get_or_create(Screenshot, url=url)
-            screenshot.port = port
-            screenshot.endpoint = endpoint
-            screenshot.target = screenshot.endpoint.target
-            screenshot.image = image
-
-            similar_pages = self._get_similar_pages(url, results)
-
-            if similar_pages is not None:
-                screenshot.similar_pages = similar_pages
-
-            self.db_mgr.add(screenshot)
-            self.output().touch()
+        self.output().touch()
 
         self.db_mgr.close()
 
@@ -1,8 +1,8 @@
 import os
+import re
 import logging
 import subprocess
 from pathlib import Path
-from urllib.parse import urlparse
 from concurrent.futures import ThreadPoolExecutor
 
 import luigi
@@ -12,8 +12,33 @@ from luigi.contrib.sqla import SQLAlchemyTarget
 import pipeline.models.db_manager
 from .targets import GatherWebTargets
 from ..config import tool_paths, defaults
-from ...models.endpoint_model import Endpoint
-from ..helpers import get_ip_address_version, is_ip_address
+from ..helpers import get_ip_address_version, is_ip_address, batched
+
+# gobuster dir -e results, i.e. "https://host/path (Status: 200) [Size: 1234]"; recursive-gobuster runs gobuster with
+# -n, so its log holds bare urls.  Anything else (errors, progress, results without a scheme) doesn't match
+GOBUSTER_RESULT = re.compile(r"^[ \t]*([a-z][a-z0-9+.-]*://\S+)(?:[ \t]+\(Status:[ \t]*(\d+)\))?", re.M | re.I)
+
+# read results files this many characters at a time
+READ_SIZE = 1024 * 1024
+
+
+def read_gobuster_results(path):
+    """ Simple helper that yields (url, status code) for each result in a gobuster or recursive-gobuster output file;
+    status code is an empty string when the file doesn't record one.
+
+    The file is matched against a single compiled regex a large chunk of whole lines at a time.
+    """
+    leftover = ""
+
+    with open(path, errors="replace") as f:
+        for data in iter(lambda: f.read(READ_SIZE), ""):
+            chunk = leftover + data
+            end = chunk.rfind("\n") + 1
+            chunk, leftover = chunk[:end], chunk[end:]
+
+            yield from GOBUSTER_RESULT.findall(chunk)
+
+    yield from GOBUSTER_RESULT.findall(leftover)
 
 
 @inherits(GatherWebTargets)
@@ -100,25 +125,30 @@ class GobusterScan(luigi.Task):
         )
 
     def parse_results(self):
-        """ Reads in each individual gobuster file and adds each line to the database as an Endpoint """
-        for file in self.results_subfolder.iterdir():
-            tgt = None
-            for i, line in enumerate(file.read_text().splitlines()):
-                url, status = line.split(maxsplit=1)  # http://somewhere/path (Status:200)
-
-                if i == 0:
-                    # parse first entry to determine ip address -> target relationship
-                    parsed_url = urlparse(url)
-
-                    tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(parsed_url.hostname)
-
-                if tgt is not None:
-                    status_code = status.split(maxsplit=1)[1]
-                    ep = self.db_mgr.get_or_create(Endpoint, url=url, status_code=status_code.replace(")", ""))
-                    if ep not in tgt.endpoints:
-                        tgt.endpoints.append(ep)
-                    self.db_mgr.add(tgt)
-                    self.output().touch()
+        """ Reads in each individual gobuster file and adds each url to the database as an Endpoint
+
+        Each url's Target is resolved from the url itself.  A url found more than once (i.e. by both gobuster and
+        recursive-gobuster) is only added the first time.
+        """
+        seen = set()
+
+        def records():
+            for file in sorted(self.results_subfolder.iterdir()):
+                if not file.is_file():
+                    continue
+
+                for url, status_code in read_gobuster_results(file):
+                    if url in seen:
+                        continue
+
+                    seen.add(url)
+
+                    yield url, int(status_code) if status_code else None
+
+        for batch in batched(records(), int(defaults.get("database-batch-size"))):
+            self.db_mgr.bulk_add_endpoints(batch)
+
+        self.output().touch()
 
     def run(self):
         """ Defines the options/arguments sent to gobuster after processing.
@@ -89,16 +89,16 @@ class TKOSubsScan(luigi.Task):
 
             next(reader, None)  # skip the headers
 
-            for row in reader:
-                domain = row[0]
-                is_vulnerable = row[3]
+            with self.db_mgr.transaction():
+                for row in reader:
+                    domain = row[0]
+                    is_vulnerable = row[3]
 
-                if "true" in is_vulnerable.lower():
-                    tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(domain)
-                    tgt.vuln_to_sub_takeover = True
+                    if "true" in is_vulnerable.lower():
+                        tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(domain)
+                        tgt.vuln_to_sub_takeover = True
 
-                    self.db_mgr.add(tgt)
-                    self.output().touch()
+                        self.db_mgr.add(tgt)
 
             self.db_mgr.close()
 
@@ -215,26 +215,26 @@ class SubjackScan(luigi.Task):
                 [Not Vulnerable] 2606:4700:10::6814:3d33
                 [Not Vulnerable] assetinventory.bugcrowd.com
             """
-            for line in f:
-                match = re.match(r"\[(?P<vuln_status>.+)] (?P<ip_or_hostname>.*)", line)
+            with self.db_mgr.transaction():
+                for line in f:
+                    match = re.match(r"\[(?P<vuln_status>.+)] (?P<ip_or_hostname>.*)", line)
 
-                if not match:
-                    continue
+                    if not match:
+                        continue
 
-                if match.group("vuln_status") == "Not Vulnerable":
-                    continue
+                    if match.group("vuln_status") == "Not Vulnerable":
+                        continue
 
-                ip_or_host = match.group("ip_or_hostname")
+                    ip_or_host = match.group("ip_or_hostname")
 
-                if ip_or_host.count(":") == 1:  # ip or host/port
-                    ip_or_host, port = ip_or_host.split(":", maxsplit=1)
+                    if ip_or_host.count(":") == 1:  # ip or host/port
+                        ip_or_host, port = ip_or_host.split(":", maxsplit=1)
 
-                tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(ip_or_host)
+                    tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(ip_or_host)
 
-                tgt.vuln_to_sub_takeover = True
+                    tgt.vuln_to_sub_takeover = True
 
-                self.db_mgr.add(tgt)
-                self.output().touch()
+                    self.db_mgr.add(tgt)
 
             self.db_mgr.close()
 
@@ -4,7 +4,6 @@ from luigi.contrib.sqla import SQLAlchemyTarget
 
 import pipeline.models.db_manager
 from ..config import web_ports
-from ..amass import ParseAmassOutput
 from ..masscan import ParseMasscanOutput
 
 
@@ -28,13 +27,13 @@ class GatherWebTargets(luigi.Task):
         self.db_mgr = pipeline.models.db_manager.DBManager(db_location=self.db_location)
 
     def requires(self):
-        """ GatherWebTargets depends on ParseMasscanOutput and ParseAmassOutput to run.
+        """ GatherWebTargets depends on ParseMasscanOutput to run.
 
         ParseMasscanOutput expects rate, target_file, interface, and either ports or top_ports as parameters.
-        ParseAmassOutput accepts exempt_list and expects target_file
+        amass is run (and its results parsed) by MasscanScan, so that masscan can sweep addresses as amass resolves them.
 
         Returns:
-            dict(str: ParseMasscanOutput, str: ParseAmassOutput)
+            dict(str: ParseMasscanOutput)
         """
         args = {
             "results_dir": self.results_dir,
@@ -44,16 +43,9 @@ class GatherWebTargets(luigi.Task):
             "interface": self.interface,
             "ports": self.ports,
             "db_location": self.db_location,
+            "exempt_list": self.exempt_list,
         }
-        return {
-            "masscan-output": ParseMasscanOutput(**args),
-            "amass-output": ParseAmassOutput(
-                exempt_list=self.exempt_list,
-                target_file=self.target_file,
-                results_dir=self.results_dir,
-                db_location=self.db_location,
-            ),
-        }
+        return {"masscan-output": ParseMasscanOutput(**args)}
 
     def output(self):
         """ Returns the target output for this task.
@@ -68,13 +60,13 @@ class GatherWebTargets(luigi.Task):
     def run(self):
         """ Gather all potential web targets and tag them as web in the database. """
 
-        for target in self.db_mgr.get_all_targets():
-            ports = self.db_mgr.get_ports_by_ip_or_host_and_protocol(target, "tcp")
-            if any(port in web_ports for port in ports):
-                tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(target)
-                tgt.is_web = True
-                self.db_mgr.add(tgt)
-                self.output().touch()
+        with self.db_mgr.transaction():
+            for target in self.db_mgr.get_all_targets():
+                ports = self.db_mgr.get_ports_by_ip_or_host_and_protocol(target, "tcp")
+                if any(port in web_ports for port in ports):
+                    tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(target)
+                    tgt.is_web = True
+                    self.db_mgr.add(tgt)
 
         # in the event that there are no web ports for any target, we still want to be able to mark the
         # task complete successfully.  we accomplish this by calling .touch() even though a database entry
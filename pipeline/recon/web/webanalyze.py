@@ -1,9 +1,9 @@
 import os
 import csv
+import queue
 import logging
 import subprocess
 from pathlib import Path
-from urllib.parse import urlparse
 from concurrent.futures import ThreadPoolExecutor
 
 import luigi
@@ -13,8 +13,30 @@ from luigi.contrib.sqla import SQLAlchemyTarget
 import pipeline.models.db_manager
 from .targets import GatherWebTargets
 from ..config import tool_paths, defaults
-from ...models.technology_model import Technology
-from ..helpers import get_ip_address_version, is_ip_address
+from ...models.endpoint_model import split_url
+from ..helpers import get_ip_address_version, is_ip_address, batched
+
+
+def read_webanalyze_csv(lines):
+    """ Simple helper that yields (url, category, technology) for each row of webanalyze's -output csv, given as an
+    open file or any other iterable of lines; the technology is the app, suffixed with its version when webanalyze
+    found one
+
+    webanalyze writes an empty line and a header row ahead of its results; neither is a result, nor is a short row.
+
+        example data
+
+            http://13.57.162.100,Font scripts,Google Font API,
+            http://13.57.162.100,"Web servers,Reverse proxies",Nginx,1.16.1
+            http://13.57.162.100,Font scripts,Font Awesome,
+    """
+    for row in csv.reader(lines):
+        if len(row) != 4 or row == ["Host", "Category", "App", "Version"]:
+            continue
+
+        url, category, app, version = row
+
+        yield url, category, f"{app}-{version}" if version else app
 
 
 @inherits(GatherWebTargets)
@@ -32,7 +54,7 @@ class WebanalyzeScan(luigi.Task):
     Basic Example:
         .. code-block:: console
 
-            webanalyze -host www.tesla.com -output json
+            webanalyze -apps apps.json -hosts webanalyze-hosts-0.txt -worker 10 -output csv -silent
 
     Luigi Example:
         .. code-block:: console
@@ -89,84 +111,141 @@ class WebanalyzeScan(luigi.Task):
             connection_string=self.db_mgr.connection_string, target_table="technology", update_id=self.task_id
         )
 
-    def parse_results(self):
-        """ Reads in the webanalyze's .csv files and updates the associated Target record. """
-
-        for entry in self.results_subfolder.glob("webanalyze*.csv"):
-            """ example data
+    def add_technologies(self, rows):
+        """ Adds each technology webanalyze found to the Target on which it was found, a transaction per batch
 
-                http://13.57.162.100,Font scripts,Google Font API,
-                http://13.57.162.100,"Web servers,Reverse proxies",Nginx,1.16.1
-                http://13.57.162.100,Font scripts,Font Awesome,
-            """
-            with open(entry, newline="") as f:
-                reader = csv.reader(f)
+        Args:
+            rows: iterable of (url, category, technology)
 
-                # skip the empty line at the start; webanalyze places an empty line at the top of the file
-                # need to skip that.  remove this line if the files have no empty lines at the top
-                next(reader, None)
-                next(reader, None)  # skip the headers; keep this one forever and always
+        Returns:
+            bool: whether there were any technologies to add
+        """
+        hosts = dict()  # url -> host; every row for a url repeats it
+        technology_ids = dict()  # (type, text) -> Technology.id
+        found = False
 
-                tgt = None
+        def records():
+            for url, category, text in rows:
+                if url not in hosts:
+                    hosts[url] = split_url(url)[1]
 
-                for row in reader:
-                    # each row in a file is a technology specific to that target
-                    host, category, app, version = row
+                yield hosts.get(url), category, text
 
-                    parsed_url = urlparse(host)
+        for batch in batched(records(), int(defaults.get("database-batch-size"))):
+            # rows may still be streaming in from webanalyze; each batch is committed (and visible) as it's added, the
+            # write lock isn't held while waiting on the next one
+            with self.db_mgr.transaction():
+                self.db_mgr.bulk_add_technologies(batch, commit=False, technology_ids=technology_ids)
 
-                    text = f"{app}-{version}" if version else app
+            found = True
 
-                    technology = self.db_mgr.get_or_create(Technology, type=category, text=text)
+        return found
 
-                    if tgt is None:
-                        # should only hit the first line of each file
-                        tgt = self.db_mgr.get_or_create_target_by_ip_or_hostname(parsed_url.hostname)
+    def parse_results(self):
+        """ Reads in the webanalyze's .csv files and adds each technology to the Target on which it was found """
 
-                    tgt.technologies.append(technology)
+        def rows():
+            for entry in sorted(self.results_subfolder.glob("webanalyze*.csv")):
+                with open(entry, newline="") as f:
+                    yield from read_webanalyze_csv(f)
 
-                if tgt is not None:
-                    self.db_mgr.add(tgt)
-                    self.output().touch()
+        if self.add_technologies(rows()):
+            self.output().touch()
 
         self.db_mgr.close()
 
-    def _wrapped_subprocess(self, cmd):
-        with open(f"webanalyze-{cmd[2].replace('//', '_').replace(':', '')}.csv", "wb") as f:
-            subprocess.run(cmd, stdout=f)
+    def run_shard(self, index, urls, workers, rows):
+        """ Run a single webanalyze process over a shard of the urls, putting each (url, category, technology) it
+        reports on the rows queue as its output streams in; None is put once the process is done.
+
+        The raw csv is kept as webanalyze-shard-INDEX.csv in the results folder.
+        """
+        hosts = self.results_subfolder / f"webanalyze-hosts-{index}.txt"
+        hosts.write_text("".join(f"{url}\n" for url in urls))
+
+        command = [
+            tool_paths.get("webanalyze"),
+            "-apps",
+            str(self.results_subfolder / "apps.json"),
+            "-hosts",
+            str(hosts),
+            "-worker",
+            str(workers),
+            "-output",
+            "csv",
+            "-silent",
+        ]
+
+        def lines(stdout, f):
+            for line in stdout:
+                f.write(line)
+                yield line
+
+        try:
+            with open(self.results_subfolder / f"webanalyze-shard-{index}.csv", "w", newline="") as f:
+                with subprocess.Popen(
+                    command, stdout=subprocess.PIPE, encoding="utf-8", errors="replace", newline=""
+                ) as proc:
+                    for row in read_webanalyze_csv(lines(proc.stdout, f)):
+                        rows.put(row)
+        finally:
+            hosts.unlink()
+            rows.put(None)
 
     def run(self):
-        """ Defines the options/arguments sent to webanalyze after processing.
+        """ Runs webanalyze against every web target, adding the technologies it finds to the database as they're
+        reported.
 
-        Returns:
-            list: list of options/arguments, beginning with the name of the executable to run
+        Rather than one process per url, each of which would load wappalyzer's apps.json on its own, the urls are
+        split into a few shards (one per cpu, at most --threads), each fed to a single webanalyze process through
+        -hosts.  The processes' -worker counts add up to --threads.
         """
         try:
             self.threads = abs(int(self.threads))
         except (TypeError, ValueError):
             return logging.error("The value supplied to --threads must be a non-negative integer.")
 
-        commands = list()
+        urls = list()
 
         for target in self.db_mgr.get_all_web_targets():
             if is_ip_address(target) and get_ip_address_version(target) == "6":
                 target = f"[{target}]"
 
             for url_scheme in ("https://", "http://"):
-                command = [tool_paths.get("webanalyze"), "-host", f"{url_scheme}{target}", "-output", "csv"]
-                commands.append(command)
+                urls.append(f"{url_scheme}{target}")
 
         self.results_subfolder.mkdir(parents=True, exist_ok=True)
 
-        cwd = Path().cwd()
-        os.chdir(self.results_subfolder)
+        if not (self.results_subfolder / "apps.json").exists():
+            subprocess.run([tool_paths.get("webanalyze"), "-update"], cwd=self.results_subfolder)
+
+        threads = max(self.threads, 1)
+        shards = min(os.cpu_count() or 1, threads, len(urls))
+        workers = -(-threads // max(shards, 1))  # ceiling division
+
+        rows = queue.Queue()
 
-        if not Path("apps.json").exists():
-            subprocess.run(f"{tool_paths.get('webanalyze')} -update".split())
+        def streamed_rows():
+            pending = shards
 
-        with ThreadPoolExecutor(max_workers=self.threads) as executor:
-            executor.map(self._wrapped_subprocess, commands)
+            while pending:
+                row = rows.get()
 
-        os.chdir(str(cwd))
+                if row is None:
+                    pending -= 1
+                    continue
 
-        self.parse_results()
+                yield row
+
+        with ThreadPoolExecutor(max_workers=max(shards, 1)) as executor:
+            futures = [executor.submit(self.run_shard, i, urls[i::shards], workers, rows) for i in range(shards)]
+
+            found = self.add_technologies(streamed_rows())
+
+            for future in futures:
+                future.result()
+
+        if found:
+            self.output().touch()
+
+        self.db_mgr.close()
@@ -17,6 +17,7 @@ class FullScan(luigi.WrapperTask):
 
     Args:
         threads: number of threads for parallel gobuster command execution
+        parse_workers: number of processes used to parse nmap's xml output
         wordlist: wordlist used for forced browsing
         extensions: additional extensions to apply to each item in the wordlist
         recursive: whether or not to recursively gobust the target (may produce a LOT of traffic... quickly)
@@ -62,7 +63,7 @@ class FullScan(luigi.WrapperTask):
         del args["scan_timeout"]
 
         yield SubjackScan(**args)
-        yield SearchsploitScan(**args)
+        yield SearchsploitScan(**args, parse_workers=self.parse_workers)
         yield WebanalyzeScan(**args)
 
         del args["threads"]
@@ -79,6 +80,7 @@ class HTBScan(luigi.WrapperTask):
 
     Args:
         threads: number of threads for parallel gobuster command execution
+        parse_workers: number of processes used to parse nmap's xml output
         wordlist: wordlist used for forced browsing
         extensions: additional extensions to apply to each item in the wordlist
         recursive: whether or not to recursively gobust the target (may produce a LOT of traffic... quickly)
@@ -123,5 +125,5 @@ class HTBScan(luigi.WrapperTask):
 
         del args["scan_timeout"]
 
-        yield SearchsploitScan(**args)
+        yield SearchsploitScan(**args, parse_workers=self.parse_workers)
         yield WebanalyzeScan(**args)
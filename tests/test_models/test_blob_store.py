@@ -0,0 +1,47 @@
+import shutil
+import struct
+import hashlib
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from pipeline.models.blob_store import BlobStore, get_blob_store, get_image_dimensions, PNG_SIGNATURE
+
+
+def make_png(width, height):
+    return PNG_SIGNATURE + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", width, height) + b"\x08\x02\x00\x00\x00"
+
+
+class TestBlobStore:
+    def setup_method(self):
+        self.tmp_path = Path(tempfile.mkdtemp())
+        self.blob_store = BlobStore(self.tmp_path / "blobs")
+
+    def teardown_method(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_put_and_get(self):
+        digest = self.blob_store.put(b"stuff")
+        assert digest == hashlib.sha256(b"stuff").hexdigest()
+        assert digest in self.blob_store
+        assert self.blob_store.get(digest) == b"stuff"
+        assert self.blob_store.path(digest) == self.tmp_path / "blobs" / digest[:2] / digest
+
+    def test_put_deduplicates(self):
+        assert self.blob_store.put(b"stuff") == self.blob_store.put(b"stuff")
+        assert len([x for x in self.blob_store.root.rglob("*") if x.is_file()]) == 1
+
+    def test_get_missing(self):
+        assert "0" * 64 not in self.blob_store
+        with pytest.raises(FileNotFoundError):
+            self.blob_store.get("0" * 64)
+
+    def test_get_blob_store(self):
+        assert get_blob_store(self.tmp_path / "db").root == self.tmp_path / "db-blobs"
+
+    @pytest.mark.parametrize(
+        "test_input, expected", [(make_png(1280, 800), (1280, 800)), (b"GIF89a", (None, None)), (b"", (None, None))]
+    )
+    def test_get_image_dimensions(self, test_input, expected):
+        assert get_image_dimensions(test_input) == expected
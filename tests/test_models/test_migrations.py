@@ -0,0 +1,156 @@
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import ipaddress
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+import pipeline.models.migrations
+from pipeline.models.db_manager import DBManager
+from pipeline.models.screenshot_model import Screenshot
+
+existing_db = Path(__file__).parent.parent / "data" / "existing-database-test"
+updated_db = Path(__file__).parent.parent / "data" / "recon-results" / "updated-tests"
+
+
+class TestMigrations:
+    def setup_method(self):
+        self.tmp_path = Path(tempfile.mkdtemp())
+        self.db_location = self.tmp_path / "existing-database-test"
+        shutil.copy(existing_db, self.db_location)
+
+    def teardown_method(self):
+        shutil.rmtree(self.tmp_path)
+
+    def query(self, sql):
+        with sqlite3.connect(str(self.db_location)) as conn:
+            return conn.execute(sql).fetchall()
+
+    def get_indexes(self):
+        return {x[0] for x in self.query("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'")}
+
+    def test_existing_database_is_migrated_on_open(self):
+        assert self.query("PRAGMA user_version") == [(0,)]
+        assert not self.get_indexes()
+
+        targets = DBManager(db_location=self.db_location).get_all_targets()
+
+        assert self.query("PRAGMA user_version") == [(pipeline.models.migrations.SCHEMA_VERSION,)]
+        assert {"ix_endpoint_status_code", "ix_port_port_number_protocol", "ix_port_association_target_id"}.issubset(
+            self.get_indexes()
+        )
+        assert DBManager(db_location=self.db_location).get_all_targets() == targets
+
+    def test_host_columns_are_backfilled(self):
+        DBManager(db_location=self.db_location).close()
+
+        assert self.query("SELECT count(*) FROM endpoint WHERE host IS NULL OR scheme IS NULL OR port IS NULL") == [
+            (0,)
+        ]
+        for url, scheme, host, port in self.query("SELECT url, scheme, host, port FROM endpoint"):
+            assert url.startswith(f"{scheme}://{host}")
+            assert port == int(url.split("/")[2].split(":")[1]) if url.count(":") == 2 else port in (80, 443)
+
+        for commandline, host in self.query("SELECT commandline, host FROM nmap_result"):
+            assert commandline.split()[-1] == host
+
+    def test_screenshots_are_moved_to_blob_store(self):
+        db_location = self.tmp_path / "updated-tests"
+        shutil.copy(updated_db, db_location)
+
+        with sqlite3.connect(str(db_location)) as conn:
+            images = dict(conn.execute("SELECT id, image FROM screenshot WHERE image IS NOT NULL"))
+        size_before = db_location.stat().st_size
+
+        db_mgr = DBManager(db_location=db_location)
+        screenshots = db_mgr.session.query(Screenshot).filter(Screenshot.id.in_(images)).all()
+
+        assert len(screenshots) == len(images) > 0
+        for screenshot in screenshots:
+            assert screenshot.image == images.get(screenshot.id)
+            assert screenshot.digest == hashlib.sha256(screenshot.image).hexdigest()
+            assert screenshot.size == len(screenshot.image)
+            assert screenshot.width and screenshot.height
+
+        db_mgr.close()
+
+        with sqlite3.connect(str(db_location)) as conn:
+            assert "image" not in {x[1] for x in conn.execute("PRAGMA table_info(screenshot)")}
+        assert db_location.stat().st_size < size_before - sum(len(x) for x in images.values()) / 2
+
+    def test_ip_addresses_are_packed(self):
+        db_location = self.tmp_path / "updated-tests"
+        shutil.copy(updated_db, db_location)
+        DBManager(db_location=db_location).close()
+
+        with sqlite3.connect(str(db_location)) as conn:
+            rows = conn.execute("SELECT ipv4_address, ipv6_address, ipv4_int, ipv6_packed FROM ip_address").fetchall()
+
+        assert rows
+        for ipv4_address, ipv6_address, ipv4_int, ipv6_packed in rows:
+            if ipv4_address:
+                assert ipv4_int == int(ipaddress.IPv4Address(ipv4_address)) and ipv6_packed is None
+            else:
+                assert ipv6_packed == ipaddress.IPv6Address(ipv6_address).packed and ipv4_int is None
+
+    def test_searchsploit_results_are_associated(self):
+        db_location = self.tmp_path / "updated-tests"
+        shutil.copy(updated_db, db_location)
+
+        with sqlite3.connect(str(db_location)) as conn:
+            expected = set(conn.execute("SELECT id, target_id FROM searchsploit_result WHERE target_id IS NOT NULL"))
+
+        DBManager(db_location=db_location).close()
+
+        with sqlite3.connect(str(db_location)) as conn:
+            associations = set(conn.execute("SELECT searchsploit_result_id, target_id FROM searchsploit_association"))
+            remaining = conn.execute("SELECT count(*) FROM searchsploit_result WHERE target_id IS NOT NULL").fetchall()
+
+        assert expected and associations == expected
+        assert remaining == [(0,)]
+
+    def test_screenshot_associations_become_clusters(self):
+        db_location = self.tmp_path / "updated-tests"
+        shutil.copy(updated_db, db_location)
+
+        with sqlite3.connect(str(db_location)) as conn:
+            pairs = set(conn.execute("SELECT screenshot_id, similar_page_id FROM screenshot_association"))
+
+        DBManager(db_location=db_location).close()
+
+        with sqlite3.connect(str(db_location)) as conn:
+            tables = {x[0] for x in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            clusters = dict(conn.execute("SELECT id, cluster_id FROM screenshot WHERE cluster_id IS NOT NULL"))
+
+        assert pairs and "screenshot_association" not in tables
+        assert all(clusters.get(x) == clusters.get(y) is not None for x, y in pairs)
+
+    def test_new_database_is_current(self):
+        new_db = self.tmp_path / "new-db"
+        DBManager(db_location=new_db).close()
+
+        engine = create_engine(f"sqlite:///{new_db}")
+        assert pipeline.models.migrations.migrate(engine) == []
+
+    def test_migrate_only_applies_newer_revisions(self, monkeypatch):
+        applied = list()
+        revision = pipeline.models.migrations.SCHEMA_VERSION + 1
+
+        DBManager(db_location=self.db_location).close()
+        monkeypatch.setitem(
+            pipeline.models.migrations.MIGRATIONS, revision, lambda connection: applied.append(revision)
+        )
+        monkeypatch.setattr(pipeline.models.migrations, "SCHEMA_VERSION", revision)
+
+        engine = create_engine(f"sqlite:///{self.db_location}")
+        assert pipeline.models.migrations.migrate(engine) == [revision]
+        assert pipeline.models.migrations.migrate(engine) == []
+        assert applied == [revision]
+
+    def test_migrate_database_dir(self, capsys):
+        (self.tmp_path / "not-a-database").write_text("stuff")
+        pipeline.models.migrations.migrate_database_dir(self.tmp_path)
+        assert self.query("PRAGMA user_version") == [(pipeline.models.migrations.SCHEMA_VERSION,)]
+        assert "not-a-database" not in capsys.readouterr().out
@@ -1,3 +1,4 @@
+import json
 import shutil
 import tempfile
 from pathlib import Path
@@ -5,7 +6,9 @@ from unittest.mock import patch, MagicMock
 
 import luigi
 
+import pipeline.models.db_manager
 from pipeline.recon import AmassScan, ParseAmassOutput, TargetList
+from pipeline.recon.amass import tail_amass_json
 
 
 amass_json = Path(__file__).parent.parent / "data" / "recon-results" / "amass-results" / "amass.json"
@@ -32,12 +35,93 @@ class TestAmassScan:
             assert mocked_run.called
 
     def test_scan_run_with_hostnames(self):
-        with patch("subprocess.run") as mocked_run:
+        with patch("pipeline.recon.amass.subprocess.Popen") as mocked_popen:
+            mocked_popen.return_value.__enter__.return_value.poll.return_value = 0
             self.scan.db_mgr = MagicMock()
             self.scan.db_mgr.get_all_hostnames.return_value = ["google.com"]
             self.scan.exempt_list = "stuff"
             self.scan.run()
-            assert mocked_run.called
+            assert mocked_popen.called
+            assert "-blf" in mocked_popen.call_args[0][0]
+
+    def fake_amass(self, chunks, during=lambda: None):
+        """ returns a stand-in for a running amass that appends the next chunk to its output each time it's polled """
+        chunks = iter(chunks)
+        output = Path(self.scan.output().path)
+
+        def poll():
+            during()
+
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return 0
+
+            with open(output, "a") as f:
+                f.write(chunk)
+
+        proc = MagicMock()
+        proc.poll.side_effect = poll
+
+        return proc
+
+    def test_tail_amass_json(self):
+        self.scan.results_subfolder.mkdir()
+        lines = amass_json.read_text().splitlines(keepends=True)
+
+        proc = self.fake_amass(["", lines[0] + lines[1][:20], lines[1][20:], "", lines[2], lines[3].rstrip("\n")])
+        results = list(tail_amass_json(self.scan.output().path, proc, poll_interval=0))
+
+        assert [[x.get("name") for x in entries] for entries in results] == [
+            ["bitdiscovery.com"],
+            ["staging.bitdiscovery.com"],
+            [],
+            [json.loads(lines[2]).get("name")],
+            [],
+            [json.loads(lines[3]).get("name")],
+        ]
+
+    def test_tail_amass_json_truncated(self, caplog):
+        self.scan.results_subfolder.mkdir()
+        proc = self.fake_amass([amass_json.read_text().splitlines(keepends=True)[0], '{"name": "trunc'])
+
+        results = list(tail_amass_json(self.scan.output().path, proc, poll_interval=0))
+
+        assert sum(len(x) for x in results) == 1
+        assert "Skipping truncated amass entry" in caplog.text
+
+    def test_scan_run_streams_results(self):
+        lines = amass_json.read_text().splitlines(keepends=True)
+        seen = list()
+
+        def during():
+            # what another task would find in the database while amass is running
+            db_mgr = pipeline.models.db_manager.DBManager(db_location=self.tmp_path / "testing.sqlite")
+            seen.append(set(db_mgr.get_all_hostnames()))
+            db_mgr.close()
+
+        self.scan.db_mgr.get_all_hostnames = MagicMock(return_value=["bitdiscovery.com"])
+
+        with patch("pipeline.recon.amass.subprocess.Popen") as mocked_popen, patch("time.sleep"):
+            mocked_popen.return_value.__enter__.return_value = self.fake_amass(
+                [lines[0], "", "", "".join(lines[1:])], during
+            )
+            self.scan.run()
+
+        assert seen[2] == set()
+        assert seen[3] == {"bitdiscovery.com"}  # committed as soon as amass went quiet
+
+        parse = ParseAmassOutput(
+            target_file=__file__, results_dir=str(self.tmp_path), db_location=str(self.tmp_path / "testing.sqlite")
+        )
+        parse.input = lambda: self.scan.output()
+
+        with patch("pipeline.recon.amass.add_amass_entries") as mocked_add:
+            parse.run()
+            assert not mocked_add.called  # AmassScan already added everything
+
+        assert parse.output().exists()
+        assert len(parse.db_mgr.get_all_hostnames()) == len(lines)
 
     def test_scan_creates_database(self):
         assert self.scan.db_mgr.location.exists()
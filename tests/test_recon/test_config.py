@@ -15,7 +15,18 @@ def test_defaults_dirs_absolute(test_input):
     assert Path(defaults.get(test_input)).is_absolute()
 
 
-@pytest.mark.parametrize("test_input", ["threads", "masscan-rate", "aquatone-scan-timeout"])
+@pytest.mark.parametrize(
+    "test_input",
+    [
+        "threads",
+        "masscan-rate",
+        "masscan-batch-size",
+        "masscan-batch-interval",
+        "nmap-hosts-per-scan",
+        "nmap-ports-per-scan",
+        "aquatone-scan-timeout",
+    ],
+)
 def test_defaults_are_numeric(test_input):
     assert defaults.get(test_input).isnumeric()
 
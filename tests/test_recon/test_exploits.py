@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import luigi
+
+from pipeline.models.db_manager import DBManager
+from pipeline.recon import ThreadedNmapScan, SearchsploitScan
+from pipeline.recon.exploits import ExploitIndex, get_search_terms
+
+nmap_results = Path(__file__).parent.parent / "data" / "recon-results" / "nmap-results"
+
+EXPLOITS = """id,file,description,date,author,type,platform,port
+1,exploits/linux/remote/1.c,"nginx 1.16.1 - Remote Code Execution",2020-01-01,a,remote,linux,80
+2,exploits/php/webapps/2.md,"PHP-FPM + Nginx - Remote Code Execution",2019-10-28,b,webapps,php,
+3,exploits/linux/dos/3.py,"Nginx 1.4.0 (Generic Linux x64) - Denial of Service",2013-01-01,c,dos,linux,
+4,exploits/windows/remote/4.txt,"Microsoft IIS 10.0 - Buffer Overflow",2018-01-01,d,remote,windows,
+"""
+
+
+class TestExploitIndex:
+    def setup_method(self):
+        self.tmp_path = Path(tempfile.mkdtemp())
+        self.csv_path = self.tmp_path / "exploitdb" / "files_exploits.csv"
+        self.cache_path = self.tmp_path / ".exploit-index.pkl"
+        self.csv_path.parent.mkdir()
+        self.csv_path.write_text(EXPLOITS)
+
+    def teardown_method(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_get_search_terms(self):
+        assert get_search_terms("http", "nginx", "1.16.1") == "nginx 1.16.1"
+        assert get_search_terms("http", "Nginx", None) == "nginx"
+        assert get_search_terms("ssh", None, "7.4") == "ssh 7.4"
+        assert get_search_terms("ssh", None, None) == "ssh"
+        assert get_search_terms(None, None, None) == ""
+
+    def test_search_matches_every_term_in_title(self):
+        index = ExploitIndex.from_csv(self.csv_path)
+
+        assert [x[1] for x in index.search("NGINX remote")] == [
+            "nginx 1.16.1 - Remote Code Execution",
+            "PHP-FPM + Nginx - Remote Code Execution",
+        ]
+        assert index.search("nginx 1.16.1") == [
+            ("remote", "nginx 1.16.1 - Remote Code Execution", str(self.csv_path.parent / "exploits/linux/remote/1.c"))
+        ]
+
+    def test_search_drops_terms_until_match(self):
+        index = ExploitIndex.from_csv(self.csv_path)
+
+        assert len(index.search_service("http", "nginx", "1.17.0")) == 3
+        assert [x[1] for x in index.search_service("http", "Microsoft IIS httpd", "10.0")] == [
+            "Microsoft IIS 10.0 - Buffer Overflow"
+        ]
+        assert index.search_service("ssh", "OpenSSH", "7.4") == []
+        assert index.search("") == []
+
+    def test_load_reuses_cache_until_csv_changes(self):
+        index = ExploitIndex.load(self.csv_path, self.cache_path)
+
+        assert self.cache_path.exists()
+
+        with patch.object(ExploitIndex, "from_csv") as mocked_from_csv:
+            assert ExploitIndex.load(self.csv_path, self.cache_path).exploits == index.exploits
+            assert not mocked_from_csv.called
+
+        self.csv_path.write_text(EXPLOITS + '5,exploits/multiple/5.txt,"nginx - Cache Poisoning",,e,webapps,,\n')
+        os.utime(self.csv_path, ns=(0, 0))
+
+        assert len(ExploitIndex.load(self.csv_path, self.cache_path).exploits) == 5
+        assert len(ExploitIndex.load(self.csv_path, self.cache_path).exploits) == 5
+
+    def test_load_rebuilds_unreadable_cache(self):
+        self.cache_path.write_bytes(b"not a pickle")
+
+        assert len(ExploitIndex.load(self.csv_path, self.cache_path).exploits) == 4
+
+    def test_scan_run_uses_index(self):
+        lcl_nmap = self.tmp_path / "nmap-results"
+        lcl_nmap.mkdir()
+        shutil.copy(nmap_results / "nmap.13.56.144.135-tcp.xml", lcl_nmap)
+
+        db_location = str(self.tmp_path / "testing.sqlite")
+        ThreadedNmapScan(
+            target_file=__file__, results_dir=str(self.tmp_path), db_location=db_location
+        ).parse_nmap_output()
+
+        scan = SearchsploitScan(target_file=__file__, results_dir=str(self.tmp_path), db_location=db_location)
+        scan.input = lambda: {"localtarget": luigi.LocalTarget(lcl_nmap)}
+
+        with patch("pipeline.recon.nmap.subprocess.Popen") as mocked_popen:
+            with patch("pipeline.recon.nmap.get_exploitdb_csv", return_value=self.csv_path):
+                with patch("pipeline.recon.exploits.defaults", {"tools-dir": str(self.tmp_path)}):
+                    scan.run()
+
+        assert not mocked_popen.called
+        assert self.cache_path.exists()
+
+        results = DBManager(db_location=db_location).get_all_searchsploit_results()
+
+        assert [x.title for x in results] == ["nginx 1.16.1 - Remote Code Execution"]
+        assert len(results[0].targets) == 1
+        assert scan.output().exists()
@@ -1,17 +1,28 @@
+import struct
 import shutil
+import logging
 import tempfile
+import threading
 from pathlib import Path
 from unittest.mock import patch
 
 import luigi
 
-from pipeline.recon import MasscanScan, ParseMasscanOutput
+import pipeline.models.db_manager
+from pipeline.recon import MasscanScan, ParseMasscanOutput, TargetList, ParseAmassOutput
+from pipeline.recon.masscan import read_masscan, MasscanRecord, BINARY_HEADER_SIZE, AddressHandoff
 
 masscan_results = Path(__file__).parent.parent / "data" / "recon-results" / "masscan-results" / "masscan.json"
+banner_results = Path(__file__).parent.parent / "data" / "tesla-results" / "masscan-results" / "masscan.json"
+
+
+def binary_record(record_type, body):
+    """ masscan -oB framing: type byte, 7-bit length bytes, body """
+    length = bytes([len(body)]) if len(body) < 0x80 else bytes([0x80 | len(body) >> 7, len(body) & 0x7F])
+    return bytes([record_type]) + length + body
 
 
 class TestMasscanScan:
-    # can't test run method due to yields from TargetList and ParseAmassOutput
     def setup_method(self):
         self.tmp_path = Path(tempfile.mkdtemp())
         self.scan = MasscanScan(
@@ -31,6 +42,99 @@ class TestMasscanScan:
     def test_scan_output_location(self):
         assert self.scan.output().path == str(self.scan.results_subfolder / "masscan.json")
 
+    def test_address_handoff(self):
+        self.scan.results_subfolder.mkdir()
+        swept_file = self.scan.results_subfolder / "swept-ips.txt"
+        self.scan.db_mgr.bulk_add_ip_addresses([("a.example.com", "10.0.0.1"), ("b.example.com", "10.0.0.2")])
+
+        handoff = AddressHandoff(self.scan.db_mgr, swept_file, batch_size=3, batch_interval=3600)
+
+        assert handoff.next_batch() == []  # still coalescing
+        assert handoff.next_batch(final=True) == ["10.0.0.1", "10.0.0.2"]
+
+        handoff.mark_swept(["10.0.0.1", "10.0.0.2"])
+        self.scan.db_mgr.bulk_add_ip_addresses(
+            [("a.example.com", "10.0.0.1"), ("c.example.com", "10.0.0.3"), ("c.example.com", "::1")]
+        )
+
+        assert handoff.next_batch(final=True) == ["10.0.0.3"]
+
+        # a restarted scan only sweeps what hadn't been swept
+        handoff = AddressHandoff(self.scan.db_mgr, swept_file, batch_size=1, batch_interval=3600)
+        self.scan.db_mgr.bulk_add_ip_addresses([("d.example.com", "10.0.0.4"), ("e.example.com", "10.0.0.5")])
+
+        assert handoff.next_batch() == ["10.0.0.3"]
+        assert handoff.next_batch(final=True) == ["10.0.0.4", "10.0.0.5"]  # everything that's left, not a batch_size
+        assert handoff.next_batch(final=True) == []
+
+    def fake_masscan(self, command, **kwargs):
+        """ stands in for masscan, reporting port 80 open on every address it's given """
+        ip_addresses = Path(command[command.index("-iL") + 1]).read_text().split()
+        records = ",\n".join(
+            f'{{"ip": "{ip}", "ports": [{{"port": 80, "proto": "tcp", "status": "open", "ttl": 63}}]}}'
+            for ip in ip_addresses
+        )
+
+        Path(command[command.index("-oJ") + 1]).write_text(f"[\n{records}\n]\n")
+        self.swept.set()
+
+    def fake_amass(self, db_mgr, hostnames, output_path, exempt_list):
+        """ stands in for a long running amass; the second address is only resolved after masscan swept the first """
+        assert hostnames == ["example.com"]
+        db_mgr = pipeline.models.db_manager.DBManager(db_location=self.tmp_path / "testing.sqlite")
+        db_mgr.bulk_add_ip_addresses([("a.example.com", "10.0.0.1")])
+
+        self.pipelined = self.swept.wait(timeout=10)
+
+        db_mgr.bulk_add_ip_addresses([("b.example.com", "10.0.0.2"), ("a.example.com", "10.0.0.1")])
+
+    def test_scan_run_pipelines_amass(self):
+        self.swept = threading.Event()
+        self.scan.ports = "80"
+        self.scan.db_mgr.bulk_get_or_create_targets(["example.com"])
+
+        with patch("pipeline.recon.masscan.subprocess.run", side_effect=self.fake_masscan) as mocked_run, patch(
+            "pipeline.recon.masscan.run_amass", side_effect=self.fake_amass
+        ) as mocked_amass, patch("pipeline.recon.masscan.POLL_INTERVAL", 0), patch.dict(
+            "pipeline.recon.config.defaults", {"masscan-batch-interval": "0.001"}
+        ):
+            run = self.scan.run()
+
+            assert isinstance(next(run), TargetList)
+            assert isinstance(next(run), ParseAmassOutput)
+            assert list(run) == []
+
+        assert mocked_amass.call_count == 1
+        assert (self.tmp_path / "amass-results" / "amass.json").exists()  # AmassScan is complete, it won't run again
+        assert self.pipelined  # masscan was sweeping while amass was still running
+        assert mocked_run.call_count == 2
+        assert (self.scan.results_subfolder / "swept-ips.txt").read_text().split() == ["10.0.0.1", "10.0.0.2"]
+        assert [x.ip for x in read_masscan(self.scan.output().path)] == ["10.0.0.1", "10.0.0.2"]
+
+    def test_scan_run_keeps_earlier_batches(self):
+        self.swept = threading.Event()
+        self.scan.ports = "80"
+        self.scan.results_subfolder.mkdir()
+        self.scan.db_mgr.bulk_add_ip_addresses([("a.example.com", "10.0.0.1"), ("b.example.com", "10.0.0.2")])
+
+        # an interrupted run swept 10.0.0.1 into its second batch (its first batch file is gone), amass had finished
+        (self.tmp_path / "amass-results").mkdir()
+        (self.tmp_path / "amass-results" / "amass.json").touch()
+        (self.scan.results_subfolder / "swept-ips.txt").write_text("10.0.0.1\n")
+        (self.scan.results_subfolder / "masscan-batch-1.json").write_text(
+            '[\n{"ip": "10.0.0.1", "ports": [{"port": 80, "proto": "tcp", "status": "open", "ttl": 63}]}\n]\n'
+        )
+
+        with patch("pipeline.recon.masscan.subprocess.run", side_effect=self.fake_masscan) as mocked_run:
+            run = self.scan.run()
+
+            assert isinstance(next(run), TargetList)
+            assert [type(x) for x in run] == [ParseAmassOutput]
+
+        assert mocked_run.call_count == 1
+        assert (self.scan.results_subfolder / "masscan-batch-2.json").exists()
+        assert [x.ip for x in read_masscan(self.scan.output().path)] == ["10.0.0.1", "10.0.0.2"]
+
 
 class TestParseMasscanOutput:
     def setup_method(self):
@@ -62,3 +166,92 @@ class TestParseMasscanOutput:
         with patch("pipeline.recon.MasscanScan"):
             retval = self.scan.requires()
             assert isinstance(retval, MasscanScan)
+
+
+class TestReadMasscan:
+    def setup_method(self):
+        self.tmp_path = Path(tempfile.mkdtemp())
+
+    def teardown_method(self):
+        shutil.rmtree(self.tmp_path)
+
+    def write(self, data):
+        path = self.tmp_path / "masscan-output"
+        path.write_bytes(data) if isinstance(data, bytes) else path.write_text(data)
+        return path
+
+    def test_read_json(self):
+        records = list(read_masscan(masscan_results))
+
+        assert len(records) == masscan_results.read_text().count('"port"')
+        assert records[0] == MasscanRecord("13.226.191.66", "tcp", 443, 235, None)
+
+    def test_read_json_banners(self):
+        records = list(read_masscan(banner_results))
+
+        assert [x.banner for x in records if x.banner][0].startswith("TLS/1.1 cipher:0xc013")
+
+    def test_read_json_skips_closed_ports(self):
+        path = self.write(
+            '[{"ip": "10.0.0.1", "ports": [{"port": 22, "proto": "tcp", "status": "closed", "ttl": 64}]},\n'
+            '{"ip": "10.0.0.1", "ports": [{"port": 80, "proto": "tcp", "status": "open", "ttl": 64}]}\n]\n'
+        )
+        assert list(read_masscan(path)) == [MasscanRecord("10.0.0.1", "tcp", 80, 64, None)]
+
+    def test_read_json_truncated(self, caplog):
+        # interrupted scans leave a trailing comma and a partial record behind
+        text = masscan_results.read_text()
+        path = self.write(text[: text.rindex("{") + 40])
+
+        with caplog.at_level(logging.WARNING):
+            records = list(read_masscan(path))
+
+        assert records == list(read_masscan(masscan_results))[:-1]
+        assert "truncated" in caplog.text
+
+    def test_read_json_across_reads(self, monkeypatch):
+        expected = list(read_masscan(banner_results))
+        monkeypatch.setattr("pipeline.recon.masscan.READ_SIZE", 7)
+        assert list(read_masscan(banner_results)) == expected
+
+    def test_read_list(self):
+        path = self.write(
+            "#masscan\n"
+            "open tcp 80 10.0.0.1 1586175011\n"
+            "banner tcp 80 10.0.0.1 1586175012 http HTTP/1.0 200 OK\n"
+            "# end\n"
+            "open udp 5"
+        )
+        assert list(read_masscan(path)) == [
+            MasscanRecord("10.0.0.1", "tcp", 80, None, None),
+            MasscanRecord("10.0.0.1", "tcp", 80, None, "HTTP/1.0 200 OK"),
+        ]
+
+    def test_read_binary(self, caplog):
+        header = b"masscan/1.1\ns:1586175011\n".ljust(BINARY_HEADER_SIZE, b"\0")
+        banner = b"x" * 200  # two byte length
+        data = b"".join(
+            [
+                header,
+                binary_record(1, struct.pack(">I4sHBB", 1, bytes([10, 0, 0, 1]), 22, 2, 64)),
+                binary_record(2, struct.pack(">I4sHBB", 1, bytes([10, 0, 0, 1]), 23, 4, 64)),  # closed
+                binary_record(6, struct.pack(">I4sBHBB", 1, bytes([10, 0, 0, 2]), 17, 53, 0, 63)),
+                binary_record(9, struct.pack(">I4sBHHB", 1, bytes([10, 0, 0, 2]), 6, 80, 1, 63) + banner),
+                binary_record(10, struct.pack(">IBHBB16s", 1, 6, 443, 2, 50, bytes(15) + b"\x01")),
+                binary_record(13, struct.pack(">IBHHB16s", 1, 6, 443, 1, 50, bytes(15) + b"\x01") + b"ssh"),
+                header,
+                binary_record(1, struct.pack(">I4sHBB", 1, bytes([10, 0, 0, 3]), 25, 2, 64))[:-3],  # truncated
+            ]
+        )
+
+        with caplog.at_level(logging.WARNING):
+            records = list(read_masscan(self.write(data)))
+
+        assert records == [
+            MasscanRecord("10.0.0.1", "tcp", 22, 64, None),
+            MasscanRecord("10.0.0.2", "udp", 53, 63, None),
+            MasscanRecord("10.0.0.2", "tcp", 80, 63, "x" * 200),
+            MasscanRecord("::1", "tcp", 443, 50, None),
+            MasscanRecord("::1", "tcp", 443, 50, "ssh"),
+        ]
+        assert "truncated" in caplog.text
@@ -1,13 +1,21 @@
 import shutil
+import sqlite3
 import tempfile
 from pathlib import Path
+from xml.etree import ElementTree
 from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
 
 import luigi
 import pytest
+from libnmap.parser import NmapParser
 from luigi.contrib.sqla import SQLAlchemyTarget
 
+from pipeline.models.db_manager import DBManager
+
 from pipeline.recon import ThreadedNmapScan, SearchsploitScan, ParseMasscanOutput, config
+from pipeline.recon.nmap import parse_nmap_xml, read_nmap_xml, get_nmap_commandline, read_searchsploit_json
+from pipeline.recon.nmap import NmapService, NSEScript, NmapJob, NmapScheduler, plan_nmap_jobs
 
 nmap_results = Path(__file__).parent.parent / "data" / "recon-results" / "nmap-results"
 
@@ -28,17 +36,220 @@ class TestThreadedNmapScan:
             assert isinstance(retval, ParseMasscanOutput)
 
     def test_scan_run(self):
-        with patch("concurrent.futures.ThreadPoolExecutor.map") as mocked_run:
+        with patch("pipeline.recon.nmap.subprocess.run") as mocked_run:
             self.scan.parse_nmap_output = MagicMock()
-            self.scan.db_mgr.get_all_targets = MagicMock()
-            self.scan.db_mgr.get_all_targets.return_value = ["13.56.144.135", "2606:4700:10::6814:3c33"]
-            self.scan.db_mgr.get_ports_by_ip_or_host_and_protocol = MagicMock()
-            self.scan.db_mgr.get_ports_by_ip_or_host_and_protocol.return_value = ["135", "80"]
+            self.scan.db_mgr.bulk_add_ports(
+                (ip, protocol, port)
+                for ip in ["13.56.144.135", "2606:4700:10::6814:3c33"]
+                for protocol in ("tcp", "udp")
+                for port in (135, 80)
+            )
 
             self.scan.run()
-            assert mocked_run.called
+            assert mocked_run.call_count == 4
+            assert sum("-6" in x[0][0] for x in mocked_run.call_args_list) == 2
             assert self.scan.parse_nmap_output.called
 
+    def test_get_hosts_and_ports_dedupes_addresses(self):
+        self.scan.db_mgr.bulk_add_ports([("google.com", "tcp", 443), ("unresolved.com", "tcp", 80)])
+        self.scan.db_mgr.bulk_add_ip_addresses([("google.com", "172.217.1.46"), ("google.com", "172.217.1.47")])
+
+        assert sorted(self.scan.get_hosts_and_ports()) == [
+            ("172.217.1.46", "tcp", ["443"]),
+            ("172.217.1.47", "tcp", ["443"]),
+            ("unresolved.com", "tcp", ["80"]),
+        ]
+
+    def fake_nmap(self, command):
+        """ write the fixture's xml where nmap -oA would have; udp scans find nothing """
+        if "-sT" not in command:
+            return
+
+        if "-iL" not in command:
+            return shutil.copy(nmap_results / f"nmap.{command[-1]}-tcp.xml", f"{command[-2]}.xml")
+
+        # several hosts: the first host's results, followed by the other hosts'
+        hosts = Path(command[-1]).read_text().split()
+        tree = ElementTree.parse(nmap_results / f"nmap.{hosts[0]}-tcp.xml")
+        tree.getroot().set("args", " ".join(command))
+
+        for host in hosts[1:]:
+            for element in ElementTree.parse(nmap_results / f"nmap.{host}-tcp.xml").getroot().iter("host"):
+                tree.getroot().append(element)
+
+        tree.write(f"{command[command.index('-oA') + 1]}.xml")
+
+    def add_open_ports(self, ip_addresses):
+        self.scan.db_mgr.bulk_add_ports(
+            (ip, protocol, port) for ip in ip_addresses for protocol in ("tcp", "udp") for port in (443, 80)
+        )
+
+    def test_scan_run_ingests_each_scan_as_it_completes(self):
+        self.scan.parse_workers = "1"
+        self.add_open_ports(["13.56.144.135", "104.20.60.51"])
+        ingested = list()
+
+        def ingest_nmap_file(path, *args, **kwargs):
+            # the earlier scan's results are committed before the next one's are added
+            ingested.append(
+                (path.name, set(DBManager(db_location=self.tmp_path / "testing.sqlite").get_ingested_files()))
+            )
+            original(path, *args, **kwargs)
+
+        original, self.scan.ingest_nmap_file = self.scan.ingest_nmap_file, ingest_nmap_file
+
+        with patch("pipeline.recon.nmap.subprocess.run", side_effect=self.fake_nmap) as mocked_run, patch.dict(
+            "pipeline.recon.config.defaults", {"nmap-hosts-per-scan": "1"}
+        ):
+            self.scan.run()
+
+        assert mocked_run.call_count == 4
+        assert sorted(x[0] for x in ingested) == ["nmap.104.20.60.51-tcp.xml", "nmap.13.56.144.135-tcp.xml"]
+        assert len(ingested[1][1]) == 1
+
+        db_mgr = DBManager(db_location=self.tmp_path / "testing.sqlite")
+        assert {x.host for x in db_mgr.get_nmap_scans()} == {"13.56.144.135", "104.20.60.51"}
+        assert len(db_mgr.get_ingested_files()) == 2
+
+        with patch("pipeline.recon.nmap.subprocess.run", side_effect=self.fake_nmap) as mocked_run, patch.dict(
+            "pipeline.recon.config.defaults", {"nmap-hosts-per-scan": "1"}
+        ):
+            self.scan.run()
+
+        # a restart only runs the scans that didn't leave ingested results behind
+        assert mocked_run.call_count == 2
+        assert all("-sU" in x[0][0] for x in mocked_run.call_args_list)
+
+    def test_scan_run_packs_hosts(self):
+        self.scan.parse_workers = "1"
+        self.add_open_ports(["13.56.144.135", "104.20.60.51"])
+
+        with patch("pipeline.recon.nmap.subprocess.run", side_effect=self.fake_nmap) as mocked_run:
+            self.scan.run()
+
+        assert mocked_run.call_count == 2  # one scan per protocol
+        assert all("-iL" in x[0][0] for x in mocked_run.call_args_list)
+        assert not list(self.scan.results_subfolder.glob("*.hosts"))
+
+        db_mgr = DBManager(db_location=self.tmp_path / "testing.sqlite")
+        assert {x.host for x in db_mgr.get_nmap_scans()} == {"13.56.144.135", "104.20.60.51"}
+
+        path = next(self.scan.results_subfolder.glob("nmap.group-*-tcp.xml"))
+        assert SearchsploitScan.get_hosts(path) == {"13.56.144.135", "104.20.60.51"}
+        assert SearchsploitScan.get_hosts(nmap_results / "nmap.13.56.144.135-tcp.xml") == {"13.56.144.135"}
+
+    def test_scan_run_holds_no_lock_while_nmap_runs(self):
+        self.scan.parse_workers = "1"
+        self.add_open_ports(["13.56.144.135", "104.20.60.51"])
+        written = list()
+
+        def fake_nmap(command):
+            # another process writing while nmap runs doesn't have to wait for the write lock
+            with sqlite3.connect(str(self.tmp_path / "testing.sqlite"), timeout=0.1) as conn:
+                conn.execute(
+                    "INSERT INTO target (hostname) VALUES (?)", (Path(command[command.index("-oA") + 1]).name,)
+                )
+            written.append(command)
+            self.fake_nmap(command)
+
+        with patch("pipeline.recon.nmap.subprocess.run", side_effect=fake_nmap):
+            self.scan.run()
+
+        assert len(written) == 2
+        db_mgr = DBManager(db_location=self.tmp_path / "testing.sqlite")
+        assert {x.host for x in db_mgr.get_nmap_scans()} == {"13.56.144.135", "104.20.60.51"}
+
+    def test_plan_nmap_jobs(self):
+        hosts = [
+            ("10.0.0.1", "tcp", ["443", "80"]),
+            ("10.0.0.2", "tcp", ["80", "443"]),
+            ("10.0.0.3", "tcp", ["80", "443"]),
+            ("10.0.0.1", "udp", ["53"]),
+            ("::1", "tcp", ["80", "443"]),
+            ("example.com", "tcp", ["80", "443"]),
+            ("10.0.0.4", "tcp", [str(x) for x in range(1, 6)]),
+        ]
+
+        jobs = plan_nmap_jobs(hosts, hosts_per_scan=2, ports_per_scan=4)
+
+        assert [(x.hosts, x.ports) for x in jobs] == [
+            (("10.0.0.4",), ("1", "2", "3", "4")),  # largest first
+            (("10.0.0.1", "10.0.0.2"), ("80", "443")),
+            (("example.com",), ("80", "443")),
+            (("10.0.0.3",), ("80", "443")),
+            (("::1",), ("80", "443")),
+            (("10.0.0.4",), ("5",)),
+            (("10.0.0.1",), ("53",)),
+        ]
+        assert [x.name for x in jobs if len(x.hosts) == 1 and x.hosts[0] in ("10.0.0.4", "10.0.0.3")] == [
+            "nmap.10.0.0.4-tcp.part0",
+            "nmap.10.0.0.3-tcp",
+            "nmap.10.0.0.4-tcp.part1",
+        ]
+        assert jobs[1].name.startswith("nmap.group-") and jobs[1].name.endswith("-tcp")
+        assert [x.ipv6 for x in jobs] == [False, False, False, False, True, False, False]
+        assert plan_nmap_jobs(hosts, hosts_per_scan=2, ports_per_scan=4) == jobs  # restarts see the same names
+
+    def test_nmap_scheduler_adapts_workers(self):
+        scheduler = NmapScheduler(max_workers=4, load_limit=1)
+        job = NmapJob("nmap.10.0.0.1-tcp", "tcp", False, ("10.0.0.1",), ("80", "443"))
+
+        with patch.object(NmapScheduler, "get_load", return_value=0.5):
+            scheduler.record(job, 2)
+            assert scheduler.workers == 4
+
+            scheduler.record(job, 10)  # more than twice the median time per port
+            assert scheduler.workers == 3
+
+            scheduler.record(job, 2)
+            assert scheduler.workers == 4
+
+        with patch.object(NmapScheduler, "get_load", return_value=2):
+            scheduler.record(job, 2)
+            scheduler.record(job, 2)
+            assert scheduler.workers == 2
+
+    def test_nmap_scheduler_limits_running_scans(self):
+        scheduler = NmapScheduler(max_workers=3)
+        scheduler.workers = 1
+        jobs = [NmapJob(f"nmap.10.0.0.{i}-tcp", "tcp", False, (f"10.0.0.{i}",), ("80",)) for i in range(5)]
+        running, most = set(), list()
+
+        def scan(job):
+            running.add(job)
+            most.append(len(running))
+            running.discard(job)
+            return job.name
+
+        with patch.object(NmapScheduler, "get_load", return_value=10):
+            results = list(scheduler.run(scan, jobs))
+
+        assert sorted(results) == sorted(x.name for x in jobs)
+        assert max(most) == 1
+
+    def test_parse_nmap_output_only_parses_new_or_changed_files(self):
+        self.scan.parse_workers = "1"
+        self.scan.results_subfolder.mkdir(parents=True, exist_ok=True)
+        shutil.copy(nmap_results / "nmap.13.56.144.135-tcp.xml", self.scan.results_subfolder)
+        shutil.copy(nmap_results / "nmap.104.20.60.51-tcp.xml", self.scan.results_subfolder)
+
+        with patch("pipeline.recon.nmap.parse_nmap_xml", side_effect=parse_nmap_xml) as mocked_parse:
+            self.scan.parse_nmap_output()
+            assert mocked_parse.call_count == 2
+
+            self.scan.parse_nmap_output()
+            assert mocked_parse.call_count == 2
+
+            changed = self.scan.results_subfolder / "nmap.104.20.60.51-tcp.xml"
+            changed.write_text(changed.read_text().replace("cloudflare", "nginx"))
+
+            self.scan.parse_nmap_output()
+            assert mocked_parse.call_count == 3
+            assert mocked_parse.call_args[0][0] == changed
+
+        db_mgr = DBManager(db_location=self.tmp_path / "testing.sqlite")
+        assert {x.product for x in db_mgr.get_nmap_scans(ip_or_host="104.20.60.51")} == {"nginx"}
+
     def test_scan_run_with_wrong_threads(self, caplog):
         with patch("concurrent.futures.ThreadPoolExecutor.map"):
             self.scan.threads = "a"
@@ -46,6 +257,92 @@ class TestThreadedNmapScan:
             assert retval is None
             assert "The value supplied to --threads must be a non-negative integer" in caplog.text
 
+    def test_scan_run_with_wrong_parse_workers(self, caplog):
+        with patch("concurrent.futures.ThreadPoolExecutor.map"):
+            self.scan.parse_workers = "a"
+            retval = self.scan.run()
+            assert retval is None
+            assert "The value supplied to --parse-workers must be a non-negative integer" in caplog.text
+
+    def test_parse_nmap_xml(self):
+        commandline, services = parse_nmap_xml(nmap_results / "nmap.13.56.144.135-tcp.xml")
+
+        assert commandline.startswith("nmap --open -sT")
+        assert services[0] == NmapService(
+            "13.56.144.135",
+            "tcp",
+            80,
+            True,
+            "syn-ack",
+            "http",
+            "nginx",
+            "1.16.1",
+            (
+                ("http-server-header", "nginx/1.16.1"),
+                ("http-title", "Did not follow redirect to https://13.56.144.135/"),
+            ),
+        )
+        assert {x.port for x in services} == {80, 443}
+
+    def test_read_nmap_xml_elements(self):
+        services = list(read_nmap_xml(nmap_results / "nmap.13.56.144.135-tcp.xml", elements=True))
+
+        assert services[0].scripts == (
+            NSEScript("http-server-header", "nginx/1.16.1", {None: "nginx/1.16.1"}),
+            NSEScript(
+                "http-title",
+                "Did not follow redirect to https://13.56.144.135/",
+                {"redirect_url": "https://13.56.144.135/"},
+            ),
+        )
+
+        ssl_cert = [x for x in services[1].scripts if x.id == "ssl-cert"][0]
+        assert ssl_cert.elements.get("subject") == {"commonName": "bitdiscovery.com"}
+        assert len(ssl_cert.elements.get("extensions").get(None)) > 1
+
+    @pytest.mark.parametrize("entry", sorted(nmap_results.glob("nmap*.xml")), ids=lambda x: x.name)
+    def test_read_nmap_xml_matches_libnmap(self, entry):
+        report = NmapParser.parse_fromfile(str(entry))
+        expected = [
+            (
+                host.address,
+                service.protocol,
+                service.port,
+                service.open(),
+                service.reason,
+                service.service,
+                service.service_dict.get("product"),
+                service.service_dict.get("version"),
+                [(x.get("id"), x.get("output")) for x in service.scripts_results],
+            )
+            for host in report.hosts
+            for service in host.services
+        ]
+
+        assert get_nmap_commandline(entry) == report.commandline
+        assert [(*x[:8], list(x.scripts)) for x in read_nmap_xml(entry)] == expected
+
+    @pytest.mark.parametrize("parse_workers", ["1", "2"])
+    def test_parse_nmap_output_workers(self, parse_workers):
+        self.scan.results_subfolder.mkdir(parents=True, exist_ok=True)
+        for entry in nmap_results.glob("nmap*.xml"):
+            shutil.copy(entry, self.scan.results_subfolder)
+
+        self.scan.parse_workers = parse_workers
+        self.scan.parse_nmap_output()
+
+        db_mgr = DBManager(db_location=self.tmp_path / "testing.sqlite")
+        results = {
+            (x.ip_address.ipv4_address or x.ip_address.ipv6_address, x.port.port_number, x.product)
+            for x in db_mgr.get_nmap_scans()
+        }
+
+        assert results == {
+            (x.address, x.port, x.product) for entry in nmap_results.glob("nmap*.xml") for x in parse_nmap_xml(entry)[1]
+        }
+        assert ("13.56.144.135", 443, "nginx") in results
+        assert db_mgr.get_nse_results_by_script_id("ssl-cert")
+
     def test_parse_nmap_output(self):
         (self.tmp_path / "nmap-results").mkdir(parents=True, exist_ok=True)
         shutil.copy(nmap_results / "nmap.13.56.144.135-tcp.xml", self.scan.results_subfolder)
@@ -91,6 +388,103 @@ class TestSearchsploitScan:
         assert self.scan.db_mgr.location.exists()
         assert self.tmp_path / "testing.sqlite" == self.scan.db_mgr.location
 
+    def test_scan_skips_results_without_open_services(self):
+        lcl_nmap = self.tmp_path / "nmap-results"
+        lcl_nmap.mkdir(parents=True, exist_ok=True)
+        text = (nmap_results / "nmap.13.56.144.135-tcp.xml").read_text()
+        (lcl_nmap / "nmap.13.56.144.135-tcp.xml").write_text(text[: text.index("<ports>")] + "</host></nmaprun>")
+        (lcl_nmap / "nmap.13.56.144.136-tcp.xml").write_text(text[: text.index("<ports>")])
+
+        self.scan.input = lambda: {"localtarget": luigi.LocalTarget(lcl_nmap)}
+
+        with patch("pipeline.recon.nmap.subprocess.Popen") as mocked_popen:
+            with patch("pipeline.recon.nmap.get_exploitdb_csv", return_value=self.tmp_path / "missing.csv"):
+                self.scan.run()
+
+        assert not mocked_popen.called
+
+    def test_read_searchsploit_json(self, caplog):
+        lines = [
+            "{",
+            '\t"SEARCH": "nginx 1.16",',
+            '\t"RESULTS_EXPLOIT": [',
+            '\t\t{"Title":"PHP-FPM + Nginx - Remote Code Execution"","EDB-ID":"47553"","Date":"","Type":"webapps"",'
+            '"Path":"/opt/exploitdb/exploits/php/webapps/47553.md""},',
+            '\t\t{"Title":"Nginx \\"quoted\\" title","EDB-ID":"1","Date":"","Type":"remote","Path":"/1.c"}',
+            "\t],",
+            "[i] /usr/bin/searchsploit -t nginx 1.16",
+            '\t\t{"Title": truncated',
+        ]
+
+        assert list(read_searchsploit_json(lines)) == [
+            ("webapps", "PHP-FPM + Nginx - Remote Code Execution", "/opt/exploitdb/exploits/php/webapps/47553.md"),
+            ("remote", 'Nginx "quoted" title', "/1.c"),
+        ]
+        assert "Skipping unreadable searchsploit result" in caplog.text
+
+    def test_scan_run_adds_each_exploit_once(self):
+        lcl_nmap = self.tmp_path / "nmap-results"
+        lcl_nmap.mkdir(parents=True, exist_ok=True)
+        shutil.copy(nmap_results / "nmap.13.56.144.135-tcp.xml", lcl_nmap)
+        shutil.copy(nmap_results / "nmap.104.20.60.51-tcp.xml", lcl_nmap)
+
+        self.scan.input = lambda: {"localtarget": luigi.LocalTarget(lcl_nmap)}
+
+        output = [
+            '\t\t{"Title":"Nginx 1.1 - Remote Code Execution","EDB-ID":"1","Type":"remote","Path":"/opt/1.c"},\n',
+            '\t\t{"Title":"Nginx 1.2 - Denial of Service","EDB-ID":"2","Type":"dos","Path":"/opt/2.c"}\n',
+        ]
+
+        with patch("pipeline.recon.nmap.subprocess.Popen") as mocked_popen:
+            mocked_popen.return_value.__enter__.return_value.stdout = output * 3
+            with patch("pipeline.recon.nmap.get_exploitdb_csv", return_value=self.tmp_path / "missing.csv"):
+                self.scan.run()
+
+        assert mocked_popen.call_count == 2
+
+        db_mgr = DBManager(db_location=self.tmp_path / "testing.sqlite")
+        results = db_mgr.get_all_searchsploit_results()
+
+        assert sorted(x.title for x in results) == [
+            "Nginx 1.1 - Remote Code Execution",
+            "Nginx 1.2 - Denial of Service",
+        ]
+        assert all(len(x.targets) == 2 for x in results)
+        assert self.scan.output().exists()
+
+    def test_scan_run_searchsploit_concurrently(self):
+        lcl_nmap = self.tmp_path / "nmap-results"
+        lcl_nmap.mkdir(parents=True, exist_ok=True)
+        shutil.copy(nmap_results / "nmap.13.56.144.135-tcp.xml", lcl_nmap)
+        shutil.copy(nmap_results / "nmap.104.20.60.51-tcp.xml", lcl_nmap)
+
+        self.scan.input = lambda: {"localtarget": luigi.LocalTarget(lcl_nmap)}
+        self.scan.threads = "2"
+
+        with patch("pipeline.recon.nmap.subprocess.Popen"):
+            with patch("pipeline.recon.nmap.concurrent.futures.ThreadPoolExecutor", wraps=ThreadPoolExecutor) as pool:
+                with patch("pipeline.recon.nmap.get_exploitdb_csv", return_value=self.tmp_path / "missing.csv"):
+                    self.scan.run()
+
+        pool.assert_called_once_with(max_workers=2)
+
+        timings = (self.tmp_path / "searchsploit-results" / "searchsploit-timings.tsv").read_text().splitlines()
+
+        assert timings[0] == "file\tseconds\tresults"
+        assert sorted(Path(x.split("\t")[0]).name for x in timings[1:]) == [
+            "nmap.104.20.60.51-tcp.xml",
+            "nmap.13.56.144.135-tcp.xml",
+        ]
+
+    def test_scan_run_bad_threads(self, caplog):
+        self.scan.threads = "a"
+
+        with patch("pipeline.recon.nmap.subprocess.Popen") as mocked_popen:
+            self.scan.run()
+
+        assert not mocked_popen.called
+        assert "The value supplied to --threads must be a non-negative integer." in caplog.text
+
     def test_scan_creates_results(self):
         lcl_nmap = self.tmp_path / "nmap-results"
         lcl_nmap.mkdir(parents=True, exist_ok=True)
@@ -104,6 +498,10 @@ class TestSearchsploitScan:
         if not Path(config.tool_paths.get("searchsploit")).exists():
             pytest.skip("exploit-db's searchsploit tool not installed")
 
+        ThreadedNmapScan(
+            target_file=__file__, results_dir=str(self.tmp_path), db_location=str(self.tmp_path / "testing.sqlite")
+        ).parse_nmap_output()
+
         self.scan.run()
 
         assert len(self.scan.db_mgr.get_all_searchsploit_results()) > 0
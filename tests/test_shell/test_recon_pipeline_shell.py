@@ -1,16 +1,19 @@
 import sys
 import time
 import shutil
+import tempfile
 import importlib
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 import pytest
+from sqlalchemy import event
 
 from pipeline.recon.config import defaults
 from pipeline.models.port_model import Port
 from pipeline.models.target_model import Target
 from pipeline.models.db_manager import DBManager
+from pipeline.models.blob_store import get_blob_store
 from pipeline.models.ip_address_model import IPAddress
 
 recon_shell = importlib.import_module("pipeline.recon-pipeline")
@@ -39,9 +42,16 @@ class TestReconShell:
         self.shell = recon_shell.ReconShell()
         self.shell.async_alert = print
         self.shell.poutput = print
-        self.db_location = Path(__file__).parent.parent / "data" / "recon-results" / "updated-tests"
+        # work on a copy; connecting switches the database to WAL mode, which would modify the committed fixture
+        self.tmp_path = Path(tempfile.mkdtemp())
+        self.db_location = self.tmp_path / "updated-tests"
+        shutil.copy(Path(__file__).parent.parent / "data" / "recon-results" / "updated-tests", self.db_location)
         self.realdb = DBManager(self.db_location)
 
+    def teardown_method(self):
+        self.realdb.close()
+        shutil.rmtree(self.tmp_path)
+
     def create_temp_target(self):
         tgt = Target(
             hostname="localhost",
@@ -102,6 +112,22 @@ class TestReconShell:
         except FileNotFoundError:
             pass
 
+    def test_get_databases_skips_sidecars(self):
+        testdb = Path(defaults.get("database-dir")) / "testdb7"
+        sidecars = [Path(f"{testdb}-wal"), Path(f"{testdb}-shm")]
+        blob_store = Path(f"{testdb}-blobs")
+        for file in [testdb] + sidecars:
+            file.touch()
+        blob_store.mkdir()
+        databases = list(recon_shell.ReconShell.get_databases())
+        try:
+            assert testdb in databases
+            assert not any(sidecar in databases for sidecar in sidecars + [blob_store])
+        finally:
+            for file in [testdb] + sidecars:
+                file.unlink()
+            blob_store.rmdir()
+
     def test_database_list_bad(self, capsys):
         def empty_gen():
             yield from ()
@@ -136,6 +162,8 @@ class TestReconShell:
         shell.database_attach("")
         time.sleep(1)
         assert "attached to sqlite database @" in capsys.readouterr().out
+        assert shell.db_mgr.read_only
+        shell.db_mgr.close()
         try:
             testdb.unlink()
         except FileNotFoundError:
@@ -167,6 +195,19 @@ class TestReconShell:
             raise AssertionError
         assert "[+] deleted sqlite database" in capsys.readouterr().out
 
+    def test_database_delete_removes_sidecars(self, capsys, tmp_path):
+        testdb = Path(tmp_path) / "testdb5"
+        sidecars = [Path(f"{testdb}-wal"), Path(f"{testdb}-shm")]
+        for file in [testdb] + sidecars:
+            file.touch()
+        get_blob_store(testdb).put(b"screenshot")
+        self.shell.select = lambda x: str(testdb.expanduser().resolve())
+        self.shell.get_databases = MagicMock(return_value=[str(testdb)])
+        self.shell.database_delete("")
+        assert not any(file.exists() for file in [testdb] + sidecars)
+        assert not get_blob_store(testdb).root.exists()
+        assert "[+] deleted sqlite database" in capsys.readouterr().out
+
     def test_database_delete_with_index(self, capsys):
         testdb = Path(defaults.get("database-dir")) / "testdb4"
         testdb.touch()
@@ -245,6 +286,9 @@ class TestReconShell:
             ("targets --vuln-to-subdomain-takeover --paged", ""),
             ("targets --type ipv4 --paged", "13.226.182.120"),
             ("targets --type ipv6", "2606:4700:10::6814:3c33"),
+            ("targets --cidr 13.226.191.0/24", "13.226.191.61\n13.226.191.66\n13.226.191.85\n13.226.191.103"),
+            ("targets --cidr 2606:4700:10::/48 --type ipv6", "2606:4700:10::6814:3c33\n2606:4700:10::6814:3d33"),
+            ("targets --cidr 13.226.191.0/33", "does not appear to be an IPv4 or IPv6 network"),
             ("targets --type domain-name --paged", "email.assetinventory.bugcrowd.com"),
             ("web-technologies", "CloudFlare (CDN)"),
             ("web-technologies --host blog.bitdiscovery.com --type CDN", "Amazon Cloudfront (CDN)"),
@@ -264,6 +308,46 @@ class TestReconShell:
             self.shell.do_view(test_input)
             assert expected in capsys.readouterr().out
 
+    def test_do_view_targets_cidr_type_mismatch(self, capsys):
+        self.shell.db_mgr = self.realdb
+        self.shell.add_dynamic_parser_arguments()
+
+        self.shell.do_view("targets --cidr 13.226.191.0/24 --type ipv6")
+        assert not capsys.readouterr().out
+
+    @pytest.mark.parametrize(
+        "test_input, max_queries",
+        [
+            ("ports", 5),
+            ("targets --vuln-to-subdomain-takeover", 4),
+            ("endpoints --headers", 2),
+            ("endpoints --host 52.8.186.88 --status-code 200 --headers", 2),
+            ("nmap-scans", 4),
+            ("nmap-scans --port 443 --nse-script http-title", 6),
+            ("web-technologies", 3),
+            ("searchsploit-results", 7),
+            ("searchsploit-results --host synopsys.bitdiscovery.com", 9),
+        ],
+    )
+    def test_do_view_query_count(self, test_input, max_queries):
+        statements = list()
+
+        self.shell.db_mgr = self.realdb
+        self.shell.add_dynamic_parser_arguments()
+        self.shell.poutput = self.shell.ppaged = MagicMock()
+        self.realdb.session.expunge_all()
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.realdb.engine, "before_cursor_execute", before_cursor_execute)
+        self.shell.do_view(test_input)
+        event.remove(self.realdb.engine, "before_cursor_execute", before_cursor_execute)
+
+        # a fixed number of statements regardless of row count; a lazy load per row would be dozens to hundreds
+        assert self.shell.poutput.called
+        assert len(statements) <= max_queries
+
     @pytest.mark.parametrize(
         "test_input, expected",
         [
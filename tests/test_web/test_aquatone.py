@@ -1,10 +1,18 @@
+import io
 import json
 import shutil
 import tempfile
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
+import pytest
+
+import pipeline.recon.web.aquatone
 from pipeline.recon.web import AquatoneScan, GatherWebTargets
+from pipeline.models.endpoint_model import Endpoint
+from pipeline.models.screenshot_model import Screenshot
+from pipeline.models.header_model import Header, header_association_table
+from pipeline.recon.web.aquatone import JsonStreamReader, read_aquatone_session
 
 aquatone_results = Path(__file__).parent.parent / "data" / "recon-results" / "aquatone-results"
 
@@ -51,6 +59,87 @@ class TestAquatoneScan:
         self.scan.parse_results()
         assert self.scan.output().exists()
 
+    def test_scan_stores_screenshots_in_blob_store(self):
+        shutil.copytree(aquatone_results, self.scan.results_subfolder)
+        self.scan.parse_results()
+
+        screenshots = self.scan.db_mgr.session.query(Screenshot).filter(Screenshot.digest != None).all()  # noqa: E711
+        assert screenshots
+
+        for screenshot in screenshots:
+            assert screenshot.digest in self.scan.db_mgr.blob_store
+            assert screenshot.size == len(screenshot.image)
+            assert screenshot.width and screenshot.height
+
+        blobs = [x for x in self.scan.db_mgr.blob_store.root.rglob("*") if x.is_file()]
+        assert len(blobs) == len({x.digest for x in screenshots})
+
+    def test_scan_clusters_similar_screenshots(self):
+        shutil.copytree(aquatone_results, self.scan.results_subfolder)
+        self.scan.parse_results()
+
+        results = json.loads((aquatone_results / "aquatone_session.json").read_text())
+        screenshots = {x.url: x for x in self.scan.db_mgr.session.query(Screenshot)}
+
+        assert set(screenshots) == {x.get("url") for x in results.get("pages").values() if x.get("hasScreenshot")}
+
+        for cluster_id, urls in results.get("pageSimilarityClusters").items():
+            members = [screenshots.get(url) for url in urls if url in screenshots]
+
+            for screenshot in members:
+                assert screenshot.cluster.uuid == cluster_id
+                assert sorted(x.url for x in screenshot.similar_pages) == sorted(
+                    x.url for x in members if x is not screenshot
+                )
+
+    def test_scan_keeps_headers_when_a_screenshot_fails(self):
+        shutil.copytree(aquatone_results, self.scan.results_subfolder)
+        results = json.loads((aquatone_results / "aquatone_session.json").read_text())
+        urls = [x.get("url") for x in results.get("pages").values() if x.get("hasScreenshot")]
+
+        # another process added the same screenshots in between get_or_create's query and its insert
+        self.scan.db_mgr.add_all([Screenshot(url=url) for url in urls])
+
+        with patch.object(
+            self.scan.db_mgr, "get_or_create", side_effect=lambda model, **kwargs: model(**kwargs)
+        ), patch.dict("pipeline.recon.config.defaults", {"database-batch-size": "2"}):
+            self.scan.parse_results()
+
+        header_ids = {x for x, in self.scan.db_mgr.session.query(Header.id)}
+        associated = {x for x, in self.scan.db_mgr.session.query(header_association_table.c.header_id)}
+
+        assert len(self.scan.db_mgr.session.query(Endpoint).all()) == len(results.get("pages"))
+        assert associated and associated <= header_ids  # no associations with headers that were rolled back
+
+    def test_read_aquatone_session(self, monkeypatch):
+        text = (aquatone_results / "aquatone_session.json").read_text()
+        results = json.loads(text)
+
+        monkeypatch.setattr(pipeline.recon.web.aquatone, "READ_SIZE", 7)
+
+        items = list(read_aquatone_session(io.StringIO(text)))
+
+        assert [x for kind, x in items if kind == "page"] == list(results.get("pages").values())
+        assert dict(x for kind, x in items if kind == "cluster") == results.get("pageSimilarityClusters")
+
+    def test_json_stream_reader(self, monkeypatch):
+        monkeypatch.setattr(pipeline.recon.web.aquatone, "READ_SIZE", 3)
+
+        reader = JsonStreamReader(io.StringIO(' { "a" : 12345 , "b": null, "c": {"d": [1, 2]}, "e": {} } '))
+        values = dict()
+
+        for key in reader.members():
+            values[key] = list(reader.members()) if key == "b" else reader.value()
+
+        assert values == {"a": 12345, "b": [], "c": {"d": [1, 2]}, "e": {}}
+        assert reader.peek() == ""
+
+    def test_read_truncated_aquatone_session(self):
+        text = (aquatone_results / "aquatone_session.json").read_text()
+
+        with pytest.raises(json.JSONDecodeError):
+            list(read_aquatone_session(io.StringIO(text[: len(text) // 2])))
+
     # pipeline/recon/web/aquatone.py                83     17    80%   69-79, 183-191, 236-260
     def test_scan_parse_results_with_bad_file(self, caplog):
         self.scan.results_subfolder = Path("/tmp")
@@ -3,7 +3,9 @@ import tempfile
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
+import pipeline.recon.web.gobuster
 from pipeline.recon.web import GobusterScan, GatherWebTargets
+from pipeline.recon.web.gobuster import read_gobuster_results
 
 gobuster_results = Path(__file__).parent.parent / "data" / "recon-results" / "gobuster-results"
 
@@ -74,3 +76,48 @@ class TestGobusterScan:
         self.scan.results_subfolder = gobuster_results
         self.scan.parse_results()
         assert self.scan.output().exists()
+
+    def test_read_gobuster_results(self, monkeypatch):
+        results = self.tmp_path / "gobuster.https_google.com.txt"
+        results.write_text(
+            "https://google.com/a (Status: 200)\n"
+            "https://google.com/b          (Status: 301) [Size: 0] [--> https://google.com/b/]\n"
+            "http://[::1]:8080/c (Status:403)\n"
+            "[ERROR] 2020/04/01 00:00:00 [!] Get https://google.com/d: timeout\n"
+            "/e (Status: 200)\n"
+            "\n"
+            "https://google.com/f"
+        )
+
+        expected = [
+            ("https://google.com/a", "200"),
+            ("https://google.com/b", "301"),
+            ("http://[::1]:8080/c", "403"),
+            ("https://google.com/f", ""),
+        ]
+
+        assert list(read_gobuster_results(results)) == expected
+
+        monkeypatch.setattr(pipeline.recon.web.gobuster, "READ_SIZE", 5)
+        assert list(read_gobuster_results(results)) == expected
+
+    def test_parse_results_resolves_each_url(self):
+        self.scan.results_subfolder.mkdir()
+        (self.scan.results_subfolder / "gobuster.https_google.com.txt").write_text(
+            "https://google.com/a (Status: 200)\nhttps://www.google.com/b (Status: 403)\n"
+        )
+        (self.scan.results_subfolder / "recursive-gobuster_google.com.log").write_text(
+            "https://google.com/a\nhttps://google.com/a/c\n"
+        )
+
+        self.scan.parse_results()
+
+        endpoints = {x.url: x for x in self.scan.db_mgr.get_all_endpoints()}
+
+        assert {x: y.status_code for x, y in endpoints.items()} == {
+            "https://google.com/a": 200,
+            "https://google.com/a/c": None,
+            "https://www.google.com/b": 403,
+        }
+        assert endpoints.get("https://www.google.com/b").target.hostname == "www.google.com"
+        assert endpoints.get("https://google.com/a/c").target.hostname == "google.com"
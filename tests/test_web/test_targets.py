@@ -4,7 +4,7 @@ from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 from pipeline.recon.web import GatherWebTargets
-from pipeline.recon import ParseMasscanOutput, ParseAmassOutput
+from pipeline.recon import ParseMasscanOutput, ThreadedNmapScan
 
 
 class TestGatherWebTargets:
@@ -18,10 +18,19 @@ class TestGatherWebTargets:
         shutil.rmtree(self.tmp_path)
 
     def test_scan_requires(self):
-        with patch("pipeline.recon.ParseMasscanOutput"), patch("pipeline.recon.ParseAmassOutput"):
+        with patch("pipeline.recon.ParseMasscanOutput"):
             retval = self.scan.requires()
             assert isinstance(retval.get("masscan-output"), ParseMasscanOutput)
-            assert isinstance(retval.get("amass-output"), ParseAmassOutput)
+            assert list(retval) == ["masscan-output"]  # amass is run by MasscanScan
+
+    def test_scan_shares_masscan_with_nmap(self):
+        # MasscanScan runs amass; web and nmap scans have to agree on which MasscanScan that is
+        args = {"target_file": __file__, "results_dir": str(self.tmp_path), "db_location": self.scan.db_location}
+        scan = GatherWebTargets(exempt_list="blacklist", **args)
+        nmap = ThreadedNmapScan(exempt_list="blacklist", **args)
+
+        assert scan.requires().get("masscan-output") == nmap.requires()
+        assert nmap.requires().requires().exempt_list == "blacklist"
 
     def test_scan_creates_database(self):
         assert self.scan.db_mgr.location.exists()
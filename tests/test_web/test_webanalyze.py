@@ -1,11 +1,12 @@
-import os
 import shutil
+import sqlite3
 import tempfile
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
-from pipeline.recon.config import tool_paths
+import pipeline.models.db_manager
 from pipeline.recon.web import WebanalyzeScan, GatherWebTargets
+from pipeline.recon.web.webanalyze import read_webanalyze_csv
 
 webanalyze_results = Path(__file__).parent.parent / "data" / "recon-results" / "webanalyze-results"
 
@@ -37,36 +38,119 @@ class TestWebanalyzeScan:
         self.scan.parse_results()
         assert self.scan.output().exists()
 
+    def test_read_webanalyze_csv(self):
+        results = self.tmp_path / "webanalyze-https_google.com.csv"
+        results.write_text(
+            "\nHost,Category,App,Version\n"
+            "https://google.com,CDN,CloudFlare,\n"
+            'https://google.com,"Web servers,Reverse proxies",Nginx,1.16.1\n'
+            "short,row\n"
+        )
+
+        with open(results, newline="") as f:
+            rows = list(read_webanalyze_csv(f))
+
+        assert rows == [
+            ("https://google.com", "CDN", "CloudFlare"),
+            ("https://google.com", "Web servers,Reverse proxies", "Nginx-1.16.1"),
+        ]
+
+    def test_parse_results_resolves_each_row(self):
+        self.scan.results_subfolder.mkdir()
+        (self.scan.results_subfolder / "webanalyze-https_google.com.csv").write_text(
+            "\nHost,Category,App,Version\n"
+            "https://google.com,CDN,CloudFlare,\n"
+            "https://www.google.com:8443,CDN,CloudFlare,\n"
+            "https://google.com,CDN,CloudFlare,\n"
+        )
+
+        self.scan.parse_results()
+        self.scan.parse_results()
+
+        technologies = self.scan.db_mgr.get_web_technologies()
+
+        assert [(x.type, x.text) for x in technologies] == [("CDN", "CloudFlare")]
+        assert sorted(x.hostname for x in technologies[0].targets) == ["google.com", "www.google.com"]
+        assert self.scan.output().exists()
+
+    def fake_webanalyze(self, command, **kwargs):
+        """ stands in for a webanalyze -hosts process, reporting CloudFlare on every host it's given """
+        hosts = Path(command[command.index("-hosts") + 1]).read_text().split()
+        self.shards.append((hosts, command[command.index("-worker") + 1]))
+
+        proc = MagicMock()
+        proc.__enter__.return_value.stdout = ["Host,Category,App,Version\n"] + [f"{x},CDN,CloudFlare,\n" for x in hosts]
+
+        return proc
+
     def test_scan_run(self):
-        with patch("concurrent.futures.ThreadPoolExecutor.map") as mocked_map, patch(
-            "subprocess.run"
-        ) as mocked_run, patch("pathlib.Path.cwd", return_value="/"):
-            self.scan.parse_results = MagicMock()
-            self.scan.db_mgr.get_all_web_targets = MagicMock()
-            self.scan.db_mgr.get_all_web_targets.return_value = [
-                "13.56.144.135",
-                "2606:4700:10::6814:3c33",
-                "google.com",
-            ]
+        self.shards = list()
+        self.scan.threads = "5"
+        self.scan.db_mgr.get_all_web_targets = MagicMock(
+            return_value=["13.56.144.135", "2606:4700:10::6814:3c33", "google.com"]
+        )
 
+        with patch("pipeline.recon.web.webanalyze.subprocess.Popen", side_effect=self.fake_webanalyze), patch(
+            "pipeline.recon.web.webanalyze.subprocess.run"
+        ) as mocked_run, patch("pipeline.recon.web.webanalyze.os.cpu_count", return_value=2):
             self.scan.run()
-            assert mocked_map.called
-            assert mocked_run.called
-            assert self.scan.parse_results.called
+
+        assert mocked_run.called  # apps.json is fetched when it's missing
+        assert [workers for _, workers in self.shards] == ["3", "3"]
+        assert sorted(x for hosts, _ in self.shards for x in hosts) == sorted(
+            f"{scheme}://{x}"
+            for x in ["13.56.144.135", "[2606:4700:10::6814:3c33]", "google.com"]
+            for scheme in ("http", "https")
+        )
+
+        assert sorted(x.name for x in self.scan.results_subfolder.iterdir()) == [
+            "webanalyze-shard-0.csv",
+            "webanalyze-shard-1.csv",
+        ]
+
+        db_mgr = pipeline.models.db_manager.DBManager(db_location=self.tmp_path / "testing.sqlite")
+        technologies = db_mgr.get_web_technologies()
+
+        assert [x.text for x in technologies] == ["CloudFlare"]
+        assert len(technologies[0].targets) == 3
+        assert self.scan.output().exists()
+
+    def test_scan_run_holds_no_lock_while_webanalyze_runs(self):
+        self.scan.db_mgr.get_all_web_targets = MagicMock(return_value=["google.com"])
+
+        def fake_webanalyze(command, **kwargs):
+            def stdout():
+                # another process writing while webanalyze runs doesn't have to wait for the write lock
+                with sqlite3.connect(str(self.tmp_path / "testing.sqlite"), timeout=0.1) as conn:
+                    conn.execute("INSERT INTO target (hostname) VALUES ('bing.com')")
+
+                yield "https://google.com,CDN,CloudFlare,\n"
+
+            proc = MagicMock()
+            proc.__enter__.return_value.stdout = stdout()
+
+            return proc
+
+        with patch("pipeline.recon.web.webanalyze.subprocess.Popen", side_effect=fake_webanalyze), patch(
+            "pipeline.recon.web.webanalyze.subprocess.run"
+        ):
+            self.scan.run()
+
+        assert [x.text for x in self.scan.db_mgr.get_web_technologies()] == ["CloudFlare"]
+
+    def test_scan_run_without_targets(self):
+        self.scan.db_mgr.get_all_web_targets = MagicMock(return_value=[])
+
+        with patch("pipeline.recon.web.webanalyze.subprocess.Popen") as mocked_popen, patch(
+            "pipeline.recon.web.webanalyze.subprocess.run"
+        ):
+            self.scan.run()
+
+        assert not mocked_popen.called
+        assert not self.scan.output().exists()
 
     def test_scan_run_with_wrong_threads(self, caplog):
         self.scan.threads = "a"
         retval = self.scan.run()
         assert retval is None
         assert "The value supplied to --threads must be a non-negative integer" in caplog.text
-
-    def test_wrapped_subprocess(self):
-        with patch("subprocess.run") as mocked_run:
-            self.scan.results_subfolder.mkdir()
-            os.chdir(self.scan.results_subfolder)
-            assert len([x for x in self.scan.results_subfolder.iterdir()]) == 0
-            cmd = [tool_paths.get("webanalyze"), "-host", "https://google.com", "-output", "csv"]
-            self.scan._wrapped_subprocess(cmd)
-            assert len([x for x in self.scan.results_subfolder.iterdir()]) == 1
-            assert next(self.scan.results_subfolder.iterdir()).name == "webanalyze-https_google.com.csv"
-            assert mocked_run.called